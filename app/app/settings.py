@@ -129,3 +129,94 @@ REST_FRAMEWORK = {
     'DEFAULT_SCHEMA_CLASS': 'drf_spectacular.openapi.AutoSchema',
 }
 
+# KPI evaluation
+# Maximum number of compiled KPI expressions kept in memory per process
+KPI_EXPRESSION_CACHE_SIZE = 1024
+# Fused programs (the KPI expressions of one asset compiled together) kept
+# per process
+KPI_PROGRAM_CACHE_SIZE = 1024
+
+# Evaluation backend: 'codegen' (native Python function) or 'interpreter'
+# (the reference AST visitor)
+KPI_EVALUATION_BACKEND = 'codegen'
+
+# Lexer: 'scan' (single-pass master regex) or 'chain' (handler chain)
+KPI_LEXER = 'scan'
+
+# Fold constants and drop identities from KPI expressions when compiling
+KPI_OPTIMIZE_EXPRESSIONS = True
+
+# Maximum number of distinct compiled Regex(...) patterns kept per process
+KPI_PATTERN_CACHE_SIZE = 4096
+
+# Maximum number of asset_id -> compiled KPI routes kept per process
+KPI_ROUTING_CACHE_SIZE = 10000
+# Poll a database version stamp so every worker process notices routing
+# changes made by the others, at most once per interval (seconds)
+KPI_ROUTING_VERSION_STAMP = False
+KPI_ROUTING_VERSION_CHECK_INTERVAL = 1.0
+
+# Assets whose latest referenced attribute values are kept per process
+KPI_ATTRIBUTE_STORE_SIZE = 10000
+
+# Window function states (per asset, KPI and series) kept per process, and
+# how often (seconds) the ones that changed are checkpointed to the database
+KPI_WINDOW_STATE_SIZE = 10000
+KPI_WINDOW_CHECKPOINT_INTERVAL = 10.0
+
+# Async evaluation endpoint: evaluations allowed in flight before answering
+# 503, and threads used to run expression evaluation off the event loop
+KPI_ASYNC_MAX_IN_FLIGHT = 256
+KPI_ASYNC_EVALUATION_WORKERS = 4
+
+# Messages evaluated and inserted together by the NDJSON stream endpoint
+KPI_NDJSON_CHUNK_SIZE = 500
+
+# Asset and attribute identifiers whose interned row ids are kept per process
+KPI_INTERNED_KEY_CACHE_SIZE = 100000
+
+# Per-stage latency histograms and per-KPI counters served at kpi/metrics/
+# in Prometheus text format; False turns every timing hook into a no-op
+KPI_METRICS_ENABLED = True
+
+# Archive every evaluated message as a Reading so KPIs can be re-evaluated
+# over history with `manage.py backfill_kpi`, and that command's defaults
+KPI_ARCHIVE_READINGS = False
+KPI_BACKFILL_WORKERS = 4
+KPI_BACKFILL_CHUNK_SIZE = 2000
+
+# Benchmark suite (manage.py benchmark): stored baseline results and the
+# slowdown (0.2 = 20%) past which a benchmark counts as a regression
+KPI_BENCHMARK_BASELINE = BASE_DIR / 'benchmark_baseline.json'
+KPI_BENCHMARK_THRESHOLD = 0.2
+
+# Write-behind buffering of evaluation results. DURABILITY 'flush'
+# answers once the results are written: requests arriving while a write
+# is in progress share the next bulk_create, but nothing waits for
+# MAX_ROWS or MAX_DELAY. 'enqueue' answers as soon as the results are
+# queued and writes them per MAX_ROWS rows or MAX_DELAY seconds (faster,
+# but results queued when the process dies are lost). At most CAPACITY
+# rows are held.
+KPI_WRITE_BEHIND = False
+KPI_WRITE_BEHIND_DURABILITY = 'flush'
+KPI_WRITE_BEHIND_MAX_ROWS = 500
+KPI_WRITE_BEHIND_MAX_DELAY = 0.5
+KPI_WRITE_BEHIND_CAPACITY = 10000
+
+# Drop messages whose (asset_id, attribute_id, timestamp) was ingested
+# recently, before they are routed or evaluated; the number of keys kept
+# per process. A unique constraint on results catches the rest.
+KPI_DEDUPLICATE_MESSAGES = True
+KPI_SEEN_MESSAGES_SIZE = 100000
+
+# Memoize results of KPIs that only read ATTR by (expression, value), for
+# sensors repeating the same readings; the number of results kept.
+# Per-KPI hit rates are listed under "results" in the cache stats
+KPI_MEMOIZE_RESULTS = False
+KPI_RESULT_MEMO_SIZE = 100000
+
+# Load the compiled expressions of all KPIs (from their stored bytecode)
+# into the expression cache before a worker handles its first request, so
+# no message waits for compilation; that request waits for the preload.
+# Bytecode missing from KPIs created before it was stored is filled in
+KPI_PRELOAD_EXPRESSIONS = False
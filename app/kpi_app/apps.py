@@ -1,6 +1,52 @@
+import logging
+from threading import Lock
 from django.apps import AppConfig
+from django.conf import settings
+from django.core.signals import request_started
+from django.db import DatabaseError
+
+
+logger = logging.getLogger(__name__)
+
+
+class _FirstRequestPreload:
+    """request_started receiver preloading expressions once per process.
+
+    The first request waits for the preload, as do requests arriving while
+    it runs, so none of them compiles expressions itself. Management
+    commands such as migrate or test serve no requests and never run it.
+    """
+
+    def __init__(self):
+        self._lock = Lock()
+        self._done = False
+
+    def __call__(self, **kwargs):
+        with self._lock:
+            if self._done:
+                return
+            _preload()
+            self._done = True
+        request_started.disconnect(dispatch_uid='kpi-preload')
+
+
+def _preload():
+    from .utils import preload_expressions
+    try:
+        loaded = preload_expressions()
+    except DatabaseError:
+        # e.g. before the first migrate
+        logger.exception("Could not preload KPI expressions")
+    else:
+        logger.info("Preloaded %d KPI expression(s)", loaded)
 
 
 class KpiAppConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'kpi_app'
+
+    def ready(self):
+        from . import signals  # noqa: F401
+        if getattr(settings, 'KPI_PRELOAD_EXPRESSIONS', False):
+            request_started.connect(_FirstRequestPreload(), weak=False,
+                                    dispatch_uid='kpi-preload')
@@ -0,0 +1,93 @@
+from django.conf import settings
+from .interning import asset_keys, attribute_keys
+from .interpreter.cache import LRUCache
+from .models import AttributeValue
+
+
+class MissingAttributes(ValueError):
+    """A KPI references attributes the asset has not reported yet."""
+
+    def __init__(self, names):
+        self.names = sorted(names)
+        super().__init__(f"Waiting for attribute(s): {', '.join(self.names)}.")
+
+
+class AttributeStore:
+    """Latest value of each attribute an asset's KPIs reference.
+
+    Values are kept per asset as ``{attribute_id: (timestamp, value)}`` in
+    an in-process LRU and written through to AttributeValue, which is read
+    on a miss so a restarted or different worker process starts from the
+    last known state. Only attributes some linked KPI references are kept.
+    """
+
+    def __init__(self, maxsize=10000):
+        self._assets = LRUCache(self._load, maxsize=maxsize)
+
+    @staticmethod
+    def _rows(asset_ids):
+        return (AttributeValue.objects.filter(asset__key__in=asset_ids)
+                .values_list('asset__key', 'attribute__key', 'timestamp',
+                             'value'))
+
+    def _load(self, asset_id):
+        return self._load_many([asset_id])[asset_id]
+
+    def _load_many(self, asset_ids):
+        latest = {asset_id: {} for asset_id in asset_ids}
+        for asset_id, attribute_id, timestamp, value in self._rows(asset_ids):
+            latest[asset_id][attribute_id] = (timestamp, value)
+        return latest
+
+    def latest(self, asset_id):
+        """The live attribute dict of one asset, loaded on a miss."""
+        return self._assets.get(str(asset_id))
+
+    def latest_many(self, asset_ids):
+        """Like ``latest`` for many assets, loading all misses in one query."""
+        return self._assets.get_many([str(asset_id) for asset_id in asset_ids],
+                                     self._load_many)
+
+    @staticmethod
+    def record(latest, attribute_id, timestamp, value):
+        """Update ``latest`` unless it already holds a newer reading."""
+        current = latest.get(attribute_id)
+        if current is not None and current[0] > timestamp:
+            return False
+        latest[attribute_id] = (timestamp, value)
+        return True
+
+    def save(self, readings):
+        """Persist ``(asset_id, attribute_id, timestamp, value)`` readings."""
+        if not readings:
+            return
+        asset_ids = asset_keys.ids_for(str(reading[0]) for reading in readings)
+        attribute_ids = attribute_keys.ids_for(
+            reading[1] for reading in readings)
+        # Readings were recorded in order, so the last one per key is the
+        # latest
+        rows = {}
+        for asset_id, attribute_id, timestamp, value in readings:
+            rows[str(asset_id), attribute_id] = AttributeValue(
+                asset_id=asset_ids[str(asset_id)],
+                attribute_id=attribute_ids[attribute_id],
+                timestamp=timestamp,
+                value=value,
+            )
+        AttributeValue.objects.bulk_create(
+            rows.values(),
+            update_conflicts=True,
+            unique_fields=['asset', 'attribute'],
+            update_fields=['timestamp', 'value'],
+        )
+
+    def clear(self):
+        self._assets.clear()
+
+    def stats(self):
+        return self._assets.stats()
+
+
+attribute_store = AttributeStore(
+    maxsize=getattr(settings, 'KPI_ATTRIBUTE_STORE_SIZE', 10000),
+)
@@ -0,0 +1,296 @@
+import json
+import os
+import django
+from django.db import connection, transaction
+from django.db.models import Q
+from .interning import asset_keys, attribute_keys
+from .interpreter.windows import WindowState
+from .models import EvaluationResult, KPIAssetLink, Reading
+from .pipeline import evaluate_asset
+from .routing import AssetRoutes, Route
+from .utils import store_results
+
+
+class Shard:
+    """Readings of one asset in ``[start, end)`` to re-evaluate."""
+
+    def __init__(self, asset_id, start, end):
+        self.asset_id = asset_id
+        self.start = start
+        self.end = end
+
+    @property
+    def key(self):
+        return f"{self.asset_id}|{self.start.isoformat()}"
+
+    def __repr__(self):
+        return (f"Shard({self.asset_id!r}, {self.start.isoformat()}, "
+                f"{self.end.isoformat()})")
+
+
+def plan_shards(kpi, start, end, span):
+    """Split re-evaluating ``kpi`` over ``[start, end)`` into shards.
+
+    Results of plain ATTR expressions depend on one reading only, so their
+    assets are also split into ``span`` long time slices. KPIs reading
+    other attributes or using window functions carry state from one
+    reading to the next and get one shard per asset.
+    """
+    route = Route(None, kpi.pk, kpi.expression)
+    if route.compiled is None:
+        raise ValueError(route.error)
+    asset_ids = sorted(KPIAssetLink.objects.filter(kpi=kpi)
+                       .values_list('asset_id', flat=True))
+    if route.needs_state:
+        return [Shard(asset_id, start, end) for asset_id in asset_ids]
+
+    shards = []
+    for asset_id in asset_ids:
+        slice_start = start
+        while slice_start < end:
+            slice_end = min(slice_start + span, end)
+            shards.append(Shard(asset_id, slice_start, slice_end))
+            slice_start = slice_end
+    return shards
+
+
+class _FreshWindows(dict):
+    """Window states created empty on first use, like a new asset's."""
+
+    def __init__(self, route):
+        super().__init__()
+        self.route = route
+
+    def __missing__(self, key):
+        state = self[key] = WindowState(self.route.expression,
+                                        self.route.compiled.windows)
+        return state
+
+
+def _message(asset_id, attribute_id, timestamp, value):
+    return {"asset_id": asset_id, "attribute_id": attribute_id,
+            "timestamp": timestamp, "value": value}
+
+
+def _warm_up(shard, linked, latest, windows):
+    """Replay the readings just before the shard without storing results.
+
+    Each attribute's last N readings are replayed, N being the largest
+    window of the expression (1 without windows), so attribute values and
+    window states start where live evaluation had them.
+    """
+    route = linked.routes[0]
+    if not route.needs_state:
+        return
+    warmup = max((window.size or 1 for window in route.compiled.windows),
+                 default=1)
+    earlier = Reading.objects.filter(asset__key=shard.asset_id,
+                                     timestamp__lt=shard.start)
+    if route.compiled.uses_value:
+        # Every attribute feeds ATTR, and windows of ATTR are kept per
+        # attribute
+        attribute_ids = (earlier.values_list('attribute__key', flat=True)
+                         .distinct())
+    else:
+        attribute_ids = route.attributes
+    replay = []
+    for attribute_id in attribute_ids:
+        replay.extend(earlier.filter(attribute__key=attribute_id)
+                      .order_by('-timestamp', '-id')
+                      .values_list('attribute__key', 'timestamp', 'value')
+                      [:warmup])
+    replay.sort(key=lambda reading: reading[1])
+    for attribute_id, timestamp, value in replay:
+        try:
+            message = _message(shard.asset_id, attribute_id, timestamp, value)
+            evaluate_asset(linked, message, latest, [], windows)
+        except (KeyError, ValueError, TypeError):
+            pass
+
+
+# Backfill workers write concurrently, and SQLite lets one writer in at a
+# time: take the write lock when a transaction begins and wait for it,
+# instead of failing with "database is locked" when upgrading a read lock
+SQLITE_WORKER_OPTIONS = {'transaction_mode': 'IMMEDIATE', 'timeout': 30}
+
+
+def setup_worker():
+    """Initialize a backfill worker process before it opens a connection."""
+    django.setup()
+    if connection.vendor == 'sqlite':
+        connection.settings_dict['OPTIONS'] = dict(
+            connection.settings_dict['OPTIONS'], **SQLITE_WORKER_OPTIONS)
+
+
+def write_results(results, kpi_id):
+    """Replace existing results of ``kpi_id`` in place and insert the rest.
+
+    Results are matched on asset, attribute and timestamp, so re-running a
+    shard overwrites what an interrupted run wrote instead of duplicating
+    it. Returns ``(created, updated)``.
+    """
+    if not results:
+        return 0, 0
+    with transaction.atomic():
+        return _write_results(results, kpi_id)
+
+
+def _write_results(results, kpi_id):
+    asset_ids = asset_keys.ids_for(result.asset_key for result in results)
+    attribute_ids = attribute_keys.ids_for(
+        result.attribute_key for result in results)
+    existing = {
+        (row.asset_id, row.attribute_id, row.timestamp): row
+        for row in EvaluationResult.objects.filter(
+            kpi_id=kpi_id,
+            asset_id__in=set(asset_ids.values()),
+            attribute_id__in=set(attribute_ids.values()),
+            timestamp__gte=min(result.timestamp for result in results),
+            timestamp__lte=max(result.timestamp for result in results),
+        )
+    }
+
+    created = []
+    updated = []
+    for result in results:
+        row = existing.get((asset_ids[result.asset_key],
+                            attribute_ids[result.attribute_key],
+                            result.timestamp))
+        if row is None:
+            created.append(result)
+            continue
+        row.value_type = result.value_type
+        row.numeric_value = result.numeric_value
+        row.integer_value = result.integer_value
+        row.bool_value = result.bool_value
+        updated.append(row)
+
+    store_results(created)
+    EvaluationResult.objects.bulk_update(
+        updated, ['value_type', 'numeric_value', 'integer_value',
+                  'bool_value'])
+    return len(created), len(updated)
+
+
+def evaluate_shard(kpi_id, expression, shard, chunk_size):
+    """Re-evaluate one shard; runs in a backfill worker process.
+
+    The expression is compiled through the process-wide expression cache,
+    so once per worker, and readings are read ``chunk_size`` at a time
+    with the results of each chunk written before the next is read.
+    Chunks of a KPI without state are evaluated column-wise.
+    """
+    route = Route(None, kpi_id, expression)
+    linked = AssetRoutes([route])
+    latest = {}
+    windows = _FreshWindows(route)
+    _warm_up(shard, linked, latest, windows)
+
+    summary = {"readings": 0, "created": 0, "updated": 0, "errors": 0}
+    for chunk in _chunks(shard, chunk_size):
+        summary["readings"] += len(chunk)
+        results = None
+        if route.compiled is not None and not route.needs_state:
+            results = _evaluate_column(route, shard, chunk)
+        if results is None:
+            results, failed = _evaluate_rows(linked, shard, chunk, latest,
+                                             windows)
+            summary["errors"] += failed
+        created, updated = write_results(results, kpi_id)
+        summary["created"] += created
+        summary["updated"] += updated
+    return summary
+
+
+def _evaluate_column(route, shard, chunk):
+    """Results of a chunk of readings, from ``evaluate_many``.
+
+    Returns None when a reading fails, so the chunk is evaluated row by row
+    and each failure is counted.
+    """
+    try:
+        values = route.compiled.evaluate_many(
+            [value for _, _, _, value in chunk])
+        return [
+            EvaluationResult.build(shard.asset_id,
+                                   route.result_key(attribute_id), timestamp,
+                                   value, kpi_id=route.kpi_id)
+            for (_, attribute_id, timestamp, _), value in zip(chunk, values)
+        ]
+    except (ValueError, TypeError, ArithmeticError):
+        return None
+
+
+def _evaluate_rows(linked, shard, chunk, latest, windows):
+    """Evaluate a chunk reading by reading; returns results and errors."""
+    results = []
+    failed = 0
+    for reading_id, attribute_id, timestamp, value in chunk:
+        try:
+            evaluated, errors = evaluate_asset(
+                linked, _message(shard.asset_id, attribute_id, timestamp,
+                                 value),
+                latest, [], windows)
+        except (KeyError, ValueError, TypeError):
+            failed += 1
+            continue
+        results.extend(evaluated)
+        failed += len(errors)
+    return results, failed
+
+
+def _chunks(shard, chunk_size):
+    """Readings of ``shard`` in time order, ``chunk_size`` per query.
+
+    Each chunk is fetched with a keyset query rather than by holding a
+    cursor open, so its results can be written in between (SQLite would
+    otherwise refuse the write while the read is in progress).
+    """
+    readings = (Reading.objects
+                .filter(asset__key=shard.asset_id,
+                        timestamp__gte=shard.start, timestamp__lt=shard.end)
+                .order_by('timestamp', 'id')
+                .values_list('id', 'attribute__key', 'timestamp', 'value'))
+    chunk = list(readings[:chunk_size])
+    while chunk:
+        yield chunk
+        last_id, _, last_time, _ = chunk[-1]
+        after = (Q(timestamp__gt=last_time)
+                 | Q(timestamp=last_time, id__gt=last_id))
+        chunk = list(readings.filter(after)[:chunk_size])
+
+
+class Checkpoint:
+    """Completed shards of a backfill run, kept in a JSON file.
+
+    The file also records what the run re-evaluates, so a checkpoint is
+    only resumed by the same KPI expression and time range.
+    """
+
+    def __init__(self, path, run):
+        self.path = path
+        self.run = run
+        self.done = set()
+
+    def load(self):
+        """Resume from the file; False when it belongs to a different run."""
+        if not os.path.exists(self.path):
+            return True
+        with open(self.path) as file:
+            stored = json.load(file)
+        if stored.get("run") != self.run:
+            return False
+        self.done = set(stored.get("done", []))
+        return True
+
+    def complete(self, shard):
+        self.done.add(shard.key)
+        temporary = f"{self.path}.tmp"
+        with open(temporary, "w") as file:
+            json.dump({"run": self.run, "done": sorted(self.done)}, file)
+        # Replace atomically so an interrupted write keeps the old checkpoint
+        os.replace(temporary, self.path)
+
+    def remove(self):
+        if os.path.exists(self.path):
+            os.remove(self.path)
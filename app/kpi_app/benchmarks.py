@@ -0,0 +1,325 @@
+import json
+import platform
+import statistics
+import time
+import tracemalloc
+from datetime import timedelta
+from itertools import islice
+import django
+from django.conf import settings
+from django.test import Client
+from django.urls import reverse
+from .columnar import decode_batch, encode_batch
+from .interpreter.compiler import compile_expression, parse_expression
+from .interpreter.optimizer import optimize_tree
+from .interpreter.interpreter import Interpreter
+from .interpreter.lexer import LEXERS, TokenType
+from .interpreter.parser import Parser
+from .models import KPI, KPIAssetLink
+from .utils import evaluate_and_store_result, parse_timestamp
+
+
+SHALLOW_EXPRESSION = "ATTR * 3600 / 60 + ATTR - 2 * (ATTR + 7)"
+DEEP_EXPRESSION = "(1 + " * 100 + "ATTR" + ")" * 100
+REGEX_EXPRESSION = 'Regex(ATTR, "^pump-[a-z]+-[0-9]+$")'
+TIMESTAMP = "2022-07-31T23:28:37Z[UTC]"
+
+
+class Benchmark:
+    """One timed operation.
+
+    ``factory`` does the setup and returns ``(run, units)``: the callable
+    that is timed and how many ``unit``s one call of it processes.
+    Benchmarks with ``database`` set need the isolated test database.
+    """
+
+    def __init__(self, name, factory, number, unit="call", database=False):
+        self.name = name
+        self.factory = factory
+        self.number = number
+        self.unit = unit
+        self.database = database
+
+
+BENCHMARKS = []
+
+
+def benchmark(name, number, unit="call", database=False):
+    def register(factory):
+        BENCHMARKS.append(Benchmark(name, factory, number, unit, database))
+        return factory
+    return register
+
+
+def _lexer_tokens(lexer_class):
+    def factory():
+        count = len(list(_tokens(lexer_class(SHALLOW_EXPRESSION))))
+
+        def run():
+            for _ in _tokens(lexer_class(SHALLOW_EXPRESSION)):
+                pass
+        return run, count
+    return factory
+
+
+def _tokens(lexer):
+    while True:
+        token = lexer.get_next_token()
+        if token.type == TokenType.EOF:
+            return
+        yield token
+
+
+for _name, _lexer_class in LEXERS.items():
+    benchmark(f"lexer.{_name}.get_next_token", 2000, unit="token")(
+        _lexer_tokens(_lexer_class))
+
+
+@benchmark("parser.parse.shallow", 2000)
+def parse_shallow():
+    return lambda: Parser(LEXERS['scan'](SHALLOW_EXPRESSION)).parse(), 1
+
+
+@benchmark("parser.parse.deep", 100)
+def parse_deep():
+    return lambda: Parser(LEXERS['scan'](DEEP_EXPRESSION)).parse(), 1
+
+
+@benchmark("interpreter.interpret.arithmetic", 5000)
+def interpret_arithmetic():
+    tree = parse_expression(SHALLOW_EXPRESSION)
+    return lambda: Interpreter({'ATTR': 17}).interpret(tree), 1
+
+
+@benchmark("interpreter.interpret.regex", 5000)
+def interpret_regex():
+    tree = parse_expression(REGEX_EXPRESSION)
+    return lambda: Interpreter({'ATTR': "pump-north-12"}).interpret(tree), 1
+
+
+@benchmark("compiled.evaluate.arithmetic", 20000)
+def compiled_arithmetic():
+    compiled = compile_expression(SHALLOW_EXPRESSION)
+    return lambda: compiled.evaluate(17), 1
+
+
+@benchmark("utils.parse_timestamp", 5000)
+def timestamp():
+    return lambda: parse_timestamp(TIMESTAMP), 1
+
+
+def _messages(asset_id):
+    """Endless distinct messages, one second apart."""
+    start = parse_timestamp(TIMESTAMP)
+    second = 0
+    while True:
+        yield {
+            "asset_id": asset_id,
+            "attribute_id": "1",
+            "timestamp": (start + timedelta(seconds=second)).strftime(
+                "%Y-%m-%dT%H:%M:%SZ[UTC]"),
+            "value": second % 100,
+        }
+        second += 1
+
+
+def _batch(size):
+    return list(islice(_messages("bench-batch"), size))
+
+
+@benchmark("batch.decode.json", 50, unit="reading")
+def decode_json():
+    body = json.dumps({"messages": _batch(1000)})
+
+    def run():
+        for message in json.loads(body)["messages"]:
+            parse_timestamp(message["timestamp"])
+    return run, 1000
+
+
+@benchmark("batch.decode.columnar", 50, unit="reading")
+def decode_columnar():
+    body = encode_batch(
+        (message["asset_id"], message["attribute_id"],
+         parse_timestamp(message["timestamp"]), message["value"])
+        for message in _batch(1000)
+    )
+
+    def run():
+        for _ in decode_batch(body).rows():
+            pass
+    return run, 1000
+
+
+@benchmark("utils.evaluate_and_store_result", 300, database=True)
+def store_result():
+    messages = _messages("bench-store")
+    return (lambda: evaluate_and_store_result(next(messages),
+                                              SHALLOW_EXPRESSION)), 1
+
+
+@benchmark("views.evaluate", 200, unit="request", database=True)
+def evaluate_endpoint():
+    kpi = KPI.objects.create(name="Benchmark KPI",
+                             expression=SHALLOW_EXPRESSION)
+    KPIAssetLink.objects.create(kpi=kpi, asset_id="bench-endpoint")
+    client = Client()
+    url = reverse('evaluate-linked-assets')
+    messages = _messages("bench-endpoint")
+
+    def run():
+        response = client.post(url, {"message": next(messages)},
+                               content_type="application/json")
+        if response.status_code != 200:
+            raise RuntimeError(f"evaluate/ answered {response.status_code}: "
+                               f"{response.content!r}")
+    return run, 1
+
+
+# Reported in bytes per KPI instead of seconds per call
+MEMORY_BENCHMARK = "memory.cached_kpi"
+
+
+def _memory_expressions(count):
+    """Distinct KPI expressions of the shapes linked in practice."""
+    shapes = [
+        f"{SHALLOW_EXPRESSION} + {{n}}",
+        "{{power}} / {{flow}} * {n}",
+        'Regex(ATTR, "^pump-[a-z]+-{n}$")',
+        "AVG(ATTR, {n}) - ATTR",
+    ]
+    return [shapes[n % len(shapes)].format(n=n + 1) for n in range(count)]
+
+
+def _allocated(build, texts):
+    tracemalloc.start()
+    try:
+        before = tracemalloc.get_traced_memory()[0]
+        kept = [build(text) for text in texts]
+        allocated = tracemalloc.get_traced_memory()[0] - before
+    finally:
+        tracemalloc.stop()
+    del kept
+    return allocated
+
+
+def measure_memory(count=1000):
+    """Bytes allocated per KPI held in the expression cache.
+
+    ``tree_bytes_per_kpi`` counts the optimized tree alone,
+    ``bytes_per_kpi`` the whole CompiledExpression including its generated
+    function. The expression texts are built beforehand and not counted.
+    """
+    texts = _memory_expressions(count)
+    # Compile every pattern once, so the shared pattern cache isn't counted
+    for text in texts:
+        compile_expression(text)
+    tree = _allocated(lambda text: optimize_tree(parse_expression(text)),
+                      texts)
+    compiled = _allocated(compile_expression, texts)
+    return {
+        "tree_bytes_per_kpi": tree / count,
+        "bytes_per_kpi": compiled / count,
+        "kpis": count,
+    }
+
+
+def select(patterns=None):
+    """Benchmarks whose name contains any of ``patterns`` (all when empty)."""
+    if not patterns:
+        return list(BENCHMARKS)
+    return [bench for bench in BENCHMARKS
+            if any(pattern in bench.name for pattern in patterns)]
+
+
+def select_memory(patterns=None):
+    """Whether ``patterns`` select the memory benchmark."""
+    return not patterns or any(pattern in MEMORY_BENCHMARK
+                               for pattern in patterns)
+
+
+def measure(bench, repeat=5, scale=1.0):
+    """Time ``bench`` and return its JSON-ready result.
+
+    The call is run ``number * scale`` times per round, after one warm-up
+    call; the fastest round is the headline figure, as slower rounds
+    mostly measure interference from the rest of the machine.
+    """
+    run, units = bench.factory()
+    number = max(1, int(bench.number * scale))
+    run()
+    rounds = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        for _ in range(number):
+            run()
+        rounds.append((time.perf_counter() - start) / number)
+    best = min(rounds)
+    return {
+        "seconds_per_call": best,
+        "median_seconds_per_call": statistics.median(rounds),
+        "throughput": units / best if best else None,
+        "unit": f"{bench.unit}/s",
+        "calls": number,
+        "repeat": repeat,
+    }
+
+
+def environment():
+    """What the numbers depend on, stored next to them."""
+    return {
+        "python": platform.python_version(),
+        "django": django.get_version(),
+        "machine": platform.machine(),
+        "backend": getattr(settings, 'KPI_EVALUATION_BACKEND', 'codegen'),
+        "lexer": getattr(settings, 'KPI_LEXER', 'scan'),
+        "optimize": getattr(settings, 'KPI_OPTIMIZE_EXPRESSIONS', True),
+        "metrics": getattr(settings, 'KPI_METRICS_ENABLED', True),
+        "database": settings.DATABASES['default']['ENGINE'],
+    }
+
+
+def compare(results, baseline, threshold):
+    """Compare ``results`` with ``baseline`` benchmark by benchmark.
+
+    Returns ``(name, baseline_seconds, seconds, change, regressed)`` rows
+    for every benchmark present in both, where ``change`` is the relative
+    slowdown (negative when faster) and ``regressed`` whether it exceeds
+    ``threshold``.
+    """
+    rows = []
+    for name, result in results["benchmarks"].items():
+        previous = baseline.get("benchmarks", {}).get(name)
+        if previous is None:
+            continue
+        before = previous["seconds_per_call"]
+        after = result["seconds_per_call"]
+        change = after / before - 1 if before else 0.0
+        rows.append((name, before, after, change, change > threshold))
+    return rows
+
+
+def compare_memory(results, baseline, threshold):
+    """Like ``compare`` for the figures of the memory benchmark."""
+    rows = []
+    current = results.get("memory", {}).get(MEMORY_BENCHMARK, {})
+    previous = baseline.get("memory", {}).get(MEMORY_BENCHMARK, {})
+    for key in ("tree_bytes_per_kpi", "bytes_per_kpi"):
+        if key not in current or key not in previous:
+            continue
+        before, after = previous[key], current[key]
+        change = after / before - 1 if before else 0.0
+        rows.append((f"{MEMORY_BENCHMARK}.{key}", before, after, change,
+                     change > threshold))
+    return rows
+
+
+def load(path):
+    with open(path) as file:
+        return json.load(file)
+
+
+def save(results, path):
+    with open(path, "w") as file:
+        json.dump(results, file, indent=2, sort_keys=True)
+        file.write("\n")
@@ -0,0 +1,209 @@
+"""Binary columnar batch format for ingestion (``application/x-kpi-columnar``).
+
+A batch packs its readings column by column, little-endian::
+
+    header   '<4sHHII'  magic b"KPIB", version 1, flags 0,
+                        string count S, row count N
+    strings  S times    u16 byte length + UTF-8 bytes
+    assets   N x u32    index of the asset ID in the string table
+    attrs    N x u32    index of the attribute ID in the string table
+    times    N x i64    timestamp in seconds since the epoch (UTC)
+    types    N x u8     0 int, 1 float, 2 bool, 3 string
+    values   N x 8      i64 for int, bool and string (a string table
+                        index), f64 for float
+
+IDs and string values are stored once in the string table however many
+rows use them. Decoding copies each column into an ``array`` with one
+call, and rows are read back as plain tuples, so no dict or timestamp
+string is built per reading.
+
+The module only uses the standard library, so a gateway can vendor it
+to produce batches with ``encode_batch``.
+"""
+import struct
+import sys
+from array import array
+from datetime import datetime
+
+
+CONTENT_TYPE = "application/x-kpi-columnar"
+MAGIC = b"KPIB"
+VERSION = 1
+HEADER = struct.Struct("<4sHHII")
+STRING_LENGTH = struct.Struct("<H")
+
+INTEGER = 0
+FLOAT = 1
+BOOLEAN = 2
+STRING = 3
+
+# array typecodes with the widths the format uses
+INDEX_CODE = next(code for code in "IL" if array(code).itemsize == 4)
+_SWAP = sys.byteorder == "big"
+
+
+class ColumnarBatch:
+    """A decoded batch; ``rows()`` yields its readings."""
+
+    def __init__(self, strings, assets, attributes, times, types, integers,
+                 floats):
+        self.strings = strings
+        self.assets = assets
+        self.attributes = attributes
+        self.times = times
+        self.types = types
+        self.integers = integers
+        self.floats = floats
+
+    def __len__(self):
+        return len(self.times)
+
+    def asset_ids(self):
+        """The distinct asset IDs of the batch."""
+        strings = self.strings
+        return [strings[index] for index in set(self.assets)]
+
+    def pairs(self):
+        """``(asset_id, attribute_id)`` of every row."""
+        strings = self.strings
+        return [(strings[asset], strings[attribute])
+                for asset, attribute in zip(self.assets, self.attributes)]
+
+    def rows(self):
+        """Yield ``(asset_id, attribute_id, epoch_seconds, value)`` per row."""
+        strings = self.strings
+        for asset, attribute, epoch, kind, integer, real in zip(
+                self.assets, self.attributes, self.times,
+                self.types, self.integers, self.floats):
+            if kind == INTEGER:
+                value = integer
+            elif kind == FLOAT:
+                value = real
+            elif kind == BOOLEAN:
+                value = bool(integer)
+            else:
+                value = strings[integer]
+            yield strings[asset], strings[attribute], epoch, value
+
+
+def _column(code, data, offset, count):
+    column = array(code)
+    end = offset + column.itemsize * count
+    if end > len(data):
+        raise ValueError("Columnar batch is truncated.")
+    column.frombytes(data[offset:end])
+    if _SWAP:
+        column.byteswap()
+    return column, end
+
+
+def decode_batch(data):
+    """Decode the bytes of a batch into a ColumnarBatch.
+
+    Raises ValueError when the data is not a well-formed batch.
+    """
+    data = memoryview(data)
+    if len(data) < HEADER.size:
+        raise ValueError("Columnar batch is truncated.")
+    magic, version, flags, string_count, count = HEADER.unpack_from(data)
+    if magic != MAGIC:
+        raise ValueError("Not a columnar KPI batch.")
+    if version != VERSION:
+        raise ValueError(f"Unsupported columnar batch version {version}.")
+
+    offset = HEADER.size
+    strings = []
+    for _ in range(string_count):
+        if offset + STRING_LENGTH.size > len(data):
+            raise ValueError("Columnar batch is truncated.")
+        (length,) = STRING_LENGTH.unpack_from(data, offset)
+        offset += STRING_LENGTH.size
+        if offset + length > len(data):
+            raise ValueError("Columnar batch is truncated.")
+        try:
+            strings.append(str(data[offset:offset + length], "utf-8"))
+        except UnicodeDecodeError:
+            raise ValueError("Columnar batch has a string that is not UTF-8.")
+        offset += length
+
+    assets, offset = _column(INDEX_CODE, data, offset, count)
+    attributes, offset = _column(INDEX_CODE, data, offset, count)
+    times, offset = _column("q", data, offset, count)
+    types, offset = _column("B", data, offset, count)
+    integers, end = _column("q", data, offset, count)
+    floats, end = _column("d", data, offset, count)
+    if end != len(data):
+        raise ValueError("Columnar batch has trailing data.")
+
+    if count:
+        if max(max(assets), max(attributes)) >= string_count:
+            raise ValueError("Columnar batch refers to a missing ID.")
+        if max(types) > STRING:
+            raise ValueError("Columnar batch has an unknown value type.")
+        if types.count(STRING) and any(
+                kind == STRING and not 0 <= index < string_count
+                for kind, index in zip(types, integers)):
+            raise ValueError(
+                "Columnar batch refers to a missing string value.")
+    return ColumnarBatch(strings, assets, attributes, times, types, integers,
+                         floats)
+
+
+def _epoch(timestamp):
+    if isinstance(timestamp, datetime):
+        if timestamp.tzinfo is None:
+            raise ValueError("Timestamps must be timezone-aware.")
+        return int(timestamp.timestamp())
+    return int(timestamp)
+
+
+def encode_batch(readings):
+    """Encode ``(asset_id, attribute_id, timestamp, value)`` readings.
+
+    ``timestamp`` is an aware datetime or seconds since the epoch; values
+    are ints, floats, bools or strings.
+    """
+    strings = {}
+
+    def intern(text):
+        text = str(text)
+        index = strings.get(text)
+        if index is None:
+            index = strings[text] = len(strings)
+        return index
+
+    assets = array(INDEX_CODE)
+    attributes = array(INDEX_CODE)
+    times = array("q")
+    types = array("B")
+    values = array("q")
+    for asset_id, attribute_id, timestamp, value in readings:
+        assets.append(intern(asset_id))
+        attributes.append(intern(attribute_id))
+        times.append(_epoch(timestamp))
+        if isinstance(value, bool):
+            types.append(BOOLEAN)
+            values.append(int(value))
+        elif isinstance(value, int):
+            types.append(INTEGER)
+            values.append(value)
+        elif isinstance(value, float):
+            types.append(FLOAT)
+            # Reinterpret the float's bits; the column is read back as f64
+            values.append(struct.unpack("<q", struct.pack("<d", value))[0])
+        elif isinstance(value, str):
+            types.append(STRING)
+            values.append(intern(value))
+        else:
+            raise ValueError(f"Unsupported value {value!r}.")
+
+    parts = [HEADER.pack(MAGIC, VERSION, 0, len(strings), len(times))]
+    for text in strings:
+        encoded = text.encode("utf-8")
+        parts.append(STRING_LENGTH.pack(len(encoded)))
+        parts.append(encoded)
+    for column in (assets, attributes, times, types, values):
+        if _SWAP:
+            column.byteswap()
+        parts.append(column.tobytes())
+    return b"".join(parts)
@@ -0,0 +1,43 @@
+from concurrent.futures import ThreadPoolExecutor
+from threading import Lock
+from django.conf import settings
+
+
+class EvaluationLimiter:
+    """Counts in-flight evaluations and refuses work beyond ``limit``."""
+
+    def __init__(self, limit):
+        self.limit = limit
+        self.in_flight = 0
+        self.rejected = 0
+        self._lock = Lock()
+
+    def try_acquire(self):
+        with self._lock:
+            if self.in_flight >= self.limit:
+                self.rejected += 1
+                return False
+            self.in_flight += 1
+            return True
+
+    def release(self):
+        with self._lock:
+            self.in_flight -= 1
+
+    def stats(self):
+        return {
+            "in_flight": self.in_flight,
+            "limit": self.limit,
+            "rejected": self.rejected,
+        }
+
+
+async_limiter = EvaluationLimiter(
+    getattr(settings, 'KPI_ASYNC_MAX_IN_FLIGHT', 256)
+)
+
+# Runs CPU-bound expression evaluation off the event loop
+evaluation_executor = ThreadPoolExecutor(
+    max_workers=getattr(settings, 'KPI_ASYNC_EVALUATION_WORKERS', 4),
+    thread_name_prefix='kpi-evaluation',
+)
@@ -0,0 +1,60 @@
+from django.conf import settings
+from .interpreter.cache import LRUCache
+
+
+class SeenMessages:
+    """Recently ingested messages, to drop gateway retries early.
+
+    A message is identified by its ``(asset_id, attribute_id, timestamp)``
+    with the timestamp as received, so a retry is recognised before its
+    timestamp is parsed or its asset routed. Keys are remembered once the
+    message's results are stored and kept in an in-process LRU of
+    ``maxsize`` entries (its hits are the duplicates found).
+
+    The filter is per process and forgets old keys, so it is backed by the
+    unique constraint on EvaluationResult: a duplicate it misses, e.g. one
+    sent to another worker, is evaluated again but not stored twice.
+    """
+
+    def __init__(self, enabled=True, maxsize=100000):
+        self.enabled = enabled
+        self._keys = LRUCache(None, maxsize=maxsize)
+
+    @staticmethod
+    def key(asset_id, attribute_id, timestamp):
+        return (str(asset_id), str(attribute_id), timestamp)
+
+    def message_key(self, message):
+        """Key of a message dict, or None if it cannot be deduplicated."""
+        if not self.enabled or not isinstance(message, dict):
+            return None
+        try:
+            key = self.key(message["asset_id"], message["attribute_id"],
+                           message["timestamp"])
+            hash(key)
+        except (KeyError, TypeError):
+            return None
+        return key
+
+    def seen(self, key):
+        return (self.enabled and key is not None
+                and self._keys.peek(key) is not None)
+
+    def remember(self, keys):
+        if not self.enabled:
+            return
+        for key in keys:
+            if key is not None:
+                self._keys.put(key, True)
+
+    def clear(self):
+        self._keys.clear()
+
+    def stats(self):
+        return self._keys.stats()
+
+
+seen_messages = SeenMessages(
+    enabled=getattr(settings, 'KPI_DEDUPLICATE_MESSAGES', True),
+    maxsize=getattr(settings, 'KPI_SEEN_MESSAGES_SIZE', 100000),
+)
@@ -0,0 +1,60 @@
+from django.conf import settings
+from django.db import transaction
+from .interpreter.cache import LRUCache
+from .models import Asset, Attribute
+
+
+class KeyInterner:
+    """Maps identifier strings to the integer keys of an interning model.
+
+    Keys are created on first use. Resolved IDs are only cached once the
+    surrounding transaction commits, so a rollback can never leave the
+    cache pointing at rows that do not exist.
+    """
+
+    def __init__(self, model, maxsize=100000):
+        self.model = model
+        self._ids = LRUCache(None, maxsize=maxsize)
+
+    def ids_for(self, keys):
+        """Return ``{key: id}`` for ``keys``, creating missing rows."""
+        ids = {}
+        missing = []
+        for key in set(keys):
+            pk = self._ids.peek(key)
+            if pk is None:
+                missing.append(key)
+            else:
+                ids[key] = pk
+
+        if missing:
+            loaded = self._fetch(missing)
+            absent = [key for key in missing if key not in loaded]
+            if absent:
+                self.model.objects.bulk_create(
+                    [self.model(key=key) for key in absent],
+                    ignore_conflicts=True,
+                )
+                loaded.update(self._fetch(absent))
+            ids.update(loaded)
+            transaction.on_commit(lambda: self._remember(loaded))
+        return ids
+
+    def _fetch(self, keys):
+        return dict(self.model.objects.filter(key__in=keys)
+                    .values_list('key', 'id'))
+
+    def _remember(self, ids):
+        for key, pk in ids.items():
+            self._ids.put(key, pk)
+
+    def clear(self):
+        self._ids.clear()
+
+    def stats(self):
+        return self._ids.stats()
+
+
+interner_size = getattr(settings, 'KPI_INTERNED_KEY_CACHE_SIZE', 100000)
+asset_keys = KeyInterner(Asset, maxsize=interner_size)
+attribute_keys = KeyInterner(Attribute, maxsize=interner_size)
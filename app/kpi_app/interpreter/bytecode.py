@@ -0,0 +1,135 @@
+"""Postfix (RPN) serialization of expression trees.
+
+A compiled KPI is stored as ``[version, checksum, instruction, ...]``:
+the format version, the CRC-32 of the expression text it was compiled
+from and the nodes of the (optimized) tree in postfix order, each a short
+JSON list. Rebuilding a tree from it is one pass over the instructions
+with a stack, so a worker skips lexing, parsing and optimizing.
+
+Bytecode whose version or checksum does not match is rejected with a
+ValueError; the caller then compiles the text, which also covers rows
+whose expression was changed without going through the model.
+"""
+import sys
+import zlib
+from .interpreter import NodeVisitor
+from .lexer import TokenType
+from .parser import (
+    BinOp,
+    Num,
+    RegexOp,
+    Str,
+    UnaryOp,
+    Var,
+    Window,
+    binary_operations,
+)
+from .windows import MAX_WINDOW_SIZE, WINDOW_FUNCTIONS
+
+
+BYTECODE_VERSION = 1
+
+UNARY_OPERATORS = {TokenType.PLUS, TokenType.MINUS}
+
+
+def checksum(text):
+    return zlib.crc32(text.encode("utf-8"))
+
+
+class BytecodeEmitter(NodeVisitor):
+    """Append the postfix instructions of a tree to ``code``."""
+
+    def __init__(self):
+        self.code = []
+
+    def visit_bin_op(self, node):
+        node.left.accept(self)
+        node.right.accept(self)
+        self.code.append(["bin", node.op])
+
+    def visit_num(self, node):
+        self.code.append(["num", node.value])
+
+    def visit_unary_op(self, node):
+        node.expr.accept(self)
+        self.code.append(["unary", node.op])
+
+    def visit_regex_op(self, node):
+        node.value.accept(self)
+        self.code.append(["regex", node.pattern])
+
+    def visit_var(self, node):
+        kind = "attr" if node.attribute else "var"
+        self.code.append([kind, node.name])
+
+    def visit_str(self, node):
+        self.code.append(["str", node.value])
+
+    def visit_window(self, node):
+        node.expr.accept(self)
+        self.code.append(["window", node.function, node.size, node.slot])
+
+
+def dump_tree(text, tree):
+    """Bytecode of ``tree``, the compiled form of ``text``."""
+    emitter = BytecodeEmitter()
+    tree.accept(emitter)
+    return [BYTECODE_VERSION, checksum(text), *emitter.code]
+
+
+def _pop(stack, count):
+    if len(stack) < count:
+        raise ValueError("Bytecode stack underflow.")
+    operands = stack[-count:]
+    del stack[-count:]
+    return operands
+
+
+def load_tree(text, bytecode):
+    """Rebuild the tree that ``dump_tree(text, tree)`` serialized."""
+    if not isinstance(bytecode, list) or len(bytecode) < 3:
+        raise ValueError("Malformed bytecode.")
+    version, stored_checksum, *code = bytecode
+    if version != BYTECODE_VERSION:
+        raise ValueError(
+            f"Bytecode version {version!r} is not {BYTECODE_VERSION}.")
+    if stored_checksum != checksum(text):
+        raise ValueError("Bytecode was compiled from a different expression.")
+
+    stack = []
+    try:
+        for kind, *arguments in code:
+            if kind == "num" and type(arguments[0]) is int:
+                stack.append(Num(arguments[0]))
+            elif kind == "var" and arguments[0] == "ATTR":
+                stack.append(Var(sys.intern(arguments[0])))
+            elif kind == "attr" and isinstance(arguments[0], str):
+                stack.append(Var(sys.intern(arguments[0]), attribute=True))
+            elif kind == "str" and isinstance(arguments[0], str):
+                stack.append(Str(arguments[0]))
+            elif kind == "bin" and arguments[0] in binary_operations:
+                left, right = _pop(stack, 2)
+                stack.append(BinOp(left, sys.intern(arguments[0]), right))
+            elif kind == "unary" and arguments[0] in UNARY_OPERATORS:
+                stack.append(UnaryOp(sys.intern(arguments[0]),
+                                     *_pop(stack, 1)))
+            elif kind == "regex" and isinstance(arguments[0], str):
+                stack.append(RegexOp(*_pop(stack, 1), arguments[0]))
+            elif kind == "window" and arguments[0] in WINDOW_FUNCTIONS:
+                function, size, slot = arguments
+                if WINDOW_FUNCTIONS[function].sized and not (
+                        type(size) is int and 1 <= size <= MAX_WINDOW_SIZE):
+                    raise ValueError(
+                        f"Invalid {function} window size in bytecode.")
+                if type(slot) is not int:
+                    raise ValueError("Invalid window slot in bytecode.")
+                stack.append(Window(sys.intern(function), *_pop(stack, 1),
+                                    size, slot))
+            else:
+                raise ValueError(
+                    f"Unknown bytecode instruction {[kind, *arguments]!r}.")
+    except (TypeError, IndexError):
+        raise ValueError("Malformed bytecode.")
+    if len(stack) != 1:
+        raise ValueError("Malformed bytecode.")
+    return stack[0]
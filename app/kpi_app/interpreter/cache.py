@@ -0,0 +1,144 @@
+from collections import OrderedDict
+from threading import Lock
+
+
+class LRUCache:
+    """Bounded least-recently-used cache that builds missing entries itself.
+
+    ``loader`` is called with the key on a miss; if it raises, nothing is
+    cached and the exception propagates to the caller. A value loaded while
+    the cache was being invalidated is returned but not stored, so it cannot
+    resurrect an entry that was discarded mid-load.
+    """
+
+    def __init__(self, loader, maxsize=128):
+        self.loader = loader
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._generation = 0
+        self._data = OrderedDict()
+        self._lock = Lock()
+
+    def get(self, key):
+        with self._lock:
+            try:
+                value = self._data[key]
+            except KeyError:
+                self.misses += 1
+                generation = self._generation
+            else:
+                self._data.move_to_end(key)
+                self.hits += 1
+                return value
+
+        # Build outside the lock so a slow loader does not stall other keys
+        value = self.loader(key)
+        self._store({key: value}, generation)
+        return value
+
+    async def aget(self, key, aloader):
+        """Like ``get`` but awaits the coroutine function ``aloader``."""
+        with self._lock:
+            try:
+                value = self._data[key]
+            except KeyError:
+                self.misses += 1
+                generation = self._generation
+            else:
+                self._data.move_to_end(key)
+                self.hits += 1
+                return value
+
+        value = await aloader(key)
+        self._store({key: value}, generation)
+        return value
+
+    def peek(self, key, default=None):
+        """Return the cached value for ``key`` without loading it."""
+        with self._lock:
+            try:
+                value = self._data[key]
+            except KeyError:
+                self.misses += 1
+                return default
+            self._data.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def put(self, key, value):
+        with self._lock:
+            generation = self._generation
+        self._store({key: value}, generation)
+
+    def get_many(self, keys, load_many):
+        """Return a dict for ``keys``, loading all misses in one call.
+
+        ``load_many`` receives the list of missing keys and must return a
+        dict with a value for each of them.
+        """
+        found = {}
+        missing = []
+        with self._lock:
+            for key in dict.fromkeys(keys):
+                try:
+                    found[key] = self._data[key]
+                except KeyError:
+                    missing.append(key)
+                else:
+                    self._data.move_to_end(key)
+            self.hits += len(found)
+            self.misses += len(missing)
+            generation = self._generation
+        if missing:
+            loaded = load_many(missing)
+            self._store(loaded, generation)
+            found.update(loaded)
+        return found
+
+    def _store(self, values, generation):
+        with self._lock:
+            if generation != self._generation:
+                return
+            for key, value in values.items():
+                self._data[key] = value
+                self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+                self.evictions += 1
+
+    def discard(self, key):
+        with self._lock:
+            self._data.pop(key, None)
+            self._generation += 1
+
+    def discard_where(self, predicate):
+        """Drop every entry whose value satisfies ``predicate``."""
+        with self._lock:
+            stale = [key for key, value in self._data.items()
+                     if predicate(value)]
+            for key in stale:
+                del self._data[key]
+            self._generation += 1
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+            self._generation += 1
+            self.hits = self.misses = self.evictions = 0
+
+    def stats(self):
+        return {
+            "size": len(self._data),
+            "maxsize": self.maxsize,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+        }
+
+    def __contains__(self, key):
+        return key in self._data
+
+    def __len__(self):
+        return len(self._data)
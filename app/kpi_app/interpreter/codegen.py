@@ -0,0 +1,91 @@
+from .lexer import TokenType
+from .interpreter import NodeVisitor, arithmetic_operand
+from .parser import Str, Var, Window
+
+
+# Python operators equivalent to the callables in parser.binary_operations
+BINARY_SYMBOLS = {
+    'PLUS': '+',
+    'MINUS': '-',
+    'MUL': '*',
+    'DIV': '//',
+}
+
+UNARY_SYMBOLS = {
+    TokenType.PLUS: '+',
+    TokenType.MINUS: '-',
+}
+
+
+class CodeGenerator(NodeVisitor):
+    """Lower an AST into the source of one Python expression.
+
+    Values the expression needs at runtime (compiled regexes) are collected
+    in ``constants`` and handed to the generated function as globals.
+    Operands that may be strings are checked with ``_operand`` before
+    arithmetic; numbers, results of arithmetic and Regex bools are not.
+    """
+
+    def __init__(self):
+        self.constants = {}
+
+    def _constant(self, value):
+        name = f"_c{len(self.constants)}"
+        self.constants[name] = value
+        return name
+
+    def _operand(self, node):
+        source = node.accept(self)
+        if isinstance(node, (Var, Str, Window)):
+            return f"_operand({source})"
+        return source
+
+    def visit_bin_op(self, node):
+        symbol = BINARY_SYMBOLS.get(node.op)
+        if not symbol:
+            raise ValueError(f"Operation {node.op} not supported.")
+        left = self._operand(node.left)
+        right = self._operand(node.right)
+        return f"({left} {symbol} {right})"
+
+    def visit_num(self, node):
+        return repr(node.value)
+
+    def visit_unary_op(self, node):
+        symbol = UNARY_SYMBOLS.get(node.op)
+        if not symbol:
+            raise ValueError(f"Operation {node.op} not supported.")
+        return f"({symbol}{self._operand(node.expr)})"
+
+    def visit_regex_op(self, node):
+        value = node.value.accept(self)
+        regex = self._constant(node.regex)
+        return f"bool({regex}.match(str({value})))"
+
+    def visit_var(self, node):
+        return f"env[{node.name!r}]"
+
+    def visit_str(self, node):
+        return repr(node.value)
+
+    def visit_window(self, node):
+        value = node.expr.accept(self)
+        return f"env['@windows'].push({node.slot}, {value}, env['@time'])"
+
+
+def generate_function(tree, generator=None, arguments='env'):
+    """Return a function ``f(env)`` that evaluates ``tree`` natively.
+
+    ``generator`` may be a CodeGenerator subclass instance whose output
+    needs more ``arguments`` than ``env``. Raises SyntaxError or
+    RecursionError when the tree is nested too deeply for the Python
+    compiler; callers fall back to the Interpreter then.
+    """
+    generator = generator or CodeGenerator()
+    body = tree.accept(generator)
+    source = f"def _kpi({arguments}):\n    return {body}\n"
+    namespace = dict(generator.constants, _operand=arithmetic_operand)
+    exec(compile(source, '<kpi>', 'exec'), namespace)
+    function = namespace['_kpi']
+    function.source = source
+    return function
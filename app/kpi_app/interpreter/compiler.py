@@ -0,0 +1,167 @@
+from contextlib import nullcontext
+from .bytecode import dump_tree, load_tree
+from .lexer import LEXERS
+from .parser import Parser
+from .interpreter import Interpreter, NodeVisitor, coerce_value
+from .optimizer import optimize_tree
+from .codegen import generate_function
+from .vectorized import NotVectorizable, evaluate_vectorized
+
+
+# 'codegen' lowers the tree to a native function, 'interpreter' walks it
+BACKENDS = ('codegen', 'interpreter')
+
+
+class ReferenceCollector(NodeVisitor):
+    """Collect the names an expression reads: ATTR and ``{attribute}`` refs."""
+
+    def __init__(self):
+        self.uses_value = False
+        self.attributes = set()
+        self.windows = []
+
+    def visit_bin_op(self, node):
+        node.left.accept(self)
+        node.right.accept(self)
+
+    def visit_num(self, node):
+        pass
+
+    def visit_unary_op(self, node):
+        node.expr.accept(self)
+
+    def visit_regex_op(self, node):
+        node.value.accept(self)
+
+    def visit_var(self, node):
+        if node.attribute:
+            self.attributes.add(node.name)
+        else:
+            self.uses_value = True
+
+    def visit_str(self, node):
+        pass
+
+    def visit_window(self, node):
+        node.expr.accept(self)
+        self.windows.append(node)
+
+
+class CompiledExpression:
+    """A KPI expression parsed once and evaluated against many values."""
+
+    def __init__(self, text, tree, backend='codegen'):
+        if backend not in BACKENDS:
+            raise ValueError(f"Unknown evaluation backend: {backend}")
+        self.text = text
+        self.tree = tree
+        self.backend = backend
+        references = ReferenceCollector()
+        tree.accept(references)
+        # Attribute names this expression depends on besides ATTR
+        self.attributes = frozenset(references.attributes)
+        self.uses_value = references.uses_value
+        # Window nodes by slot; evaluation needs a WindowState built from them
+        self.windows = sorted(references.windows,
+                              key=lambda window: window.slot)
+        self._function = None
+        if backend == 'codegen':
+            try:
+                self._function = generate_function(tree)
+            except (SyntaxError, RecursionError, MemoryError):
+                # Too deeply nested for the Python compiler
+                self.backend = 'interpreter'
+
+    def evaluate(self, value):
+        return self.evaluate_with({'ATTR': coerce_value(value)})
+
+    def evaluate_many(self, values):
+        """Evaluate a sequence of ATTR values, column-wise when possible.
+
+        Falls back to evaluating value by value when NumPy is unavailable or
+        the expression/inputs are not vectorizable, so results (and errors)
+        always match ``evaluate``.
+        """
+        try:
+            return evaluate_vectorized(self.tree, values).tolist()
+        except NotVectorizable:
+            return [self.evaluate(value) for value in values]
+
+    @property
+    def source(self):
+        """The generated Python source, or None for the interpreter backend."""
+        return self._function.source if self._function is not None else None
+
+    @property
+    def bytecode(self):
+        """Serialized form of the tree for ``load_compiled``."""
+        return dump_tree(self.text, self.tree)
+
+    @property
+    def is_stateful(self):
+        """Whether results depend on previous messages (window functions)."""
+        return bool(self.windows)
+
+    def evaluate_with(self, variables):
+        """Evaluate with ``variables`` bound.
+
+        Stateful expressions also need ``'@windows'``, the WindowState of the
+        asset, and ``'@time'``, the timestamp of the message.
+        """
+        if self.windows and '@windows' not in variables:
+            raise ValueError(
+                "Window functions need per-asset state to be evaluated.")
+        if self._function is not None:
+            try:
+                return self._function(variables)
+            except KeyError as error:
+                raise ValueError(f"Variable {error.args[0]} is not bound.")
+        return Interpreter(variables).interpret(self.tree)
+
+    def __repr__(self):
+        return f"CompiledExpression({self.text!r}, backend={self.backend!r})"
+
+
+def _untimed(stage):
+    return nullcontext()
+
+
+def parse_expression(text, lexer='scan', timed=_untimed):
+    """Lex and parse ``text`` into an AST.
+
+    ``timed(stage)`` returns a context manager wrapped around the 'lex' and
+    'parse' stages. The chain lexer produces tokens on demand, so with it
+    most lexing is counted as parsing.
+    """
+    try:
+        lexer_class = LEXERS[lexer]
+    except KeyError:
+        raise ValueError(f"Unknown lexer: {lexer}")
+    with timed('lex'):
+        tokens = lexer_class(text)
+    with timed('parse'):
+        return Parser(tokens).parse()
+
+
+def compile_expression(text, backend='codegen', lexer='scan', optimize=True,
+                       timed=_untimed):
+    """Lex, parse and optionally optimize ``text`` into a CompiledExpression.
+
+    Optimizing and code generation are timed as the 'compile' stage.
+    """
+    tree = parse_expression(text, lexer, timed)
+    with timed('compile'):
+        if optimize:
+            tree = optimize_tree(tree)
+        return CompiledExpression(text, tree, backend)
+
+
+def load_compiled(text, bytecode, backend='codegen', timed=_untimed):
+    """Rebuild a CompiledExpression of ``text`` from its ``bytecode``.
+
+    Lexing, parsing and optimizing are skipped; only code generation runs,
+    timed as the 'compile' stage. Raises ValueError for bytecode of another
+    format version or another expression.
+    """
+    with timed('compile'):
+        return CompiledExpression(text, load_tree(text, bytecode), backend)
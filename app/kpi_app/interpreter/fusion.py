@@ -0,0 +1,189 @@
+from collections import Counter
+from .parser import BinOp, Num, RegexOp, Str, UnaryOp, Var, Window
+from .interpreter import Interpreter, NodeVisitor
+from .codegen import CodeGenerator, generate_function
+
+
+class Canonicalizer(NodeVisitor):
+    """Hash-cons trees so structurally identical subtrees become one node.
+
+    Window nodes are keyed by their ``owner`` expression as well, because
+    their state belongs to a single KPI. Input trees are not modified.
+    """
+
+    def __init__(self):
+        self.nodes = {}
+        self.owner = None
+
+    def _intern(self, key, build):
+        node = self.nodes.get(key)
+        if node is None:
+            node = self.nodes[key] = build()
+        return node
+
+    def visit_bin_op(self, node):
+        left = node.left.accept(self)
+        right = node.right.accept(self)
+        return self._intern(('BinOp', node.op, id(left), id(right)),
+                            lambda: BinOp(left, node.op, right))
+
+    def visit_num(self, node):
+        return self._intern(('Num', type(node.value), node.value),
+                            lambda: node)
+
+    def visit_unary_op(self, node):
+        expr = node.expr.accept(self)
+        return self._intern(('UnaryOp', node.op, id(expr)),
+                            lambda: UnaryOp(node.op, expr))
+
+    def visit_regex_op(self, node):
+        value = node.value.accept(self)
+        return self._intern(('RegexOp', node.pattern, id(value)),
+                            lambda: RegexOp(value, node.pattern))
+
+    def visit_var(self, node):
+        return self._intern(('Var', node.attribute, node.name), lambda: node)
+
+    def visit_str(self, node):
+        return self._intern(('Str', node.value), lambda: node)
+
+    def visit_window(self, node):
+        expr = node.expr.accept(self)
+        return self._intern(('Window', self.owner, node.slot),
+                            lambda: Window(node.function, expr, node.size,
+                                           node.slot))
+
+
+def _children(node):
+    if isinstance(node, BinOp):
+        return (node.left, node.right)
+    if isinstance(node, (UnaryOp, Window)):
+        return (node.expr,)
+    if isinstance(node, RegexOp):
+        return (node.value,)
+    return ()
+
+
+def _shared_nodes(roots):
+    """Map ``id(node)`` to a memo slot for each subtree used more than once."""
+    references = Counter(id(root) for root in roots)
+    seen = set()
+    order = []
+    stack = list(roots)
+    while stack:
+        node = stack.pop()
+        if id(node) in seen:
+            continue
+        seen.add(id(node))
+        order.append(node)
+        for child in _children(node):
+            references[id(child)] += 1
+            stack.append(child)
+    # Leaves are cheaper to re-read than to memoize
+    shared = [node for node in order
+              if references[id(node)] > 1
+              and not isinstance(node, (Num, Var, Str))]
+    return {id(node): slot for slot, node in enumerate(shared)}
+
+
+class FusedCodeGenerator(CodeGenerator):
+    """CodeGenerator that reads shared subtrees from the memo ``_m``."""
+
+    def __init__(self, shared):
+        super().__init__()
+        self.shared = shared
+
+    def _memoized(self, node, source):
+        slot = self.shared.get(id(node))
+        if slot is None:
+            return source
+        return (f"(_m[{slot}] if {slot} in _m "
+                f"else _m.setdefault({slot}, {source}))")
+
+    def visit_bin_op(self, node):
+        return self._memoized(node, super().visit_bin_op(node))
+
+    def visit_unary_op(self, node):
+        return self._memoized(node, super().visit_unary_op(node))
+
+    def visit_regex_op(self, node):
+        return self._memoized(node, super().visit_regex_op(node))
+
+
+class MemoInterpreter(Interpreter):
+    """Interpreter that reads shared subtrees from a memo."""
+
+    def __init__(self, variables, memo, shared):
+        super().__init__(variables)
+        self.memo = memo
+        self.shared = shared
+
+    def _memoized(self, node, evaluate):
+        slot = self.shared.get(id(node))
+        if slot is None:
+            return evaluate(node)
+        if slot not in self.memo:
+            self.memo[slot] = evaluate(node)
+        return self.memo[slot]
+
+    def visit_bin_op(self, node):
+        return self._memoized(node, super().visit_bin_op)
+
+    def visit_unary_op(self, node):
+        return self._memoized(node, super().visit_unary_op)
+
+    def visit_regex_op(self, node):
+        return self._memoized(node, super().visit_regex_op)
+
+
+class FusedProgram:
+    """Several compiled expressions evaluated as one DAG.
+
+    Identical subtrees are merged across (and within) the expressions and
+    computed at most once per message: their values go into a memo shared
+    by every output evaluated for that message, so ``ATTR * 3600`` or a
+    Regex used by ten KPIs runs once. Errors are not memoized; an output
+    that reaches a failing subtree raises the error itself, so outputs
+    still succeed or fail independently.
+    """
+
+    def __init__(self, expressions):
+        self.expressions = list(expressions)
+        canonicalizer = Canonicalizer()
+        roots = []
+        for owner, expression in enumerate(self.expressions):
+            canonicalizer.owner = owner
+            roots.append(expression.tree.accept(canonicalizer))
+        self.node_count = len(canonicalizer.nodes)
+        self.shared = _shared_nodes(roots)
+        self._outputs = [self._compile(expression, root)
+                         for expression, root in zip(self.expressions, roots)]
+
+    def _compile(self, expression, root):
+        if expression.backend == 'codegen':
+            try:
+                return generate_function(root, FusedCodeGenerator(self.shared),
+                                         arguments='env, _m')
+            except (SyntaxError, RecursionError, MemoryError):
+                pass
+        shared = self.shared
+        return (lambda env, memo:
+                MemoInterpreter(env, memo, shared).interpret(root))
+
+    def evaluate(self, index, variables, memo):
+        """Evaluate output ``index``.
+
+        Pass the same ``memo`` dict for every output evaluated with the
+        same message; only the ``'@windows'`` entry of ``variables`` may
+        differ between them.
+        """
+        if self.expressions[index].windows and '@windows' not in variables:
+            raise ValueError(
+                "Window functions need per-asset state to be evaluated.")
+        try:
+            return self._outputs[index](variables, memo)
+        except KeyError as error:
+            raise ValueError(f"Variable {error.args[0]} is not bound.")
+
+    def __len__(self):
+        return len(self.expressions)
@@ -1,7 +1,34 @@
+import re
 from abc import ABC, abstractmethod
 from .lexer import TokenType
 from .parser import binary_operations
-import re
+
+
+# Strings read as numbers; surrounding whitespace is allowed
+INTEGER_STRING = re.compile(r"\s*[+-]?\d+\s*", re.ASCII)
+FLOAT_STRING = re.compile(
+    r"\s*[+-]?(?:\d+\.\d*|\.\d+|\d+)(?:[eE][+-]?\d+)?\s*", re.ASCII)
+
+
+def coerce_value(value):
+    """Turn numeric strings into ints or floats, as substitution used to.
+
+    ``"-4"`` and ``" 4"`` are ints and ``"3.5"`` a float; other strings
+    stay strings, which Regex can match but arithmetic rejects.
+    """
+    if isinstance(value, str):
+        if INTEGER_STRING.fullmatch(value):
+            return int(value)
+        if FLOAT_STRING.fullmatch(value):
+            return float(value)
+    return value
+
+
+def arithmetic_operand(value):
+    """Reject strings, which ``*`` and ``+`` would repeat or concatenate."""
+    if isinstance(value, str):
+        raise ValueError(f"Cannot use the string {value!r} in arithmetic.")
+    return value
 
 
 class NodeVisitor(ABC):
@@ -21,28 +48,58 @@ class NodeVisitor(ABC):
     def visit_regex_op(self, node):
         pass
 
+    @abstractmethod
+    def visit_var(self, node):
+        pass
+
+    @abstractmethod
+    def visit_str(self, node):
+        pass
+
+    @abstractmethod
+    def visit_window(self, node):
+        pass
+
 
 class Interpreter(NodeVisitor):
+    def __init__(self, variables=None):
+        self.variables = variables or {}
+
     def visit_bin_op(self, node):
-        operation = binary_operations.get(node.op.type)
+        operation = binary_operations.get(node.op)
         if not operation:
-            raise ValueError(f"Operation {node.op.type} not supported.")
-        return operation(node.left.accept(self), node.right.accept(self))
+            raise ValueError(f"Operation {node.op} not supported.")
+        return operation(arithmetic_operand(node.left.accept(self)),
+                         arithmetic_operand(node.right.accept(self)))
 
     def visit_num(self, node):
         return node.value
 
     def visit_unary_op(self, node):
-        op_type = node.op.type
+        op_type = node.op
+        operand = arithmetic_operand(node.expr.accept(self))
         if op_type == TokenType.PLUS:
-            return +node.expr.accept(self)
+            return +operand
         elif op_type == TokenType.MINUS:
-            return -node.expr.accept(self)
+            return -operand
 
     def visit_regex_op(self, node):
-        value = str(node.value.value)
-        pattern = node.pattern.value
-        return bool(re.match(pattern, value))
+        value = str(node.value.accept(self))
+        return bool(node.regex.match(value))
+
+    def visit_var(self, node):
+        try:
+            return self.variables[node.name]
+        except KeyError:
+            raise ValueError(f"Variable {node.name} is not bound.")
+
+    def visit_str(self, node):
+        return node.value
+
+    def visit_window(self, node):
+        value = node.expr.accept(self)
+        windows = self.variables['@windows']
+        return windows.push(node.slot, value, self.variables['@time'])
 
     def interpret(self, tree):
         return tree.accept(self)
@@ -1,4 +1,6 @@
+import re
 from abc import ABC, abstractmethod
+from typing import NamedTuple
 
 
 # Token Types
@@ -13,6 +15,7 @@ class TokenType:
     REGEX = 'REGEX'
     PATTERN = 'PATTERN'
     STRING = 'STRING'
+    ATTRIBUTE = 'ATTRIBUTE'
     COMMA = 'COMMA'
     EOF = 'EOF'
 
@@ -28,10 +31,15 @@ OPERATORS = {
 }
 
 
-class Token:
-    def __init__(self, type, value):
-        self.type = type
-        self.value = value
+# Characters allowed in the name of an attribute reference, ``{name}``
+ATTRIBUTE_NAME = re.compile(r"[\w.-]")
+
+
+class Token(NamedTuple):
+    """An immutable token; ``pos`` is its source offset, when known."""
+    type: str
+    value: object
+    pos: int = None
 
     def __str__(self):
         return f"Token({self.type}, {repr(self.value)})"
@@ -40,6 +48,13 @@ class Token:
         return self.__str__()
 
 
+# Shared instances of the fixed-text tokens, which have no position in Lexer
+OPERATOR_TOKENS = {text: Token(token_type, text)
+                   for text, token_type in OPERATORS.items()}
+COMMA = Token(TokenType.COMMA, ',')
+EOF = Token(TokenType.EOF, None)
+
+
 class TokenHandler(ABC):
     def __init__(self, next_handler=None):
         self.next_handler = next_handler
@@ -71,8 +86,7 @@ class RegexHandler(TokenHandler):
 class OperatorHandler(TokenHandler):
     def handle(self, lexer):
         if lexer.current_char is not None and lexer.current_char in OPERATORS:
-            token_type = OPERATORS[lexer.current_char]
-            token = Token(token_type, lexer.current_char)
+            token = OPERATOR_TOKENS[lexer.current_char]
             lexer.advance()
             return token
         elif self.next_handler:
@@ -95,11 +109,19 @@ class StringHandler(TokenHandler):
             return self.next_handler.handle(lexer)
 
 
+class AttributeHandler(TokenHandler):
+    def handle(self, lexer):
+        if lexer.current_char == '{':
+            return Token(TokenType.ATTRIBUTE, lexer.attribute())
+        elif self.next_handler:
+            return self.next_handler.handle(lexer)
+
+
 class CommaHandler(TokenHandler):
     def handle(self, lexer):
         if lexer.current_char == ',':
             lexer.advance()
-            return Token(TokenType.COMMA, ',')
+            return COMMA
         elif self.next_handler:
             return self.next_handler.handle(lexer)
 
@@ -108,10 +130,10 @@ class ParenthesisHandler(TokenHandler):
     def handle(self, lexer):
         if lexer.current_char == '(':
             lexer.advance()
-            return Token(TokenType.LPAREN, '(')
+            return OPERATOR_TOKENS['(']
         elif lexer.current_char == ')':
             lexer.advance()
-            return Token(TokenType.RPAREN, ')')
+            return OPERATOR_TOKENS[')']
         elif self.next_handler:
             return self.next_handler.handle(lexer)
 
@@ -119,7 +141,7 @@ class ParenthesisHandler(TokenHandler):
 class EOFHandler(TokenHandler):
     def handle(self, lexer):
         if lexer.current_char is None:
-            return Token(TokenType.EOF, None)
+            return EOF
         elif self.next_handler:
             return self.next_handler.handle(lexer)
 
@@ -135,9 +157,11 @@ class Lexer:
                 OperatorHandler(
                     PatternHandler(
                         StringHandler(
-                            CommaHandler(
-                                ParenthesisHandler(
-                                    EOFHandler()
+                            AttributeHandler(
+                                CommaHandler(
+                                    ParenthesisHandler(
+                                        EOFHandler()
+                                    )
                                 )
                             )
                         )
@@ -179,7 +203,90 @@ class Lexer:
             self.advance()
         return result
 
+    def attribute(self):
+        """Return the name in an attribute reference such as ``{power}``."""
+        start = self.pos
+        self.advance()
+        result = ''
+        while (self.current_char is not None
+               and ATTRIBUTE_NAME.match(self.current_char)):
+            result += self.current_char
+            self.advance()
+        if not result or self.current_char != '}':
+            raise ValueError(
+                f"Invalid attribute reference at position {start}")
+        self.advance()
+        return result
+
     def get_next_token(self):
         """Use the token handler chain to get the next token."""
         self.skip_whitespace()
         return self.token_handler_chain.handle(self)
+
+
+# Master pattern for ScanningLexer. Alternatives are tried in the same order
+# as the handler chain, so "Regex" wins over a plain STRING; anything else
+# falls through to MISMATCH. Trailing whitespace matches with no group.
+TOKEN_PATTERN = re.compile(r"""
+    \s*(?:
+        (?P<INTEGER>\d+)
+      | (?P<REGEX>Regex)
+      | (?P<OPERATOR>[-+*/(),])
+      | "(?P<PATTERN>[^"]*)"?
+      | (?P<STRING>[^\W\d_]+)
+      | \{(?P<ATTRIBUTE>[\w.-]+)\}
+      | (?P<MISMATCH>\S)
+    )?
+""", re.VERBOSE)
+
+# Fixed-text tokens, looked up instead of being rebuilt from the match
+SCANNER_OPERATORS = dict(OPERATORS, **{',': TokenType.COMMA})
+
+
+class ScanningLexer:
+    """Tokenize the whole input in one pass with TOKEN_PATTERN.
+
+    Produces the same token types as Lexer, with each token's source offset
+    in ``pos``, and exposes the same ``get_next_token`` interface.
+    """
+
+    def __init__(self, text):
+        self.text = text
+        self.tokens = self.tokenize(text)
+        self.index = 0
+
+    @staticmethod
+    def tokenize(text):
+        tokens = []
+        append = tokens.append
+        for found in TOKEN_PATTERN.finditer(text):
+            kind = found.lastgroup
+            if kind is None:
+                continue
+            value = found[kind]
+            pos = found.start(kind)
+            if kind == 'OPERATOR':
+                append(Token(SCANNER_OPERATORS[value], value, pos))
+            elif kind == 'INTEGER':
+                append(Token(TokenType.INTEGER, int(value), pos))
+            elif kind == 'MISMATCH':
+                raise ValueError(
+                    f"Unexpected character {value!r} at position {pos}"
+                )
+            else:
+                append(Token(kind, value, pos))
+        tokens.append(Token(TokenType.EOF, None, len(text)))
+        return tokens
+
+    def get_next_token(self):
+        token = self.tokens[self.index]
+        if token.type != TokenType.EOF:
+            self.index += 1
+        return token
+
+
+# Lexer implementations selectable by name
+LEXERS = {
+    'chain': Lexer,
+    'scan': ScanningLexer,
+}
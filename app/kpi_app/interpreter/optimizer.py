@@ -0,0 +1,101 @@
+from .lexer import TokenType
+from .parser import BinOp, Num, UnaryOp, Window, binary_operations
+from .interpreter import NodeVisitor
+
+
+def _is_constant(node, value):
+    return isinstance(node, Num) and node.value == value
+
+
+def _is_numeric(node):
+    """Whether ``node`` always evaluates to a number (never a bool/string)."""
+    return isinstance(node, (Num, BinOp, UnaryOp))
+
+
+def _identity(operand):
+    # ``ATTR * 1`` turns a boolean ATTR into an integer; unary plus does
+    # the same more cheaply, so it is only dropped for numeric operands
+    if _is_numeric(operand):
+        return operand
+    return UnaryOp(TokenType.PLUS, operand)
+
+
+class Optimizer(NodeVisitor):
+    """Rewrite an AST into an equivalent tree that is cheaper to evaluate.
+
+    Constant subtrees are folded, ``x * 1``, ``x + 0``, ``x - 0`` and ``+x``
+    are dropped and double negation collapses. ``x / 1`` is left alone as
+    floor division changes floats, and division by a constant zero is kept
+    so it still raises for every message. Unchanged subtrees are shared
+    with the input tree, which is never modified.
+    """
+
+    def visit_bin_op(self, node):
+        left = node.left.accept(self)
+        right = node.right.accept(self)
+        op_type = node.op
+
+        if isinstance(left, Num) and isinstance(right, Num):
+            if not (op_type == TokenType.DIV and right.value == 0):
+                return Num(binary_operations[op_type](left.value, right.value))
+
+        if op_type == TokenType.MUL:
+            if _is_constant(right, 1):
+                return _identity(left)
+            if _is_constant(left, 1):
+                return _identity(right)
+        elif op_type == TokenType.PLUS:
+            if _is_constant(right, 0):
+                return _identity(left)
+            if _is_constant(left, 0):
+                return _identity(right)
+        elif op_type == TokenType.MINUS and _is_constant(right, 0):
+            return _identity(left)
+
+        if left is node.left and right is node.right:
+            return node
+        return BinOp(left, node.op, right)
+
+    def visit_num(self, node):
+        return node
+
+    def visit_unary_op(self, node):
+        operand = node.expr.accept(self)
+        op_type = node.op
+
+        if isinstance(operand, Num):
+            return Num(-operand.value if op_type == TokenType.MINUS
+                       else +operand.value)
+        if op_type == TokenType.PLUS:
+            return _identity(operand)
+        if isinstance(operand, UnaryOp):
+            if operand.op == TokenType.MINUS:
+                return _identity(operand.expr)
+            # -(+x) is -x for every type
+            operand = operand.expr
+
+        if operand is node.expr:
+            return node
+        return UnaryOp(node.op, operand)
+
+    def visit_regex_op(self, node):
+        # The value is always a leaf and the pattern is compiled already
+        return node
+
+    def visit_var(self, node):
+        return node
+
+    def visit_str(self, node):
+        return node
+
+    def visit_window(self, node):
+        # The window itself must stay: it has to see every message
+        expr = node.expr.accept(self)
+        if expr is node.expr:
+            return node
+        return Window(node.function, expr, node.size, node.slot)
+
+
+def optimize_tree(tree):
+    """Return an optimized copy of ``tree``; see Optimizer."""
+    return tree.accept(Optimizer())
@@ -1,5 +1,8 @@
 import operator
+import sys
 from .lexer import TokenType
+from .patterns import compile_pattern
+from .windows import MAX_WINDOW_SIZE, WINDOW_FUNCTIONS
 from abc import ABC, abstractmethod
 
 
@@ -18,54 +21,132 @@ class OperatorFactory:
     @staticmethod
     def create(left, token, right):
         if token.type in binary_operations:
-            return BinOp(left, token, right)
+            return BinOp(left, token.type, right)
         else:
             raise ValueError(f"Unsupported operator: {token.type}")
 
 
 class ASTNode(ABC):
+    """Base of the immutable tree nodes.
+
+    Nodes keep only what evaluation needs in ``__slots__``, operators as
+    their TokenType code rather than the token they were parsed from, so
+    the trees of thousands of cached KPIs stay small. They are never
+    modified once built; optimizing and fusing build new nodes and share
+    unchanged subtrees, which immutability makes safe.
+    """
+    __slots__ = ()
+
+    def __setattr__(self, name, value):
+        raise AttributeError(f"{type(self).__name__} nodes are immutable")
+
+    __delattr__ = __setattr__
+
     @abstractmethod
     def accept(self, visitor):
         pass
 
 
+_set = object.__setattr__
+
+
 class BinOp(ASTNode):
+    __slots__ = ('left', 'op', 'right')
+
     def __init__(self, left, op, right):
-        self.left = left
-        self.op = op
-        self.right = right
+        _set(self, 'left', left)
+        _set(self, 'op', op)
+        _set(self, 'right', right)
 
     def accept(self, visitor):
         return visitor.visit_bin_op(self)
 
 
 class Num(ASTNode):
-    def __init__(self, token):
-        self.token = token
-        self.value = token.value
+    __slots__ = ('value',)
+
+    def __init__(self, value):
+        _set(self, 'value', value)
 
     def accept(self, visitor):
         return visitor.visit_num(self)
 
 
 class UnaryOp(ASTNode):
+    __slots__ = ('op', 'expr')
+
     def __init__(self, op, expr):
-        self.op = op
-        self.expr = expr
+        _set(self, 'op', op)
+        _set(self, 'expr', expr)
 
     def accept(self, visitor):
         return visitor.visit_unary_op(self)
 
 
+class Var(ASTNode):
+    """Reference to a value bound at evaluation time.
+
+    Either ``ATTR``, the value of the message being evaluated, or an
+    attribute reference like ``{power}`` (``attribute`` set), the asset's
+    latest value of that attribute.
+    """
+    __slots__ = ('name', 'attribute')
+
+    def __init__(self, name, attribute=False):
+        _set(self, 'name', name)
+        _set(self, 'attribute', attribute)
+
+    def accept(self, visitor):
+        return visitor.visit_var(self)
+
+
+class Str(ASTNode):
+    __slots__ = ('value',)
+
+    def __init__(self, value):
+        _set(self, 'value', value)
+
+    def accept(self, visitor):
+        return visitor.visit_str(self)
+
+
 class RegexOp(ASTNode):
+    __slots__ = ('value', 'regex')
+
     def __init__(self, value, pattern):
-        self.value = value
-        self.pattern = pattern
+        _set(self, 'value', value)
+        _set(self, 'regex', compile_pattern(pattern))
+
+    @property
+    def pattern(self):
+        return self.regex.pattern
 
     def accept(self, visitor):
         return visitor.visit_regex_op(self)
 
 
+class Window(ASTNode):
+    """Window function such as ``AVG(expr, 10)`` over successive messages.
+
+    ``slot`` numbers the windows of one expression; it selects the
+    accumulator in the per-asset WindowState that evaluation updates.
+    """
+    __slots__ = ('function', 'expr', 'size', 'slot')
+
+    def __init__(self, function, expr, size, slot):
+        _set(self, 'function', function)
+        _set(self, 'expr', expr)
+        _set(self, 'size', size)
+        _set(self, 'slot', slot)
+
+    def accept(self, visitor):
+        return visitor.visit_window(self)
+
+
+# Names that are bound to the incoming message value at evaluation time
+VARIABLES = {'ATTR'}
+
+
 # Define operator precedence
 PRECEDENCE = {
     'PLUS': 1,
@@ -81,6 +162,7 @@ class Parser:
     def __init__(self, lexer):
         self.lexer = lexer
         self.current_token = self.lexer.get_next_token()
+        self.window_count = 0
 
     def eat(self, token_type):
         if self.current_token.type == token_type:
@@ -92,7 +174,10 @@ class Parser:
         token = self.current_token
         if token.type == TokenType.INTEGER:
             self.eat(TokenType.INTEGER)
-            return Num(token)
+            return Num(token.value)
+        elif token.type in (TokenType.PLUS, TokenType.MINUS):
+            self.eat(token.type)
+            return UnaryOp(token.type, self.factor())
         elif token.type == TokenType.LPAREN:
             self.eat(TokenType.LPAREN)
             node = self.expr()
@@ -100,25 +185,71 @@ class Parser:
             return node
         elif token.type == TokenType.REGEX:
             return self.regex_operation()
+        elif token.type == TokenType.STRING and token.value in VARIABLES:
+            self.eat(TokenType.STRING)
+            return Var(sys.intern(token.value))
+        elif token.type == TokenType.ATTRIBUTE:
+            return self.attribute_reference()
+        elif (token.type == TokenType.STRING
+              and token.value in WINDOW_FUNCTIONS):
+            return self.window_function()
+        raise ValueError("Invalid syntax")
+
+    def attribute_reference(self):
+        """Parse ``{name}``: the latest value of another asset attribute."""
+        token = self.current_token
+        self.eat(TokenType.ATTRIBUTE)
+        if token.value in VARIABLES:
+            raise ValueError(
+                f"{token.value} cannot be used as an attribute name")
+        return Var(sys.intern(token.value), attribute=True)
+
+    def window_function(self):
+        """Parse ``AVG(expr, N)``-style calls; DELTA and RATE take no N."""
+        token = self.current_token
+        self.eat(TokenType.STRING)
+        self.eat(TokenType.LPAREN)
+        expr = self.expr()
+        size = None
+        if WINDOW_FUNCTIONS[token.value].sized:
+            self.eat(TokenType.COMMA)
+            size = self.current_token.value
+            self.eat(TokenType.INTEGER)
+            if not 1 <= size <= MAX_WINDOW_SIZE:
+                raise ValueError(
+                    f"{token.value} window size must be between 1 and "
+                    f"{MAX_WINDOW_SIZE}"
+                )
+        self.eat(TokenType.RPAREN)
+        node = Window(sys.intern(token.value), expr, size, self.window_count)
+        self.window_count += 1
+        return node
 
     def regex_operation(self):
         """Parse a regex operation: Regex(value, "pattern")"""
         self.eat(TokenType.REGEX)
         self.eat(TokenType.LPAREN)
-        value_token = self.current_token  # Get the actual value in place of ATTR
+        value_token = self.current_token
         if value_token.type == TokenType.STRING:
             self.eat(TokenType.STRING)
+            if value_token.value in VARIABLES:
+                value = Var(sys.intern(value_token.value))
+            else:
+                value = Str(value_token.value)
         elif value_token.type == TokenType.INTEGER:
             self.eat(TokenType.INTEGER)
+            value = Num(value_token.value)
+        elif value_token.type == TokenType.ATTRIBUTE:
+            value = self.attribute_reference()
         else:
-            raise ValueError("Expected a STRING or INTEGER token")
+            raise ValueError("Expected a STRING, INTEGER or ATTRIBUTE token")
 
         self.eat(TokenType.COMMA)  # Expect comma here
 
         pattern = self.current_token
         self.eat(TokenType.PATTERN)
         self.eat(TokenType.RPAREN)
-        return RegexOp(value_token, pattern)
+        return RegexOp(value, pattern.value)
 
     def parse_expression(self, precedence_level=1):
         node = self.factor()
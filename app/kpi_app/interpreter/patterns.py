@@ -0,0 +1,22 @@
+import re
+from django.conf import settings
+from .cache import LRUCache
+
+
+def _compile(pattern):
+    try:
+        return re.compile(pattern)
+    except re.error as error:
+        raise ValueError(f"Invalid regex pattern {pattern!r}: {error}")
+
+
+# Compiled Regex(...) patterns shared by every expression in the process.
+# Unlike the re module's internal cache this one is sized for the number of
+# distinct KPI patterns and reports how many are live.
+pattern_cache = LRUCache(
+    _compile, maxsize=getattr(settings, 'KPI_PATTERN_CACHE_SIZE', 4096))
+
+
+def compile_pattern(pattern):
+    """Compiled form of ``pattern``; raises ValueError if it is invalid."""
+    return pattern_cache.get(pattern)
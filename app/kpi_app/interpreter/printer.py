@@ -0,0 +1,49 @@
+from .interpreter import NodeVisitor
+
+
+class TreePrinter(NodeVisitor):
+    """Render an AST as indented lines, one node per line."""
+
+    def __init__(self, indent="  "):
+        self.indent = indent
+        self.lines = []
+        self._depth = 0
+
+    def _node(self, label, *children):
+        self.lines.append(self.indent * self._depth + label)
+        self._depth += 1
+        for child in children:
+            child.accept(self)
+        self._depth -= 1
+
+    def visit_bin_op(self, node):
+        self._node(f"BinOp {node.op}", node.left, node.right)
+
+    def visit_num(self, node):
+        self._node(f"Num {node.value!r}")
+
+    def visit_unary_op(self, node):
+        self._node(f"UnaryOp {node.op}", node.expr)
+
+    def visit_regex_op(self, node):
+        self._node(f"Regex {node.pattern!r}", node.value)
+
+    def visit_var(self, node):
+        if node.attribute:
+            self._node(f"Var {{{node.name}}}")
+        else:
+            self._node(f"Var {node.name}")
+
+    def visit_str(self, node):
+        self._node(f"Str {node.value!r}")
+
+    def visit_window(self, node):
+        size = f" {node.size}" if node.size is not None else ""
+        self._node(f"Window {node.function}{size}", node.expr)
+
+
+def format_tree(tree):
+    """Return the lines TreePrinter renders for ``tree``."""
+    printer = TreePrinter()
+    tree.accept(printer)
+    return printer.lines
@@ -0,0 +1,169 @@
+from .interpreter import NodeVisitor, coerce_value
+
+try:
+    import numpy as np
+except ImportError:  # NumPy is optional; callers fall back to scalar mode
+    np = None
+
+
+# Largest magnitude int64 arithmetic may produce without overflowing
+INT64_LIMIT = 2 ** 63 - 1
+
+
+class NotVectorizable(Exception):
+    """The expression or its inputs cannot be evaluated column-wise."""
+
+
+def to_column(values):
+    """Convert input values to a 1-D array with coerce_value semantics.
+
+    Numeric arrays are used as they are. Other values are coerced one by
+    one like ``evaluate`` does, and must then all be ints, all floats or
+    all strings: a column mixing them would be converted to one dtype by
+    NumPy and give results the scalar backends don't.
+    """
+    if isinstance(values, np.ndarray):
+        if values.ndim != 1:
+            raise NotVectorizable("Expected a 1-D array of values.")
+        if values.dtype.kind in 'if':
+            return values
+        if values.dtype.kind == 'u':
+            if values.size and int(values.max()) > INT64_LIMIT:
+                raise NotVectorizable("Unsigned values exceed int64.")
+            return values.astype(np.int64)
+        values = values.tolist()
+
+    values = [coerce_value(value) for value in values]
+    kinds = {type(value) for value in values}
+    if kinds <= {int}:
+        try:
+            return np.array(values, dtype=np.int64)
+        except OverflowError:
+            raise NotVectorizable("Integers exceed int64.")
+    if kinds == {float}:
+        return np.array(values, dtype=np.float64)
+    if kinds == {str}:
+        return np.array(values, dtype=str)
+    raise NotVectorizable("Mixed or unsupported value types.")
+
+
+def _numeric(operand):
+    """Regex results are bools; promote them so arithmetic matches Python."""
+    if isinstance(operand, np.ndarray):
+        if operand.dtype == bool:
+            return operand.astype(np.int64)
+        if operand.dtype.kind not in 'iuf':
+            raise NotVectorizable("Arithmetic on non-numeric values.")
+    elif isinstance(operand, bool):
+        return int(operand)
+    elif not isinstance(operand, (int, float)):
+        raise NotVectorizable("Arithmetic on non-numeric values.")
+    return operand
+
+
+def _magnitude(operand):
+    if isinstance(operand, np.ndarray):
+        if operand.size == 0:
+            return 0
+        return int(np.abs(operand).max())
+    return abs(int(operand))
+
+
+def _is_integral(operand):
+    if isinstance(operand, np.ndarray):
+        return operand.dtype.kind in 'iu'
+    return isinstance(operand, int)
+
+
+class VectorizedEvaluator(NodeVisitor):
+    """Evaluate a tree over whole columns of values with NumPy ufuncs.
+
+    Anything whose result could differ from the scalar backends (int64
+    overflow, division by zero, arithmetic on strings) raises
+    NotVectorizable instead of returning an approximation.
+    """
+
+    def __init__(self, columns):
+        self.columns = columns
+
+    def visit_bin_op(self, node):
+        left = _numeric(node.left.accept(self))
+        right = _numeric(node.right.accept(self))
+        op_type = node.op
+
+        if _is_integral(left) and _is_integral(right):
+            bound = {
+                'PLUS': lambda a, b: a + b,
+                'MINUS': lambda a, b: a + b,
+                'MUL': lambda a, b: a * b,
+                'DIV': lambda a, b: a,
+            }.get(op_type)
+            limit = bound and bound(_magnitude(left), _magnitude(right))
+            if limit and limit > INT64_LIMIT:
+                raise NotVectorizable("Result may overflow int64.")
+
+        if op_type == 'PLUS':
+            return np.add(left, right)
+        elif op_type == 'MINUS':
+            return np.subtract(left, right)
+        elif op_type == 'MUL':
+            return np.multiply(left, right)
+        elif op_type == 'DIV':
+            if np.any(np.asarray(right) == 0):
+                # Let the scalar backend raise ZeroDivisionError per value
+                raise NotVectorizable("Division by zero.")
+            return np.floor_divide(left, right)
+        raise ValueError(f"Operation {op_type} not supported.")
+
+    def visit_num(self, node):
+        return node.value
+
+    def visit_unary_op(self, node):
+        operand = _numeric(node.expr.accept(self))
+        if node.op == 'PLUS':
+            return np.positive(operand)
+        elif node.op == 'MINUS':
+            return np.negative(operand)
+        raise ValueError(f"Operation {node.op} not supported.")
+
+    def visit_regex_op(self, node):
+        value = node.value.accept(self)
+        pattern = node.regex
+        if not isinstance(value, np.ndarray):
+            return bool(pattern.match(str(value)))
+        if value.dtype == bool:
+            raise NotVectorizable("Regex over boolean values.")
+        strings = value if value.dtype.kind == 'U' else value.astype(str)
+        match = np.frompyfunc(
+            lambda string: pattern.match(string) is not None, 1, 1
+        )
+        return match(strings).astype(bool)
+
+    def visit_var(self, node):
+        try:
+            return self.columns[node.name]
+        except KeyError:
+            raise ValueError(f"Variable {node.name} is not bound.")
+
+    def visit_str(self, node):
+        return node.value
+
+    def visit_window(self, node):
+        raise NotVectorizable("Window functions depend on previous messages.")
+
+
+def evaluate_vectorized(tree, values):
+    """Evaluate ``tree`` for every value in ``values`` in a single pass.
+
+    Returns a NumPy array with one result per input value. Raises
+    NotVectorizable when NumPy is missing or the scalar backends would be
+    needed to reproduce the exact result.
+    """
+    if np is None:
+        raise NotVectorizable("NumPy is not installed.")
+    column = to_column(values)
+    result = tree.accept(VectorizedEvaluator({'ATTR': column}))
+    result = np.broadcast_to(result, column.shape).copy()
+    if result.dtype.kind not in 'iufb':
+        raise NotVectorizable("Expression does not produce numeric results.")
+    return result
@@ -0,0 +1,188 @@
+from collections import deque
+from threading import Lock
+
+
+# Upper bound on N in AVG(x, N) and friends, to bound per-asset memory
+MAX_WINDOW_SIZE = 100000
+
+
+def _is_number(value):
+    return isinstance(value, (int, float))
+
+
+class MovingSum:
+    """Sum of the last ``size`` values, kept in a ring buffer."""
+
+    sized = True
+
+    def __init__(self, size):
+        self.size = size
+        self.values = deque(maxlen=size)
+        self.total = 0
+        self._pushes = 0
+
+    def push(self, value, timestamp):
+        # Add first: a value that cannot be added leaves the window as it was
+        total = self.total + value
+        if len(self.values) == self.size:
+            total -= self.values[0]
+        self.values.append(value)
+        self.total = total
+        self._pushes += 1
+        if self._pushes >= self.size:
+            # Re-add from scratch once per window so float error cannot
+            # build up
+            self.total = sum(self.values)
+            self._pushes = 0
+        return self.total
+
+    def dump(self):
+        return {"values": list(self.values)}
+
+    def restore(self, state):
+        # Checkpoints written before values were checked may hold strings
+        values = [value for value in state["values"] if _is_number(value)]
+        for value in values[-self.size:]:
+            self.push(value, None)
+
+
+class MovingAverage(MovingSum):
+    def push(self, value, timestamp):
+        return super().push(value, timestamp) / len(self.values)
+
+
+class MovingMin:
+    """Minimum of the last ``size`` values using a monotonic deque.
+
+    The deque holds ``(position, value)`` pairs with increasing values, so
+    the front is the minimum and each value is added and dropped once.
+    """
+
+    sized = True
+
+    def __init__(self, size):
+        self.size = size
+        self.window = deque()
+        self.position = 0
+
+    @staticmethod
+    def keeps(kept, value):
+        return kept < value
+
+    def push(self, value, timestamp):
+        window = self.window
+        while window and not self.keeps(window[-1][1], value):
+            window.pop()
+        window.append((self.position, value))
+        if window[0][0] <= self.position - self.size:
+            window.popleft()
+        self.position += 1
+        return window[0][1]
+
+    def dump(self):
+        return {"window": [list(entry) for entry in self.window],
+                "position": self.position}
+
+    def restore(self, state):
+        self.window = deque(tuple(entry) for entry in state["window"]
+                            if _is_number(entry[1]))
+        self.position = state["position"]
+
+
+class MovingMax(MovingMin):
+    @staticmethod
+    def keeps(kept, value):
+        return kept > value
+
+
+class Delta:
+    """Change since the previous value; 0 for the first one."""
+
+    sized = False
+
+    def __init__(self, size=None):
+        self.previous = None
+
+    def push(self, value, timestamp):
+        previous = value if self.previous is None else self.previous
+        delta = value - previous
+        self.previous = value
+        return delta
+
+    def dump(self):
+        return {"previous": self.previous}
+
+    def restore(self, state):
+        previous = state["previous"]
+        self.previous = previous if _is_number(previous) else None
+
+
+class Rate:
+    """Change per second since the previous value; 0.0 for the first one."""
+
+    sized = False
+
+    def __init__(self, size=None):
+        self.previous = None
+        self.previous_time = None
+
+    def push(self, value, timestamp):
+        seconds = timestamp.timestamp()
+        if self.previous is None:
+            rate = 0.0
+        elif seconds <= self.previous_time:
+            raise ValueError("RATE needs readings with increasing timestamps.")
+        else:
+            rate = (value - self.previous) / (seconds - self.previous_time)
+        self.previous = value
+        self.previous_time = seconds
+        return rate
+
+    def dump(self):
+        return {"previous": self.previous, "previous_time": self.previous_time}
+
+    def restore(self, state):
+        previous = state["previous"]
+        if _is_number(previous):
+            self.previous = previous
+            self.previous_time = state["previous_time"]
+
+
+WINDOW_FUNCTIONS = {
+    'AVG': MovingAverage,
+    'SUM': MovingSum,
+    'MIN': MovingMin,
+    'MAX': MovingMax,
+    'DELTA': Delta,
+    'RATE': Rate,
+}
+
+
+class WindowState:
+    """Accumulators for every window function of one expression.
+
+    One instance exists per (asset, KPI); ``push`` is what evaluating a
+    Window node calls, so every message updates each aggregate in constant
+    (amortized) time. Hold ``lock`` while evaluating. Values that are
+    not numbers are rejected before any accumulator sees them.
+    """
+
+    def __init__(self, expression, windows):
+        self.expression = expression
+        self.functions = [WINDOW_FUNCTIONS[window.function](window.size)
+                          for window in windows]
+        self.lock = Lock()
+
+    def push(self, slot, value, timestamp):
+        if not _is_number(value):
+            raise ValueError(f"Window functions need numbers, not {value!r}.")
+        return self.functions[slot].push(value, timestamp)
+
+    def dump(self):
+        return [function.dump() for function in self.functions]
+
+    def restore(self, states):
+        if len(states) != len(self.functions):
+            raise ValueError("Window state does not match the expression.")
+        for function, state in zip(self.functions, states):
+            function.restore(state)
@@ -0,0 +1,148 @@
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from datetime import timedelta
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+from kpi_app.backfill import (
+    Checkpoint,
+    evaluate_shard,
+    plan_shards,
+    setup_worker,
+)
+from kpi_app.models import KPI
+
+
+def parse_time(value):
+    parsed = parse_datetime(value)
+    if parsed is None:
+        raise CommandError(f"Invalid time {value!r}; use ISO 8601.")
+    if timezone.is_naive(parsed):
+        parsed = timezone.make_aware(parsed)
+    return parsed
+
+
+class Command(BaseCommand):
+    help = (
+        "Re-evaluate a KPI over the archived readings (KPI_ARCHIVE_READINGS) "
+        "of its linked assets between --start and --end, overwriting the "
+        "results it stored for the same readings. Work is split by asset and "
+        "time across worker processes; completed shards are checkpointed so "
+        "an interrupted run resumes where it stopped."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('kpi', type=int,
+                            help="ID of the KPI to re-evaluate.")
+        parser.add_argument('--start', required=True, type=parse_time)
+        parser.add_argument('--end', type=parse_time, help="Defaults to now.")
+        parser.add_argument('--workers', type=int, default=getattr(
+            settings, 'KPI_BACKFILL_WORKERS', 4),
+            help="Worker processes; 0 evaluates in this process.")
+        parser.add_argument('--shard-hours', type=float, default=24 * 7,
+                            help="Time slice per shard for KPIs without "
+                                 "state.")
+        parser.add_argument('--chunk-size', type=int, default=getattr(
+            settings, 'KPI_BACKFILL_CHUNK_SIZE', 2000))
+        parser.add_argument('--retries', type=int, default=2,
+                            help="Times a failed shard is retried, e.g. after "
+                                 "a lock timeout.")
+        parser.add_argument('--checkpoint', help="Checkpoint file of the run.")
+        parser.add_argument('--restart', action='store_true',
+                            help="Ignore an existing checkpoint.")
+
+    def handle(self, *args, **options):
+        try:
+            kpi = KPI.objects.get(pk=options['kpi'])
+        except KPI.DoesNotExist:
+            raise CommandError(f"KPI {options['kpi']} does not exist.")
+        start = options['start']
+        end = options['end'] or timezone.now()
+        if start >= end:
+            raise CommandError("--start must be before --end.")
+        span = timedelta(hours=options['shard_hours'])
+        if span <= timedelta(0):
+            raise CommandError("--shard-hours must be positive.")
+        try:
+            shards = plan_shards(kpi, start, end, span)
+        except ValueError as error:
+            raise CommandError(str(error))
+
+        checkpoint = Checkpoint(
+            options['checkpoint']
+            or str(settings.BASE_DIR / f"backfill_kpi_{kpi.pk}.json"),
+            {"kpi": kpi.pk, "expression": kpi.expression,
+             "start": start.isoformat(), "end": end.isoformat(),
+             "shard_hours": options['shard_hours']},
+        )
+        if options['restart']:
+            checkpoint.remove()
+        elif not checkpoint.load():
+            raise CommandError(f"{checkpoint.path} belongs to a different "
+                               "backfill; pass --restart to discard it.")
+        pending = [shard for shard in shards
+                   if shard.key not in checkpoint.done]
+        self.stdout.write(f"KPI {kpi.pk}: {len(shards)} shard(s), "
+                          f"{len(shards) - len(pending)} already done.")
+
+        totals = {"readings": 0, "created": 0, "updated": 0, "errors": 0}
+        for attempt in range(options['retries'] + 1):
+            if attempt and pending:
+                self.stderr.write(f"Retrying {len(pending)} failed shard(s).")
+            pending = self.run(kpi, pending, options, checkpoint, totals,
+                               len(shards))
+        self.stdout.write(
+            f"Re-evaluated {totals['readings']} reading(s): "
+            f"{totals['created']} result(s) created, {totals['updated']} "
+            f"updated, {totals['errors']} error(s).")
+        if pending:
+            raise CommandError(f"{len(pending)} shard(s) failed; run the "
+                               "command again to retry them.")
+        checkpoint.remove()
+
+    def run(self, kpi, shards, options, checkpoint, totals, total):
+        """Evaluate ``shards`` and return the ones that failed."""
+        arguments = (kpi.pk, kpi.expression)
+        chunk_size = options['chunk_size']
+        if options['workers'] <= 0:
+            for shard in shards:
+                summary = evaluate_shard(*arguments, shard, chunk_size)
+                self.done(shard, summary, checkpoint, totals, total)
+            return []
+        if not shards:
+            return []
+
+        # Workers must open their own connections rather than share ours
+        connections.close_all()
+        failed = []
+        with ProcessPoolExecutor(max_workers=options['workers'],
+                                 initializer=setup_worker) as pool:
+            futures = {pool.submit(evaluate_shard, *arguments, shard,
+                                   chunk_size): shard
+                       for shard in shards}
+            try:
+                for future in as_completed(futures):
+                    shard = futures[future]
+                    try:
+                        summary = future.result()
+                    except Exception as error:
+                        failed.append(shard)
+                        self.stderr.write(f"{shard!r} failed: {error}")
+                        continue
+                    self.done(shard, summary, checkpoint, totals, total)
+            except KeyboardInterrupt:
+                pool.shutdown(cancel_futures=True)
+                raise CommandError(
+                    "Interrupted; run the command again to resume.")
+        return failed
+
+    def done(self, shard, summary, checkpoint, totals, total):
+        checkpoint.complete(shard)
+        for key in totals:
+            totals[key] += summary[key]
+        self.stdout.write(
+            f"[{len(checkpoint.done)}/{total}] {shard.asset_id} from "
+            f"{shard.start.isoformat()}: {summary['readings']} reading(s), "
+            f"{summary['created']} created, {summary['updated']} updated, "
+            f"{summary['errors']} error(s)")
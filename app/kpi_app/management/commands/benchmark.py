@@ -0,0 +1,131 @@
+import json
+import os
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test.utils import setup_test_environment, teardown_test_environment
+from kpi_app import benchmarks
+
+
+class Command(BaseCommand):
+    help = (
+        "Time the lexer, parser, interpreter, parse_timestamp and the "
+        "evaluate path against SQLite, measure the memory of a cached KPI, "
+        "print the results as JSON and compare them with the stored "
+        "baseline. Database benchmarks run against a throwaway test "
+        "database, never the configured one."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('names', nargs='*',
+                            help="Only run benchmarks whose name contains "
+                                 "one of these.")
+        parser.add_argument('--repeat', type=int, default=5)
+        parser.add_argument('--scale', type=float, default=1.0,
+                            help="Multiply the number of calls per round.")
+        parser.add_argument('--output',
+                            help="Write the JSON results to this file.")
+        parser.add_argument('--baseline', default=str(getattr(
+            settings, 'KPI_BENCHMARK_BASELINE',
+            settings.BASE_DIR / 'benchmark_baseline.json')))
+        parser.add_argument('--threshold', type=float,
+                            default=getattr(settings,
+                                            'KPI_BENCHMARK_THRESHOLD', 0.2),
+                            help="Allowed slowdown before a benchmark counts "
+                                 "as a regression.")
+        parser.add_argument('--save-baseline', action='store_true',
+                            help="Store these results as the new baseline.")
+        parser.add_argument('--list', action='store_true')
+
+    def handle(self, *args, **options):
+        selected = benchmarks.select(options['names'])
+        memory = benchmarks.select_memory(options['names'])
+        if options['list']:
+            for bench in selected:
+                self.stdout.write(bench.name)
+            if memory:
+                self.stdout.write(benchmarks.MEMORY_BENCHMARK)
+            return
+        if not selected and not memory:
+            raise CommandError("No benchmark matches.")
+
+        results = {"environment": benchmarks.environment(),
+                   "benchmarks": self.run(selected, options)}
+        if memory:
+            results["memory"] = {
+                benchmarks.MEMORY_BENCHMARK: self.measure_memory()}
+        if options['output']:
+            benchmarks.save(results, options['output'])
+        else:
+            self.stdout.write(json.dumps(results, indent=2, sort_keys=True))
+
+        if options['save_baseline']:
+            benchmarks.save(results, options['baseline'])
+            self.stderr.write(f"Baseline saved to {options['baseline']}.")
+        elif os.path.exists(options['baseline']):
+            self.report(results, benchmarks.load(options['baseline']),
+                        options['threshold'])
+        else:
+            self.stderr.write(f"No baseline at {options['baseline']}; "
+                              "run with --save-baseline to store one.")
+
+    def run(self, selected, options):
+        timed = {}
+        database = [bench for bench in selected if bench.database]
+        for bench in selected:
+            if not bench.database:
+                timed[bench.name] = self.measure(bench, options)
+        if not database:
+            return timed
+
+        # Without DEBUG the connection does not keep every query it ran
+        setup_test_environment(debug=False)
+        old_name = connection.creation.create_test_db(verbosity=0,
+                                                      autoclobber=True)
+        try:
+            for bench in database:
+                timed[bench.name] = self.measure(bench, options)
+        finally:
+            connection.creation.destroy_test_db(old_name, verbosity=0)
+            teardown_test_environment()
+        return timed
+
+    def measure(self, bench, options):
+        result = benchmarks.measure(bench, options['repeat'], options['scale'])
+        self.stderr.write(f"{bench.name:<40}{result['throughput']:14.1f} "
+                          f"{result['unit']}")
+        return result
+
+    def measure_memory(self):
+        result = benchmarks.measure_memory()
+        self.stderr.write(f"{benchmarks.MEMORY_BENCHMARK:<40}"
+                          f"{result['bytes_per_kpi']:14.1f} bytes/KPI "
+                          f"({result['tree_bytes_per_kpi']:.1f} in the tree)")
+        return result
+
+    def report(self, results, baseline, threshold):
+        changed = {key for key, value in results["environment"].items()
+                   if baseline.get("environment", {}).get(key) != value}
+        if changed:
+            self.stderr.write("Baseline was recorded with a different "
+                              f"{', '.join(sorted(changed))}.")
+
+        regressions = []
+        for name, before, after, change, regressed in benchmarks.compare(
+                results, baseline, threshold):
+            flag = '  REGRESSION' if regressed else ''
+            self.stderr.write(f"{name:<40}{before * 1e6:12.2f}us -> "
+                              f"{after * 1e6:10.2f}us {change:+8.1%}{flag}")
+            if regressed:
+                regressions.append(name)
+        memory = benchmarks.compare_memory(results, baseline, threshold)
+        for name, before, after, change, regressed in memory:
+            flag = '  REGRESSION' if regressed else ''
+            self.stderr.write(f"{name:<40}{before:12.1f}B  -> {after:10.1f}B  "
+                              f"{change:+8.1%}{flag}")
+            if regressed:
+                regressions.append(name)
+        if regressions:
+            raise CommandError(f"{len(regressions)} benchmark(s) slower or "
+                               f"larger than the baseline by more than "
+                               f"{threshold:.0%}: {', '.join(regressions)}")
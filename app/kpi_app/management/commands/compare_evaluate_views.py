@@ -0,0 +1,91 @@
+import json
+import time
+import urllib.error
+import urllib.request
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta, timezone
+from django.core.management.base import BaseCommand
+from django.db.models import Max
+from django.urls import reverse
+from kpi_app.models import KPI, EvaluationResult, KPIAssetLink
+
+
+class Command(BaseCommand):
+    help = (
+        "Load a running server with concurrent requests and report "
+        "requests/sec for the sync and async evaluate endpoints. Serve the "
+        "project through ASGI (e.g. uvicorn app.asgi:application) for the "
+        "async numbers to be meaningful."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--url', default='http://127.0.0.1:8000')
+        parser.add_argument('--requests', type=int, default=1000)
+        parser.add_argument('--concurrency', type=int, default=32)
+        parser.add_argument('--asset-id', default='loadtest-asset')
+
+    def handle(self, *args, **options):
+        asset_id = options['asset_id']
+        self.ensure_link(asset_id)
+        # Every request carries a timestamp not stored yet, so each one is
+        # evaluated and stored instead of being answered as a duplicate
+        start = self.first_unused_second(asset_id)
+        bodies = [json.dumps({"message": {
+            "asset_id": asset_id,
+            "attribute_id": "1",
+            "timestamp": (start + timedelta(seconds=index)).strftime(
+                "%Y-%m-%dT%H:%M:%SZ[UTC]"),
+            "value": 5,
+        }}).encode() for index in range(2 * options['requests'])]
+
+        endpoints = (
+            ('sync', reverse('evaluate-linked-assets')),
+            ('async', reverse('evaluate-async')),
+        )
+        total = options['requests']
+        for run, (name, path) in enumerate(endpoints):
+            url = options['url'].rstrip('/') + path
+            elapsed, statuses = self.load(
+                url, bodies[run * total:(run + 1) * total],
+                options['concurrency']
+            )
+            summary = ' '.join(
+                f"{code}={count}" for code, count in sorted(statuses.items())
+            )
+            self.stdout.write(
+                f"{name:<6}{options['requests'] / elapsed:10.1f} req/s  "
+                f"({elapsed:.2f}s, {summary})"
+            )
+
+    def ensure_link(self, asset_id):
+        kpi, _ = KPI.objects.get_or_create(
+            name='Load test KPI', defaults={'expression': 'ATTR * 2 + 1'}
+        )
+        KPIAssetLink.objects.get_or_create(kpi=kpi, asset_id=asset_id)
+
+    def first_unused_second(self, asset_id):
+        latest = EvaluationResult.objects.filter(
+            asset__key=asset_id).aggregate(latest=Max('timestamp'))['latest']
+        if latest is None:
+            return datetime(2022, 7, 31, tzinfo=timezone.utc)
+        return latest.replace(microsecond=0) + timedelta(seconds=1)
+
+    def load(self, url, bodies, concurrency):
+        # Statuses are counted as strings so 'unreachable' sorts with them
+        def post(body):
+            request = urllib.request.Request(
+                url, data=body, headers={'Content-Type': 'application/json'}
+            )
+            try:
+                with urllib.request.urlopen(request) as response:
+                    return str(response.status)
+            except urllib.error.HTTPError as error:
+                return str(error.code)
+            except urllib.error.URLError:
+                return 'unreachable'
+
+        start = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=concurrency) as pool:
+            statuses = Counter(pool.map(post, bodies))
+        return time.perf_counter() - start, statuses
@@ -0,0 +1,84 @@
+from threading import Lock
+from django.conf import settings
+from .interpreter.cache import LRUCache
+
+
+MISSING = object()
+
+
+class ResultMemo:
+    """Results of pure KPI expressions by input value, when ``enabled``.
+
+    Sensors often repeat the same readings (status codes, quantized
+    values), and a pure expression gives the same result for the same
+    input, so results are kept in an LRU of ``maxsize`` entries keyed by
+    the expression text, the input's type and the input. The type is
+    part of the key because ``1``, ``1.0`` and ``True`` compare equal but
+    can give different results.
+
+    Only expressions that read nothing but ATTR qualify (``cacheable``):
+    window functions and ``{attribute}`` references depend on earlier
+    messages. That is checked against the compiled expression on every
+    call, so a KPI edited to use windows stops being memoized at once,
+    and entries of its old expression are simply never hit again.
+    Failed evaluations are not memoized.
+    """
+
+    def __init__(self, enabled=False, maxsize=100000):
+        self.enabled = enabled
+        self._results = LRUCache(None, maxsize=maxsize)
+        # kpi_id -> [hits, misses]
+        self._kpis = {}
+        self._lock = Lock()
+
+    @staticmethod
+    def cacheable(compiled):
+        return (compiled is not None and not compiled.is_stateful
+                and not compiled.attributes)
+
+    def key(self, compiled, value):
+        """Memo key of ``value`` for ``compiled``, or None if not memoized."""
+        if not self.enabled or not self.cacheable(compiled):
+            return None
+        key = (compiled.text, type(value), value)
+        try:
+            hash(key)
+        except TypeError:
+            return None
+        return key
+
+    def get(self, key, kpi_id=None):
+        """The memoized result for ``key``, or MISSING."""
+        if key is None:
+            return MISSING
+        result = self._results.peek(key, MISSING)
+        if kpi_id is not None:
+            with self._lock:
+                counts = self._kpis.setdefault(kpi_id, [0, 0])
+                counts[result is MISSING] += 1
+        return result
+
+    def put(self, key, result):
+        if key is not None:
+            self._results.put(key, result)
+
+    def clear(self):
+        self._results.clear()
+        with self._lock:
+            self._kpis.clear()
+
+    def stats(self):
+        stats = self._results.stats()
+        with self._lock:
+            stats["kpis"] = {
+                str(kpi_id): {"hits": hits, "misses": misses,
+                              "hit_rate": hits / (hits + misses)}
+                for kpi_id, (hits, misses) in self._kpis.items()
+            }
+        return stats
+
+
+result_memo = ResultMemo(
+    enabled=getattr(settings, 'KPI_MEMOIZE_RESULTS', False),
+    maxsize=getattr(settings, 'KPI_RESULT_MEMO_SIZE', 100000),
+)
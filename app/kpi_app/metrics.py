@@ -0,0 +1,221 @@
+import time
+from bisect import bisect_left
+from threading import Lock
+from django.conf import settings
+
+
+# Upper bounds (seconds) of the latency histogram buckets
+LATENCY_BUCKETS = (
+    0.00001, 0.000025, 0.00005, 0.0001, 0.00025, 0.0005,
+    0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0,
+)
+
+# Metric families: name -> (type, help, label names)
+FAMILIES = {
+    "kpi_stage_duration_seconds": (
+        "histogram", "Time spent in each stage of message evaluation.",
+        ("stage",)),
+    "kpi_evaluation_duration_seconds": (
+        "histogram", "Time spent evaluating one KPI for one message.",
+        ("kpi",)),
+    "kpi_evaluations_total": (
+        "counter", "KPI evaluations that produced a result.", ("kpi",)),
+    "kpi_evaluation_errors_total": (
+        "counter", "KPI evaluations that failed.", ("kpi",)),
+    "kpi_rejected_messages_total": (
+        "counter", "Messages that could not be evaluated against any KPI.",
+        ()),
+    "kpi_result_flush_lag_seconds": (
+        "histogram", "Time buffered results waited before being written.", ()),
+    "kpi_result_flushes_total": (
+        "counter", "Writes of buffered results.", ()),
+    "kpi_result_flushed_rows_total": (
+        "counter", "Buffered results written.", ()),
+    "kpi_result_backpressure_total": (
+        "counter",
+        "Stores that had to flush first because the result buffer was full.",
+        ()),
+}
+
+
+class Histogram:
+    """Cumulative-on-render latency histogram with fixed buckets."""
+
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        # Prometheus buckets are inclusive upper bounds
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+
+class _Timer:
+    __slots__ = ("metrics", "family", "labels", "start")
+
+    def __init__(self, metrics, family, labels):
+        self.metrics = metrics
+        self.family = family
+        self.labels = labels
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.metrics.observe(self.family, self.labels,
+                             time.perf_counter() - self.start)
+        return False
+
+
+class _NullTimer:
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        return False
+
+
+NULL_TIMER = _NullTimer()
+
+
+class Metrics:
+    """In-process latency histograms and counters in Prometheus text format.
+
+    With ``enabled`` off every hook returns immediately: ``stage`` hands
+    out one shared no-op context manager and nothing is recorded or
+    locked. Values are per process, like the caches they sit next to.
+    """
+
+    def __init__(self, enabled=True, buckets=LATENCY_BUCKETS):
+        self.enabled = enabled
+        self.buckets = buckets
+        self._histograms = {}
+        self._counters = {}
+        self._lock = Lock()
+
+    def stage(self, name):
+        """Context manager timing pipeline stage ``name``."""
+        if not self.enabled:
+            return NULL_TIMER
+        return _Timer(self, "kpi_stage_duration_seconds", (name,))
+
+    def evaluation(self, kpi_id):
+        """Context manager timing one evaluation of KPI ``kpi_id``."""
+        if not self.enabled:
+            return NULL_TIMER
+        return _Timer(self, "kpi_evaluation_duration_seconds", (str(kpi_id),))
+
+    def observe(self, family, labels, seconds):
+        with self._lock:
+            histogram = self._histograms.get((family, labels))
+            if histogram is None:
+                histogram = Histogram(self.buckets)
+                self._histograms[family, labels] = histogram
+            histogram.observe(seconds)
+
+    def count(self, family, labels=(), amount=1):
+        if not self.enabled:
+            return
+        with self._lock:
+            key = family, labels
+            self._counters[key] = self._counters.get(key, 0) + amount
+
+    def evaluated(self, kpi_id):
+        self.count("kpi_evaluations_total", (str(kpi_id),))
+
+    def failed(self, kpi_id):
+        self.count("kpi_evaluation_errors_total", (str(kpi_id),))
+
+    def rejected(self, amount=1):
+        self.count("kpi_rejected_messages_total", (), amount)
+
+    def flushed(self, rows, lag):
+        """Record a write of ``rows`` buffered results ``lag`` seconds old."""
+        if not self.enabled:
+            return
+        self.observe("kpi_result_flush_lag_seconds", (), lag)
+        self.count("kpi_result_flushes_total")
+        self.count("kpi_result_flushed_rows_total", (), rows)
+
+    def backpressure(self):
+        self.count("kpi_result_backpressure_total")
+
+    def render(self, caches=None):
+        """Prometheus text exposition of every metric.
+
+        ``caches`` maps cache names to LRUCache-style ``stats()`` dicts,
+        rendered as hit, miss and eviction counters and a size gauge.
+        """
+        with self._lock:
+            histograms = {key: (list(value.counts), value.sum, value.count)
+                          for key, value in self._histograms.items()}
+            counters = dict(self._counters)
+
+        lines = []
+        for family, (kind, description, names) in FAMILIES.items():
+            lines.append(f"# HELP {family} {description}")
+            lines.append(f"# TYPE {family} {kind}")
+            if kind == "histogram":
+                for (name, labels), histogram in sorted(histograms.items()):
+                    if name == family:
+                        lines.extend(self._histogram_lines(
+                            family, names, labels, *histogram))
+            else:
+                for (name, labels), value in sorted(counters.items()):
+                    if name == family:
+                        lines.append(
+                            f"{family}{_labels(names, labels)} {value}")
+
+        for field, kind, description in (
+            ("hits", "counter", "Cache lookups answered from memory."),
+            ("misses", "counter", "Cache lookups that had to load the value."),
+            ("evictions", "counter",
+             "Entries dropped to stay within maxsize."),
+            ("size", "gauge", "Entries currently cached."),
+        ):
+            family = (f"kpi_cache_{field}_total" if kind == "counter"
+                      else f"kpi_cache_{field}")
+            lines.append(f"# HELP {family} {description}")
+            lines.append(f"# TYPE {family} {kind}")
+            for cache, stats in sorted((caches or {}).items()):
+                if field in stats:
+                    lines.append(f'{family}{{cache="{cache}"}} {stats[field]}')
+        return "\n".join(lines) + "\n"
+
+    def _histogram_lines(self, family, names, labels, counts, total, count):
+        cumulative = 0
+        for bound, bucket_count in zip(self.buckets, counts):
+            cumulative += bucket_count
+            labelled = _labels(names, labels, le=repr(bound))
+            yield f"{family}_bucket{labelled} {cumulative}"
+        yield f"{family}_bucket{_labels(names, labels, le='+Inf')} {count}"
+        yield f"{family}_sum{_labels(names, labels)} {total!r}"
+        yield f"{family}_count{_labels(names, labels)} {count}"
+
+    def reset(self):
+        with self._lock:
+            self._histograms.clear()
+            self._counters.clear()
+
+
+def _labels(names, values, **extra):
+    pairs = list(zip(names, values)) + list(extra.items())
+    if not pairs:
+        return ""
+    return "{" + ",".join(f'{name}="{_escape(value)}"'
+                          for name, value in pairs) + "}"
+
+
+def _escape(value):
+    return (str(value).replace("\\", "\\\\").replace("\n", "\\n")
+            .replace('"', '\\"'))
+
+
+metrics = Metrics(enabled=getattr(settings, 'KPI_METRICS_ENABLED', True))
@@ -0,0 +1,21 @@
+# Generated by Django 5.1.2 on 2026-10-17 11:43
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('kpi_app', '0002_routingversion'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='evaluationresult',
+            index=models.Index(fields=['asset_id', 'attribute_id', 'timestamp'], name='result_asset_attr_time_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='evaluationresult',
+            index=models.Index(fields=['timestamp'], name='result_timestamp_idx'),
+        ),
+    ]
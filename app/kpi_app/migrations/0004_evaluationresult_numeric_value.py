@@ -0,0 +1,40 @@
+# Generated by Django 5.1.2 on 2026-10-17 11:44
+
+from django.db import migrations, models
+
+
+def parse_numeric(text):
+    if text in ('True', 'False'):
+        return float(text == 'True')
+    try:
+        return float(text)
+    except ValueError:
+        return None
+
+
+def backfill_numeric_value(apps, schema_editor):
+    EvaluationResult = apps.get_model('kpi_app', 'EvaluationResult')
+    batch = []
+    for result in EvaluationResult.objects.only('id', 'value').iterator(chunk_size=2000):
+        result.numeric_value = parse_numeric(result.value)
+        batch.append(result)
+        if len(batch) >= 2000:
+            EvaluationResult.objects.bulk_update(batch, ['numeric_value'])
+            batch = []
+    EvaluationResult.objects.bulk_update(batch, ['numeric_value'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('kpi_app', '0003_evaluationresult_indexes'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='evaluationresult',
+            name='numeric_value',
+            field=models.FloatField(blank=True, null=True),
+        ),
+        migrations.RunPython(backfill_numeric_value, migrations.RunPython.noop),
+    ]
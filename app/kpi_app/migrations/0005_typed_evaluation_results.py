@@ -0,0 +1,174 @@
+import django.db.models.deletion
+from django.db import migrations, models
+from django.db.models import Case, OuterRef, Subquery, Value, When
+
+INTEGER, FLOAT, BOOLEAN = 1, 2, 3
+
+
+def intern_and_type_results(apps, schema_editor):
+    EvaluationResult = apps.get_model('kpi_app', 'EvaluationResult')
+    Asset = apps.get_model('kpi_app', 'Asset')
+    Attribute = apps.get_model('kpi_app', 'Attribute')
+
+    # Intern every distinct identifier, then point rows at it in one UPDATE
+    for model, field in ((Asset, 'legacy_asset_id'), (Attribute, 'legacy_attribute_id')):
+        keys = EvaluationResult.objects.values_list(field, flat=True).distinct()
+        model.objects.bulk_create(
+            [model(key=key) for key in keys.iterator()],
+            ignore_conflicts=True,
+            batch_size=1000,
+        )
+    EvaluationResult.objects.update(
+        asset=Subquery(Asset.objects.filter(key=OuterRef('legacy_asset_id')).values('pk')[:1]),
+        attribute=Subquery(Attribute.objects.filter(key=OuterRef('legacy_attribute_id')).values('pk')[:1]),
+    )
+
+    # numeric_value was already filled by 0004; only the discriminator and
+    # the boolean column are new
+    EvaluationResult.objects.filter(legacy_value__in=['True', 'False']).update(
+        value_type=BOOLEAN,
+        numeric_value=None,
+        bool_value=Case(When(legacy_value='True', then=Value(True)), default=Value(False)),
+    )
+    EvaluationResult.objects.filter(
+        value_type__isnull=True, legacy_value__regex=r'^-?[0-9]+$'
+    ).update(value_type=INTEGER)
+    EvaluationResult.objects.filter(value_type__isnull=True).update(value_type=FLOAT)
+
+
+def restore_text_results(apps, schema_editor):
+    EvaluationResult = apps.get_model('kpi_app', 'EvaluationResult')
+    batch = []
+    results = EvaluationResult.objects.select_related('asset', 'attribute')
+    for result in results.iterator(chunk_size=2000):
+        result.legacy_asset_id = result.asset.key
+        result.legacy_attribute_id = result.attribute.key
+        if result.value_type == BOOLEAN:
+            result.legacy_value = str(result.bool_value)
+            result.numeric_value = float(result.bool_value)
+        elif result.value_type == INTEGER and result.numeric_value is not None:
+            result.legacy_value = str(int(result.numeric_value))
+        else:
+            result.legacy_value = str(result.numeric_value)
+        batch.append(result)
+        if len(batch) >= 2000:
+            EvaluationResult.objects.bulk_update(
+                batch, ['legacy_asset_id', 'legacy_attribute_id', 'legacy_value', 'numeric_value']
+            )
+            batch = []
+    EvaluationResult.objects.bulk_update(
+        batch, ['legacy_asset_id', 'legacy_attribute_id', 'legacy_value', 'numeric_value']
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('kpi_app', '0004_evaluationresult_numeric_value'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Asset',
+            fields=[
+                ('id', models.AutoField(primary_key=True, serialize=False)),
+                ('key', models.CharField(max_length=255, unique=True)),
+            ],
+        ),
+        migrations.CreateModel(
+            name='Attribute',
+            fields=[
+                ('id', models.AutoField(primary_key=True, serialize=False)),
+                ('key', models.CharField(max_length=255, unique=True)),
+            ],
+        ),
+        migrations.RemoveIndex(
+            model_name='evaluationresult',
+            name='result_asset_attr_time_idx',
+        ),
+        # Free the asset_id/attribute_id column names for the new foreign keys
+        migrations.RenameField(
+            model_name='evaluationresult',
+            old_name='asset_id',
+            new_name='legacy_asset_id',
+        ),
+        migrations.RenameField(
+            model_name='evaluationresult',
+            old_name='attribute_id',
+            new_name='legacy_attribute_id',
+        ),
+        migrations.RenameField(
+            model_name='evaluationresult',
+            old_name='value',
+            new_name='legacy_value',
+        ),
+        # Nullable legacy columns let the migration be reversed: they are
+        # re-added empty and refilled by restore_text_results
+        migrations.AlterField(
+            model_name='evaluationresult',
+            name='legacy_asset_id',
+            field=models.CharField(max_length=255, null=True),
+        ),
+        migrations.AlterField(
+            model_name='evaluationresult',
+            name='legacy_attribute_id',
+            field=models.CharField(max_length=255, null=True),
+        ),
+        migrations.AlterField(
+            model_name='evaluationresult',
+            name='legacy_value',
+            field=models.TextField(null=True),
+        ),
+        migrations.AddField(
+            model_name='evaluationresult',
+            name='asset',
+            field=models.ForeignKey(null=True, on_delete=django.db.models.deletion.PROTECT, related_name='results', to='kpi_app.asset'),
+        ),
+        migrations.AddField(
+            model_name='evaluationresult',
+            name='attribute',
+            field=models.ForeignKey(null=True, on_delete=django.db.models.deletion.PROTECT, related_name='results', to='kpi_app.attribute'),
+        ),
+        migrations.AddField(
+            model_name='evaluationresult',
+            name='value_type',
+            field=models.PositiveSmallIntegerField(choices=[(1, 'integer'), (2, 'float'), (3, 'boolean')], null=True),
+        ),
+        migrations.AddField(
+            model_name='evaluationresult',
+            name='bool_value',
+            field=models.BooleanField(blank=True, null=True),
+        ),
+        migrations.RunPython(intern_and_type_results, restore_text_results),
+        migrations.RemoveField(
+            model_name='evaluationresult',
+            name='legacy_asset_id',
+        ),
+        migrations.RemoveField(
+            model_name='evaluationresult',
+            name='legacy_attribute_id',
+        ),
+        migrations.RemoveField(
+            model_name='evaluationresult',
+            name='legacy_value',
+        ),
+        migrations.AlterField(
+            model_name='evaluationresult',
+            name='asset',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.PROTECT, related_name='results', to='kpi_app.asset'),
+        ),
+        migrations.AlterField(
+            model_name='evaluationresult',
+            name='attribute',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.PROTECT, related_name='results', to='kpi_app.attribute'),
+        ),
+        migrations.AlterField(
+            model_name='evaluationresult',
+            name='value_type',
+            field=models.PositiveSmallIntegerField(choices=[(1, 'integer'), (2, 'float'), (3, 'boolean')]),
+        ),
+        migrations.AddIndex(
+            model_name='evaluationresult',
+            index=models.Index(fields=['asset', 'attribute', 'timestamp'], name='result_asset_attr_time_idx'),
+        ),
+    ]
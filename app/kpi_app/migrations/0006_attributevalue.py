@@ -0,0 +1,27 @@
+# Generated by Django 5.1.2 on 2026-10-17 11:52
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('kpi_app', '0005_typed_evaluation_results'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='AttributeValue',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('timestamp', models.DateTimeField()),
+                ('value', models.JSONField()),
+                ('asset', models.ForeignKey(on_delete=django.db.models.deletion.PROTECT, related_name='attribute_values', to='kpi_app.asset')),
+                ('attribute', models.ForeignKey(on_delete=django.db.models.deletion.PROTECT, related_name='attribute_values', to='kpi_app.attribute')),
+            ],
+            options={
+                'constraints': [models.UniqueConstraint(fields=('asset', 'attribute'), name='unique_asset_attribute_value')],
+            },
+        ),
+    ]
@@ -0,0 +1,29 @@
+# Generated by Django 5.1.2 on 2026-10-17 11:56
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('kpi_app', '0006_attributevalue'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='WindowCheckpoint',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('expression', models.TextField()),
+                ('state', models.JSONField()),
+                ('updated_at', models.DateTimeField()),
+                ('asset', models.ForeignKey(on_delete=django.db.models.deletion.PROTECT, related_name='window_checkpoints', to='kpi_app.asset')),
+                ('attribute', models.ForeignKey(on_delete=django.db.models.deletion.PROTECT, related_name='window_checkpoints', to='kpi_app.attribute')),
+                ('kpi', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='window_checkpoints', to='kpi_app.kpi')),
+            ],
+            options={
+                'constraints': [models.UniqueConstraint(fields=('asset', 'kpi', 'attribute'), name='unique_window_checkpoint')],
+            },
+        ),
+    ]
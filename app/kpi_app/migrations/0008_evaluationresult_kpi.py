@@ -0,0 +1,19 @@
+# Generated by Django 5.1.2 on 2026-10-17 11:59
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('kpi_app', '0007_windowcheckpoint'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='evaluationresult',
+            name='kpi',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='results', to='kpi_app.kpi'),
+        ),
+    ]
@@ -0,0 +1,27 @@
+# Generated by Django 5.1.2 on 2026-10-17 12:07
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('kpi_app', '0008_evaluationresult_kpi'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Reading',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('timestamp', models.DateTimeField()),
+                ('value', models.JSONField()),
+                ('asset', models.ForeignKey(on_delete=django.db.models.deletion.PROTECT, related_name='readings', to='kpi_app.asset')),
+                ('attribute', models.ForeignKey(on_delete=django.db.models.deletion.PROTECT, related_name='readings', to='kpi_app.attribute')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['asset', 'timestamp'], name='reading_asset_time_idx')],
+            },
+        ),
+    ]
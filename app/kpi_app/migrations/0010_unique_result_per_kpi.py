@@ -0,0 +1,39 @@
+# Generated by Django 5.1.2 on 2026-10-17 12:25
+
+from django.db import migrations, models
+from django.db.models import Count, Min
+
+
+def remove_duplicate_results(apps, schema_editor):
+    EvaluationResult = apps.get_model('kpi_app', 'EvaluationResult')
+    # Keep the first stored result of every retried message
+    groups = (EvaluationResult.objects
+              .filter(kpi__isnull=False)
+              .values('asset', 'attribute', 'timestamp', 'kpi')
+              .annotate(first=Min('id'), rows=Count('id'))
+              .filter(rows__gt=1))
+    for group in list(groups):
+        (EvaluationResult.objects
+         .filter(asset=group['asset'], attribute=group['attribute'],
+                 timestamp=group['timestamp'], kpi=group['kpi'])
+         .exclude(id=group['first'])
+         .delete())
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('kpi_app', '0009_reading'),
+    ]
+
+    operations = [
+        migrations.RunPython(remove_duplicate_results, migrations.RunPython.noop),
+        migrations.RemoveIndex(
+            model_name='evaluationresult',
+            name='result_asset_attr_time_idx',
+        ),
+        migrations.AddConstraint(
+            model_name='evaluationresult',
+            constraint=models.UniqueConstraint(fields=('asset', 'attribute', 'timestamp', 'kpi'), name='unique_result_per_kpi'),
+        ),
+    ]
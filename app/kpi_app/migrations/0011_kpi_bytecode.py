@@ -0,0 +1,20 @@
+# Generated by Django 5.1.2 on 2026-10-17 12:30
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('kpi_app', '0010_unique_result_per_kpi'),
+    ]
+
+    # Existing KPIs compile from their text until preload_expressions or
+    # their next save stores the bytecode
+    operations = [
+        migrations.AddField(
+            model_name='kpi',
+            name='bytecode',
+            field=models.JSONField(blank=True, editable=False, null=True),
+        ),
+    ]
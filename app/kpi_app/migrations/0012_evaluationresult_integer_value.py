@@ -0,0 +1,36 @@
+# Generated by Django 5.1.2 on 2026-10-17 13:10
+
+from django.db import migrations, models
+from django.db.models import BigIntegerField
+from django.db.models.functions import Cast
+
+INTEGER = 1
+# Largest magnitude up to which every integer is exact as a float
+FLOAT_EXACT = 2 ** 53
+
+
+def copy_exact_integers(apps, schema_editor):
+    EvaluationResult = apps.get_model('kpi_app', 'EvaluationResult')
+    # Larger values were rounded when 0004 stored them as floats; they keep
+    # integer_value NULL rather than pretending to be exact
+    EvaluationResult.objects.filter(
+        value_type=INTEGER,
+        numeric_value__gte=-FLOAT_EXACT,
+        numeric_value__lte=FLOAT_EXACT,
+    ).update(integer_value=Cast('numeric_value', BigIntegerField()))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('kpi_app', '0011_kpi_bytecode'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='evaluationresult',
+            name='integer_value',
+            field=models.BigIntegerField(blank=True, null=True),
+        ),
+        migrations.RunPython(copy_exact_integers, migrations.RunPython.noop),
+    ]
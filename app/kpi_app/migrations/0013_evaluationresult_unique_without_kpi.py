@@ -0,0 +1,35 @@
+# Generated by Django 5.1.2 on 2026-10-17 12:51
+
+from django.db import migrations, models
+from django.db.models import Count, Min
+
+
+def remove_duplicate_results(apps, schema_editor):
+    EvaluationResult = apps.get_model('kpi_app', 'EvaluationResult')
+    # Keep the first stored result of every retried message without a KPI
+    groups = (EvaluationResult.objects
+              .filter(kpi__isnull=True)
+              .values('asset', 'attribute', 'timestamp')
+              .annotate(first=Min('id'), rows=Count('id'))
+              .filter(rows__gt=1))
+    for group in list(groups):
+        (EvaluationResult.objects
+         .filter(asset=group['asset'], attribute=group['attribute'],
+                 timestamp=group['timestamp'], kpi__isnull=True)
+         .exclude(id=group['first'])
+         .delete())
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('kpi_app', '0012_evaluationresult_integer_value'),
+    ]
+
+    operations = [
+        migrations.RunPython(remove_duplicate_results, migrations.RunPython.noop),
+        migrations.AddConstraint(
+            model_name='evaluationresult',
+            constraint=models.UniqueConstraint(condition=models.Q(('kpi__isnull', True)), fields=('asset', 'attribute', 'timestamp'), name='unique_result_without_kpi'),
+        ),
+    ]
@@ -0,0 +1,19 @@
+# Generated by Django 5.1.2 on 2026-10-17 13:12
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('kpi_app', '0013_evaluationresult_unique_without_kpi'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='evaluationresult',
+            name='kpi',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='results', to='kpi_app.kpi'),
+        ),
+    ]
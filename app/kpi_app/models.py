@@ -5,6 +5,9 @@ class KPI(models.Model):
     name = models.CharField(max_length=255, unique=True)
     expression = models.TextField()
     description = models.TextField(blank=True, null=True)
+    # Postfix bytecode of the compiled expression (interpreter/bytecode.py),
+    # kept current by signals.py so workers can skip lexing and parsing
+    bytecode = models.JSONField(null=True, blank=True, editable=False)
 
     def __str__(self):
         return self.name
@@ -21,11 +24,192 @@ class KPIAssetLink(models.Model):
         return f"{self.kpi.name} - {self.asset_id}"
 
 
+class Asset(models.Model):
+    """Asset identifier interned into a small integer key."""
+    id = models.AutoField(primary_key=True)
+    key = models.CharField(max_length=255, unique=True)
+
+    def __str__(self):
+        return self.key
+
+
+class Attribute(models.Model):
+    """Attribute identifier interned into a small integer key."""
+    id = models.AutoField(primary_key=True)
+    key = models.CharField(max_length=255, unique=True)
+
+    def __str__(self):
+        return self.key
+
+
 class EvaluationResult(models.Model):
-    asset_id = models.CharField(max_length=255)
-    attribute_id = models.CharField(max_length=255)
+    INTEGER = 1
+    FLOAT = 2
+    BOOLEAN = 3
+    VALUE_TYPES = [
+        (INTEGER, 'integer'),
+        (FLOAT, 'float'),
+        (BOOLEAN, 'boolean'),
+    ]
+
+    asset = models.ForeignKey(Asset, on_delete=models.PROTECT,
+                              related_name="results")
+    attribute = models.ForeignKey(Attribute, on_delete=models.PROTECT,
+                                  related_name="results")
+    # KPI that produced the result; assets can be linked to many KPIs. Its
+    # results go with a deleted KPI, as rows left without one would collide
+    # in unique_result_without_kpi
+    kpi = models.ForeignKey(KPI, on_delete=models.CASCADE, null=True,
+                            blank=True, related_name="results")
+    timestamp = models.DateTimeField()
+    # The value lives in one typed column selected by value_type; integers
+    # are also kept in numeric_value so aggregates read one column
+    value_type = models.PositiveSmallIntegerField(choices=VALUE_TYPES)
+    numeric_value = models.FloatField(null=True, blank=True)
+    # Exact integer results; NULL on INTEGER rows migrated from text whose
+    # value was beyond what a float holds exactly
+    integer_value = models.BigIntegerField(null=True, blank=True)
+    bool_value = models.BooleanField(null=True, blank=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['timestamp'], name='result_timestamp_idx'),
+        ]
+        constraints = [
+            # Makes ingestion idempotent; its index also serves lookups by
+            # asset, attribute and time
+            models.UniqueConstraint(
+                fields=['asset', 'attribute', 'timestamp', 'kpi'],
+                name='unique_result_per_kpi'),
+            # NULLs are distinct in the one above, so results stored without
+            # a KPI (evaluate_and_store_result) need a key of their own
+            models.UniqueConstraint(fields=['asset', 'attribute', 'timestamp'],
+                                    condition=models.Q(kpi__isnull=True),
+                                    name='unique_result_without_kpi'),
+        ]
+
+    @classmethod
+    def typed_fields(cls, value):
+        """Map a KPI result to the typed columns that store it."""
+        if isinstance(value, bool):
+            return {'value_type': cls.BOOLEAN, 'numeric_value': None,
+                    'integer_value': None, 'bool_value': value}
+        if isinstance(value, int):
+            if not -2 ** 63 <= value < 2 ** 63:
+                raise ValueError(
+                    f"KPI result {value} does not fit in 64 bits.")
+            return {'value_type': cls.INTEGER, 'numeric_value': float(value),
+                    'integer_value': value, 'bool_value': None}
+        if isinstance(value, float):
+            return {'value_type': cls.FLOAT, 'numeric_value': value,
+                    'integer_value': None, 'bool_value': None}
+        raise ValueError(f"KPI result {value!r} is not a number or boolean.")
+
+    @classmethod
+    def format_value(cls, value_type, numeric_value, bool_value,
+                     integer_value=None):
+        """Render typed columns in the text form the API has always used."""
+        if value_type == cls.BOOLEAN:
+            return str(bool_value)
+        if value_type == cls.INTEGER:
+            if integer_value is not None:
+                return str(integer_value)
+            if numeric_value is not None:
+                return str(int(numeric_value))
+        return str(numeric_value)
+
+    @classmethod
+    def build(cls, asset_key, attribute_key, timestamp, value, kpi_id=None):
+        """Unsaved result; keys are interned when stored by store_results."""
+        result = cls(timestamp=timestamp, kpi_id=kpi_id,
+                     **cls.typed_fields(value))
+        result.asset_key = asset_key
+        result.attribute_key = attribute_key
+        return result
+
+    @property
+    def value(self):
+        return self.format_value(self.value_type, self.numeric_value,
+                                 self.bool_value, self.integer_value)
+
+    def __str__(self):
+        return f"Result for Asset {self.asset.key}"
+
+
+class AttributeValue(models.Model):
+    """Latest reading of an asset attribute that a linked KPI references."""
+    asset = models.ForeignKey(Asset, on_delete=models.PROTECT,
+                              related_name="attribute_values")
+    attribute = models.ForeignKey(Attribute, on_delete=models.PROTECT,
+                                  related_name="attribute_values")
     timestamp = models.DateTimeField()
-    value = models.TextField()
+    value = models.JSONField()
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['asset', 'attribute'],
+                                    name='unique_asset_attribute_value'),
+        ]
+
+    def __str__(self):
+        return f"{self.attribute.key} of Asset {self.asset.key}"
+
+
+class Reading(models.Model):
+    """Raw message archived for re-evaluating KPIs over history (backfill)."""
+    asset = models.ForeignKey(Asset, on_delete=models.PROTECT,
+                              related_name="readings")
+    attribute = models.ForeignKey(Attribute, on_delete=models.PROTECT,
+                                  related_name="readings")
+    timestamp = models.DateTimeField()
+    value = models.JSONField()
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['asset', 'timestamp'],
+                         name='reading_asset_time_idx'),
+        ]
+
+    def __str__(self):
+        return (f"{self.attribute.key} of Asset {self.asset.key} "
+                f"at {self.timestamp}")
+
+
+class WindowCheckpoint(models.Model):
+    """Periodic snapshot of the window function state of an asset's KPI.
+
+    ``attribute`` is the result series the windows feed (``output_<id>``
+    or ``kpi_<id>``). ``expression`` records what the state was built for,
+    so a checkpoint taken before the KPI changed is not restored into the
+    new expression.
+    """
+    asset = models.ForeignKey(Asset, on_delete=models.PROTECT,
+                              related_name="window_checkpoints")
+    kpi = models.ForeignKey(KPI, on_delete=models.CASCADE,
+                            related_name="window_checkpoints")
+    attribute = models.ForeignKey(Attribute, on_delete=models.PROTECT,
+                                  related_name="window_checkpoints")
+    expression = models.TextField()
+    state = models.JSONField()
+    updated_at = models.DateTimeField()
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['asset', 'kpi', 'attribute'],
+                                    name='unique_window_checkpoint'),
+        ]
+
+    def __str__(self):
+        return f"Window state of KPI {self.kpi_id} for Asset {self.asset.key}"
+
+
+class RoutingVersion(models.Model):
+    """Single-row counter bumped whenever KPIs or asset links change.
+
+    Worker processes compare it with the version they last saw to know when
+    their in-memory routing table is stale.
+    """
+    version = models.PositiveBigIntegerField(default=0)
 
     def __str__(self):
-        return f"Result for Asset {self.asset_id}"
+        return f"Routing version {self.version}"
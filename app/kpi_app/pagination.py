@@ -0,0 +1,13 @@
+from rest_framework.pagination import CursorPagination
+
+
+class EvaluationResultPagination(CursorPagination):
+    """Keyset pagination over results in timestamp order.
+
+    Each page seeks from the last timestamp seen instead of using OFFSET,
+    so deep pages stay as cheap as the first one.
+    """
+    ordering = ('timestamp', 'id')
+    page_size = 100
+    page_size_query_param = 'page_size'
+    max_page_size = 1000
@@ -0,0 +1,14 @@
+from rest_framework.exceptions import ParseError
+from rest_framework.parsers import BaseParser
+from .columnar import CONTENT_TYPE, decode_batch
+
+
+class ColumnarParser(BaseParser):
+    """Parses ``application/x-kpi-columnar`` bodies into a ColumnarBatch."""
+    media_type = CONTENT_TYPE
+
+    def parse(self, stream, media_type=None, parser_context=None):
+        try:
+            return decode_batch(stream.read())
+        except ValueError as error:
+            raise ParseError(f"Columnar parse error - {error}")
@@ -0,0 +1,356 @@
+import json
+from datetime import datetime, timezone
+from functools import partial
+from itertools import islice
+from .attributes import MissingAttributes, attribute_store
+from .dedup import seen_messages
+from .memoization import MISSING, result_memo
+from .interpreter.compiler import coerce_value
+from .routing import routing_table
+from .window_state import window_store
+from .readings import reading_archive
+from .metrics import metrics
+from .models import EvaluationResult
+from .utils import parse_timestamp, result_buffer
+
+
+def evaluate_asset(linked, message, latest, readings, windows, archive=None):
+    """Evaluate one message against every KPI linked to its asset.
+
+    ``linked`` is the asset's AssetRoutes. A reading of an attribute some
+    KPI references updates ``latest``, the asset's values from the
+    attribute store, and is appended to ``readings`` for saving; only the
+    KPIs that read ATTR or depend on that attribute are re-evaluated.
+    ``windows`` maps ``(asset_id, kpi_id, series)`` to the WindowState of
+    KPIs using window functions. Subexpressions shared between the KPIs
+    are computed once. Unless ``archive`` is None the raw reading is
+    appended to it for the ReadingArchive.
+
+    Returns the unsaved results and ``(kpi_id, error)`` pairs for KPIs that
+    failed. Problems with the message itself raise KeyError or ValueError.
+    """
+    asset_id = str(message["asset_id"])
+    attribute_id = str(message["attribute_id"])
+    with metrics.stage('timestamp'):
+        timestamp = parse_timestamp(message["timestamp"])
+    return evaluate_reading(linked, asset_id, attribute_id, timestamp,
+                            message["value"], latest, readings, windows,
+                            archive)
+
+
+def evaluate_reading(linked, asset_id, attribute_id, timestamp, raw_value,
+                     latest, readings, windows, archive=None):
+    """``evaluate_asset`` for a reading that is already decoded.
+
+    ``timestamp`` is an aware datetime and ``raw_value`` the value as
+    received; the other arguments are those of ``evaluate_asset``.
+    """
+    value = coerce_value(raw_value)
+    if archive is not None:
+        archive.append((asset_id, attribute_id, timestamp, raw_value))
+
+    dependents = True
+    if attribute_id in linked.dependents:
+        if attribute_store.record(latest, attribute_id, timestamp, value):
+            readings.append((asset_id, attribute_id, timestamp, value))
+        else:
+            # An out-of-order reading older than the one already applied
+            dependents = False
+
+    variables = {'ATTR': value}
+    if latest:
+        variables.update((name, entry[1]) for name, entry in latest.items())
+    memo = {}
+    results = []
+    errors = []
+    for route in linked.triggered(attribute_id, dependents):
+        if route.compiled is None:
+            errors.append((route.kpi_id, route.error))
+            metrics.failed(route.kpi_id)
+            continue
+        missing = route.attributes.difference(variables)
+        if missing:
+            errors.append((route.kpi_id, str(MissingAttributes(missing))))
+            continue
+
+        series = route.result_key(attribute_id)
+        try:
+            with metrics.evaluation(route.kpi_id):
+                if route.compiled.is_stateful:
+                    state = windows[asset_id, route.kpi_id, series]
+                    with state.lock:
+                        result = linked.program.evaluate(route.index, dict(
+                            variables,
+                            **{'@windows': state, '@time': timestamp}
+                        ), memo)
+                else:
+                    # Pure ATTR expressions repeat results for repeated values
+                    key = result_memo.key(route.compiled, value)
+                    result = result_memo.get(key, route.kpi_id)
+                    if result is MISSING:
+                        result = linked.program.evaluate(route.index,
+                                                         variables, memo)
+                        result_memo.put(key, result)
+            # A result that cannot be stored fails this KPI, not the message
+            row = EvaluationResult.build(
+                asset_id, series, timestamp, result, kpi_id=route.kpi_id
+            )
+        except (ValueError, TypeError, ArithmeticError) as error:
+            errors.append((route.kpi_id, str(error)))
+            metrics.failed(route.kpi_id)
+        else:
+            results.append(row)
+            metrics.evaluated(route.kpi_id)
+    return results, errors
+
+
+def _message_pairs(messages):
+    """``(asset_id, attribute_id)`` of the well-formed ``messages``."""
+    for message in messages:
+        if isinstance(message, dict) and "attribute_id" in message:
+            yield message.get("asset_id"), message["attribute_id"]
+
+
+def _window_entries(pairs, routes):
+    """``(asset_id, series, route)`` for the window states readings touch.
+
+    ``pairs`` are the ``(asset_id, attribute_id)`` of the readings.
+    """
+    for asset_id, attribute_id in pairs:
+        linked = routes.get(str(asset_id))
+        if linked is None or not linked.stateful:
+            continue
+        attribute_id = str(attribute_id)
+        for route in linked.triggered(attribute_id):
+            if route.compiled is not None and route.compiled.is_stateful:
+                yield asset_id, route.result_key(attribute_id), route
+
+
+def evaluate_message(linked, message):
+    """Evaluate a single message, saving the state it updates."""
+    asset_id = message["asset_id"]
+    latest = attribute_store.latest(asset_id) if linked.dependents else None
+    windows = window_store.states_for(
+        _window_entries(_message_pairs([message]), {str(asset_id): linked})
+    )
+    readings = []
+    archive = reading_archive.collector()
+    try:
+        return evaluate_asset(linked, message, latest, readings, windows,
+                              archive)
+    finally:
+        attribute_store.save(readings)
+        reading_archive.save(archive)
+        window_store.checkpoint_if_due()
+
+
+def evaluate_messages(messages, accepted=None):
+    """Evaluate ``(position, message)`` pairs against their linked KPIs.
+
+    Links for every asset are resolved together, so a batch costs at most
+    one routing query, plus one query each for the attribute values and
+    window checkpoints of assets whose KPIs need them.
+
+    Messages seen before (see SeenMessages) or repeated within the batch
+    are skipped; the keys of the evaluated ones are appended to
+    ``accepted``, to be remembered once their results are stored. Returns
+    the unsaved results, ``(position, kpi_id, error)`` triples, with
+    ``kpi_id`` None when the message itself could not be evaluated, and
+    the number of duplicates.
+    """
+    fresh = []
+    batch_keys = set()
+    for position, message in messages:
+        key = seen_messages.message_key(message)
+        if key is not None:
+            if key in batch_keys or seen_messages.seen(key):
+                continue
+            batch_keys.add(key)
+        fresh.append((position, message, key))
+    duplicates = len(messages) - len(fresh)
+
+    asset_ids = [message.get("asset_id") for _, message, _ in fresh
+                 if isinstance(message, dict) and message.get("asset_id")]
+    with metrics.stage('route'):
+        routes = routing_table.route_many(asset_ids)
+    latest = attribute_store.latest_many(
+        asset_id for asset_id, linked in routes.items()
+        if linked is not None and linked.dependents
+    )
+    windows = window_store.states_for(
+        _window_entries(_message_pairs(message for _, message, _ in fresh),
+                        routes)
+    )
+    readings = []
+    archive = reading_archive.collector()
+
+    results = []
+    errors = []
+    for position, message, key in fresh:
+        if not isinstance(message, dict) or not message.get("asset_id"):
+            errors.append((position, None,
+                           "Asset ID is required in the message data."))
+            continue
+
+        asset_id = str(message["asset_id"])
+        linked = routes.get(asset_id)
+        if linked is None:
+            errors.append((position, None, "No KPI linked to this asset."))
+            continue
+
+        try:
+            evaluated, failed = evaluate_asset(
+                linked, message, latest.get(asset_id), readings, windows,
+                archive)
+        except KeyError as error:
+            errors.append((position, None,
+                           f"Missing field {error} in the message data."))
+        except (ValueError, TypeError, ArithmeticError) as error:
+            errors.append((position, None, str(error)))
+        else:
+            results.extend(evaluated)
+            errors.extend((position, kpi_id, error)
+                          for kpi_id, error in failed)
+            if accepted is not None:
+                accepted.append(key)
+
+    attribute_store.save(readings)
+    reading_archive.save(archive)
+    window_store.checkpoint_if_due()
+    metrics.rejected(sum(1 for error in errors if error[1] is None))
+    return results, errors, duplicates
+
+
+def evaluate_columns(batch, accepted=None):
+    """Evaluate a decoded ColumnarBatch like ``evaluate_messages``.
+
+    Rows are read straight from the batch columns, and each distinct epoch
+    second is converted to a datetime once, so no message dict is built and
+    no timestamp string parsed. Errors carry the row index as position;
+    duplicates are keyed by the epoch seconds.
+    """
+    with metrics.stage('route'):
+        routes = routing_table.route_many(batch.asset_ids())
+    latest = attribute_store.latest_many(
+        asset_id for asset_id, linked in routes.items()
+        if linked is not None and linked.dependents
+    )
+    windows = window_store.states_for(_window_entries(batch.pairs(), routes))
+    readings = []
+    archive = reading_archive.collector()
+
+    times = {}
+    batch_keys = set()
+    duplicates = 0
+    results = []
+    errors = []
+    for row, (asset_id, attribute_id, epoch, value) in enumerate(batch.rows()):
+        key = None
+        if seen_messages.enabled:
+            key = (asset_id, attribute_id, epoch)
+            if key in batch_keys or seen_messages.seen(key):
+                duplicates += 1
+                continue
+            batch_keys.add(key)
+        linked = routes.get(asset_id)
+        if linked is None:
+            errors.append((row, None, "No KPI linked to this asset."))
+            continue
+        timestamp = times.get(epoch)
+        if timestamp is None:
+            try:
+                timestamp = datetime.fromtimestamp(epoch, timezone.utc)
+                times[epoch] = timestamp
+            except (OverflowError, OSError, ValueError):
+                errors.append((row, None,
+                               f"Timestamp {epoch} is out of range."))
+                continue
+
+        try:
+            evaluated, failed = evaluate_reading(
+                linked, asset_id, attribute_id, timestamp, value,
+                latest.get(asset_id), readings, windows, archive)
+        except (ValueError, TypeError, ArithmeticError) as error:
+            errors.append((row, None, str(error)))
+        else:
+            results.extend(evaluated)
+            errors.extend((row, kpi_id, error) for kpi_id, error in failed)
+            if accepted is not None:
+                accepted.append(key)
+
+    attribute_store.save(readings)
+    reading_archive.save(archive)
+    window_store.checkpoint_if_due()
+    metrics.rejected(sum(1 for error in errors if error[1] is None))
+    return results, errors, duplicates
+
+
+def describe_error(position_key, position, kpi_id, error):
+    """JSON form of an error from ``evaluate_messages``."""
+    described = {position_key: position, "error": error}
+    if kpi_id is not None:
+        described["kpi"] = kpi_id
+    return described
+
+
+def parse_ndjson(lines):
+    """Lazily decode NDJSON lines into ``(line_number, message, error)``.
+
+    Undecodable lines are passed on with an error instead of a message so
+    they are reported with the rest of their chunk.
+    """
+    for number, line in enumerate(lines, 1):
+        line = line.strip()
+        if not line:
+            continue
+        try:
+            yield number, json.loads(line), None
+        except ValueError as error:
+            yield number, None, f"Invalid JSON: {error}"
+
+
+def chunked(iterable, size):
+    iterator = iter(iterable)
+    while chunk := list(islice(iterator, size)):
+        yield chunk
+
+
+def ingest_ndjson(lines, chunk_size):
+    """Evaluate and store an NDJSON stream chunk by chunk.
+
+    Yields one NDJSON progress line per stored chunk and a final summary,
+    so memory use is bounded by ``chunk_size`` whatever the input size.
+    """
+    evaluated = 0
+    failed = 0
+    duplicated = 0
+    for chunk in chunked(parse_ndjson(lines), chunk_size):
+        messages = []
+        errors = []
+        for number, message, error in chunk:
+            if error:
+                errors.append((number, None, error))
+            else:
+                messages.append((number, message))
+        metrics.rejected(len(errors))
+
+        accepted = []
+        results, evaluation_errors, duplicates = evaluate_messages(
+            messages, accepted)
+        errors.extend(evaluation_errors)
+        result_buffer.store(results, partial(seen_messages.remember, accepted))
+
+        evaluated += len(results)
+        failed += len(errors)
+        duplicated += duplicates
+        yield json.dumps({
+            "lines": [chunk[0][0], chunk[-1][0]],
+            "evaluated": len(results),
+            "duplicates": duplicates,
+            "errors": [describe_error("line", *error)
+                       for error in sorted(errors,
+                                           key=lambda error: error[0])],
+        }) + "\n"
+
+    yield json.dumps({"done": True, "evaluated": evaluated, "failed": failed,
+                      "duplicates": duplicated}) + "\n"
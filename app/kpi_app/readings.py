@@ -0,0 +1,41 @@
+from django.conf import settings
+from .interning import asset_keys, attribute_keys
+from .models import Reading
+
+
+class ReadingArchive:
+    """Stores every evaluated message as a Reading when ``enabled``.
+
+    The archive is what the backfill command replays when a KPI has to be
+    re-evaluated over history. Readings are collected while a batch is
+    evaluated and written with one insert.
+    """
+
+    def __init__(self, enabled=False):
+        self.enabled = enabled
+
+    def collector(self):
+        """A list to pass to ``evaluate_asset``, or None when disabled."""
+        return [] if self.enabled else None
+
+    def save(self, readings):
+        """Insert ``(asset_id, attribute_id, timestamp, value)`` readings."""
+        if not readings:
+            return
+        asset_ids = asset_keys.ids_for(str(reading[0]) for reading in readings)
+        attribute_ids = attribute_keys.ids_for(
+            reading[1] for reading in readings)
+        Reading.objects.bulk_create([
+            Reading(
+                asset_id=asset_ids[str(asset_id)],
+                attribute_id=attribute_ids[attribute_id],
+                timestamp=timestamp,
+                value=value,
+            )
+            for asset_id, attribute_id, timestamp, value in readings
+        ])
+
+
+reading_archive = ReadingArchive(
+    enabled=getattr(settings, 'KPI_ARCHIVE_READINGS', False),
+)
@@ -0,0 +1,208 @@
+import time
+from django.conf import settings
+from django.db.models import F
+from .interpreter.cache import LRUCache
+from .models import KPIAssetLink, RoutingVersion
+from .utils import load_expression, program_cache
+
+
+class Route:
+    """One KPI linked to an asset, compiled for evaluating its messages."""
+
+    def __init__(self, link_id, kpi_id, expression, bytecode=None):
+        self.link_id = link_id
+        self.kpi_id = kpi_id
+        self.expression = expression
+        self.error = None
+        # Output of this KPI in the asset's FusedProgram
+        self.index = None
+        try:
+            self.compiled = load_expression(expression, bytecode)
+        except (ValueError, RecursionError) as error:
+            # KPIs saved before creation-time validation may not compile
+            self.compiled = None
+            self.error = f"Invalid KPI expression: {error}"
+        self.attributes = (self.compiled.attributes if self.compiled
+                           else frozenset())
+        # Attribute values or window functions keep state between messages
+        self.needs_state = bool(self.attributes) or bool(
+            self.compiled and self.compiled.is_stateful)
+
+    def result_key(self, attribute_id):
+        """Attribute key of the results of a message of ``attribute_id``."""
+        if self.attributes:
+            return f"kpi_{self.kpi_id}"
+        return f"output_{attribute_id}"
+
+    def __repr__(self):
+        return f"Route(asset link {self.link_id}, KPI {self.kpi_id})"
+
+
+class AssetRoutes:
+    """Every KPI linked to one asset, evaluated together.
+
+    The valid KPIs are compiled into one FusedProgram so subexpressions
+    they share run once per message. ``dependents`` is the dependency
+    index from an attribute to the KPIs referencing it as ``{name}``;
+    KPIs that read ATTR (or failed to compile) run for every message.
+    """
+
+    def __init__(self, routes):
+        self.routes = routes
+        valid = [route for route in routes if route.compiled is not None]
+        for index, route in enumerate(valid):
+            route.index = index
+        self.program = program_cache.get(
+            tuple(route.expression for route in valid))
+        self.stateful = any(route.compiled.is_stateful for route in valid)
+        self.needs_state = any(route.needs_state for route in routes)
+
+        self.always = [route for route in routes
+                       if not route.attributes or route.compiled.uses_value]
+        self.dependents = {}
+        for route in routes:
+            for name in route.attributes:
+                self.dependents.setdefault(name, []).append(route)
+        always = set(self.always)
+        self._triggered = {
+            name: [route for route in routes
+                   if route in always or route in dependents]
+            for name, dependents in self.dependents.items()
+        }
+
+    def triggered(self, attribute_id, dependents=True):
+        """Routes a message for ``attribute_id`` re-evaluates, in link order.
+
+        With ``dependents=False`` only the routes run for every message.
+        """
+        if not dependents:
+            return self.always
+        return self._triggered.get(attribute_id, self.always)
+
+    def __iter__(self):
+        return iter(self.routes)
+
+    def __repr__(self):
+        return f"AssetRoutes({self.routes!r})"
+
+
+class RoutingTable:
+    """In-process map from asset_id to its AssetRoutes (None when unlinked).
+
+    Entries are invalidated precisely by the model signals in signals.py.
+    With ``use_version_stamp`` the table also polls RoutingVersion at most
+    every ``check_interval`` seconds and drops everything when another
+    process has changed the routing data.
+    """
+
+    def __init__(self, maxsize=10000, use_version_stamp=False,
+                 check_interval=1.0):
+        self.use_version_stamp = use_version_stamp
+        self.check_interval = check_interval
+        self._routes = LRUCache(self._load, maxsize=maxsize)
+        self._version = None
+        self._checked_at = None
+
+    @staticmethod
+    def _links(asset_ids):
+        return (KPIAssetLink.objects.select_related('kpi')
+                .filter(asset_id__in=asset_ids).order_by('pk'))
+
+    @staticmethod
+    def _group(asset_ids, links):
+        grouped = {asset_id: [] for asset_id in asset_ids}
+        for link in links:
+            grouped[link.asset_id].append(Route(
+                link.pk, link.kpi_id, link.kpi.expression, link.kpi.bytecode))
+        return {asset_id: AssetRoutes(routes) if routes else None
+                for asset_id, routes in grouped.items()}
+
+    def _load(self, asset_id):
+        return self._load_many([asset_id])[asset_id]
+
+    async def _aload(self, asset_id):
+        links = [link async for link in self._links([asset_id])]
+        return self._group([asset_id], links)[asset_id]
+
+    def _load_many(self, asset_ids):
+        return self._group(asset_ids, self._links(asset_ids))
+
+    def _version_check_due(self):
+        return (self._checked_at is None
+                or time.monotonic() - self._checked_at >= self.check_interval)
+
+    def _check_version(self):
+        if self._version_check_due():
+            self._apply_version(RoutingVersion.objects.filter(pk=1)
+                                .values_list('version', flat=True).first())
+
+    async def _acheck_version(self):
+        if self._version_check_due():
+            self._apply_version(await RoutingVersion.objects.filter(pk=1)
+                                .values_list('version', flat=True).afirst())
+
+    def _apply_version(self, version):
+        first_check = self._checked_at is None
+        self._checked_at = time.monotonic()
+        if version != self._version:
+            if not first_check:
+                self._routes.clear()
+            self._version = version
+
+    def route(self, asset_id):
+        if self.use_version_stamp:
+            self._check_version()
+        return self._routes.get(str(asset_id))
+
+    async def aroute(self, asset_id):
+        """Async counterpart of ``route`` using the async ORM on a miss."""
+        if self.use_version_stamp:
+            await self._acheck_version()
+        return await self._routes.aget(str(asset_id), self._aload)
+
+    def route_many(self, asset_ids):
+        """Resolve many assets, fetching all uncached links in one query.
+
+        The returned dict is keyed by the string form of each asset ID.
+        """
+        if self.use_version_stamp:
+            self._check_version()
+        keys = [str(asset_id) for asset_id in asset_ids]
+        return self._routes.get_many(keys, self._load_many)
+
+    def invalidate_asset(self, asset_id):
+        self._routes.discard(asset_id)
+
+    def invalidate_link(self, link_id):
+        self._routes.discard_where(
+            lambda routes: routes is not None
+            and any(route.link_id == link_id for route in routes)
+        )
+
+    def invalidate_kpi(self, kpi_id):
+        self._routes.discard_where(
+            lambda routes: routes is not None
+            and any(route.kpi_id == kpi_id for route in routes)
+        )
+
+    def clear(self):
+        self._routes.clear()
+
+    def stats(self):
+        return self._routes.stats()
+
+
+def bump_routing_version():
+    """Tell other processes that routing data changed."""
+    updated = (RoutingVersion.objects.filter(pk=1)
+               .update(version=F('version') + 1))
+    if not updated:
+        RoutingVersion.objects.get_or_create(pk=1, defaults={'version': 1})
+
+
+routing_table = RoutingTable(
+    maxsize=getattr(settings, 'KPI_ROUTING_CACHE_SIZE', 10000),
+    use_version_stamp=getattr(settings, 'KPI_ROUTING_VERSION_STAMP', False),
+    check_interval=getattr(settings, 'KPI_ROUTING_VERSION_CHECK_INTERVAL',
+                           1.0),
+)
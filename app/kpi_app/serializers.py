@@ -1,5 +1,6 @@
 from rest_framework import serializers
 from .models import KPI, KPIAssetLink, EvaluationResult
+from .utils import expression_cache
 
 
 class KPISerializer(serializers.ModelSerializer):
@@ -7,6 +8,14 @@ class KPISerializer(serializers.ModelSerializer):
         model = KPI
         fields = ['id', 'name', 'expression', 'description']
 
+    def validate_expression(self, value):
+        """Compile the expression (and its regex patterns) up front."""
+        try:
+            expression_cache.get(value)
+        except (ValueError, RecursionError) as error:
+            raise serializers.ValidationError(f"Invalid expression: {error}")
+        return value
+
 
 class KPIAssetLinkSerializer(serializers.ModelSerializer):
     class Meta:
@@ -15,6 +24,34 @@ class KPIAssetLinkSerializer(serializers.ModelSerializer):
 
 
 class EvaluationResultSerializer(serializers.ModelSerializer):
+    asset_id = serializers.CharField(source='asset.key', read_only=True)
+    attribute_id = serializers.CharField(source='attribute.key',
+                                         read_only=True)
+    value = serializers.CharField(read_only=True)
+
     class Meta:
         model = EvaluationResult
-        fields = ['id', 'asset_id', 'attribute_id', 'timestamp', 'value']
+        fields = ['id', 'asset_id', 'attribute_id', 'kpi', 'timestamp',
+                  'value']
+
+
+# Columns read by list endpoints that serialize straight from .values()
+RESULT_VALUE_FIELDS = (
+    'id', 'asset__key', 'attribute__key', 'kpi', 'timestamp',
+    'value_type', 'numeric_value', 'integer_value', 'bool_value',
+)
+
+
+def represent_result_row(row):
+    """Same shape as EvaluationResultSerializer, built from a values() row."""
+    return {
+        'id': row['id'],
+        'asset_id': row['asset__key'],
+        'attribute_id': row['attribute__key'],
+        'kpi': row['kpi'],
+        'timestamp': row['timestamp'],
+        'value': EvaluationResult.format_value(
+            row['value_type'], row['numeric_value'], row['bool_value'],
+            row['integer_value'],
+        ),
+    }
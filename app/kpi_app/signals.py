@@ -0,0 +1,42 @@
+from django.db import transaction
+from django.db.models.signals import post_delete, post_save, pre_save
+from django.dispatch import receiver
+from .models import KPI, KPIAssetLink
+from .routing import bump_routing_version, routing_table
+from .utils import expression_cache
+
+
+def _invalidate(callback):
+    # Run now, and again on commit to drop anything re-read before then
+    callback()
+    transaction.on_commit(callback)
+    if routing_table.use_version_stamp:
+        bump_routing_version()
+
+
+@receiver(pre_save, sender=KPI)
+def store_kpi_bytecode(sender, instance, **kwargs):
+    # Saved with every write of the expression, so it can only go stale
+    # through queryset updates, which load_expression detects
+    try:
+        instance.bytecode = expression_cache.get(instance.expression).bytecode
+    except (ValueError, RecursionError):
+        instance.bytecode = None
+
+
+@receiver([post_save, post_delete], sender=KPI)
+def invalidate_kpi_routes(sender, instance, **kwargs):
+    kpi_id = instance.pk  # cleared on the instance once a delete finishes
+    _invalidate(lambda: routing_table.invalidate_kpi(kpi_id))
+
+
+@receiver([post_save, post_delete], sender=KPIAssetLink)
+def invalidate_link_routes(sender, instance, **kwargs):
+    link_id, asset_id = instance.pk, instance.asset_id
+
+    def callback():
+        # The link may have moved away from a cached asset, and the new
+        # asset may be cached as unlinked
+        routing_table.invalidate_link(link_id)
+        routing_table.invalidate_asset(asset_id)
+    _invalidate(callback)
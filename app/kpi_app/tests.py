@@ -1,7 +1,64 @@
+import io
+import json
+import os
+import random
+import tempfile
+import time
+from datetime import timedelta
+from functools import partial
+from threading import Event, Thread
+from unittest import skipUnless
+from unittest.mock import patch
+from django.core.management import call_command
+from django.core.management.base import CommandError
+from django.core.signals import request_started
 from django.test import TestCase
 from django.urls import reverse
-from .utils import evaluate_and_store_result, parse_timestamp, evaluate_expression
-from .models import KPI, KPIAssetLink, EvaluationResult
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+from .utils import (
+    evaluate_and_store_result,
+    evaluate_expression,
+    expression_cache,
+    load_expression,
+    parse_timestamp,
+    preload_expressions,
+    program_cache,
+    result_buffer,
+    store_results,
+)
+from .models import (
+    KPI, KPIAssetLink, EvaluationResult, Asset, Attribute, AttributeValue,
+    Reading, WindowCheckpoint,
+)
+from .routing import RoutingTable, bump_routing_version, routing_table
+from .dedup import SeenMessages, seen_messages
+from .attributes import attribute_store
+from .window_state import window_store
+from .readings import reading_archive
+from .concurrency import async_limiter
+from .metrics import Metrics, metrics
+from .write_behind import ResultBuffer
+from .memoization import MISSING, ResultMemo, result_memo
+from . import benchmarks
+from .apps import _FirstRequestPreload, _preload
+from .columnar import CONTENT_TYPE, decode_batch, encode_batch
+from .interpreter.cache import LRUCache
+from .interpreter.compiler import (
+    CompiledExpression,
+    coerce_value,
+    compile_expression,
+    load_compiled,
+    parse_expression,
+)
+from .interpreter.bytecode import BYTECODE_VERSION
+from .interpreter.fusion import FusedProgram
+from .interpreter import vectorized
+from .interpreter.lexer import Lexer, ScanningLexer, TokenType
+from .interpreter.parser import Var, Num, RegexOp, UnaryOp
+from .interpreter.patterns import pattern_cache
+from .interpreter.printer import format_tree
+from .interpreter.windows import MovingMax, MovingMin, MovingSum, Rate
 
 
 class EvaluateExpressionTests(TestCase):
@@ -79,11 +136,1769 @@ class EvaluateExpressionTests(TestCase):
 
         # Verify that the EvaluationResult is stored with correct values
         result = EvaluationResult.objects.filter(
-            asset_id="123",
-            attribute_id="output_1",
+            asset__key="123",
+            attribute__key="output_1",
             timestamp=expected_timestamp,
-            value="7"
+            value_type=EvaluationResult.INTEGER,
+            numeric_value=7
         ).first()
 
         self.assertIsNotNone(result)
         self.assertEqual(result.value, "7")
+
+
+def store_result(asset_id, attribute_id, timestamp, value):
+    store_results([
+        EvaluationResult.build(asset_id, attribute_id, timestamp, value)])
+
+
+def stored_values():
+    return sorted(result.value for result in EvaluationResult.objects.all())
+
+
+RESULT_INSERTS = 'INTO "kpi_app_evaluationresult"'
+
+
+def queries_on(queries, fragment):
+    return [query for query in queries.captured_queries
+            if fragment in query["sql"]]
+
+
+class CompiledExpressionTests(TestCase):
+    def test_attr_is_a_variable_node(self):
+        compiled = compile_expression('Regex(ATTR, "^dog")')
+        self.assertIsInstance(compiled.tree, RegexOp)
+        self.assertIsInstance(compiled.tree.value, Var)
+        self.assertEqual(compiled.tree.value.name, "ATTR")
+
+    def test_compiled_expression_is_reusable(self):
+        compiled = compile_expression("ATTR * 2 + 1")
+        self.assertEqual(compiled.evaluate(3), 7)
+        self.assertEqual(compiled.evaluate("10"), 21)
+
+    def test_numeric_strings_are_coerced(self):
+        compiled = compile_expression("ATTR * 2")
+        for value, expected in [("-4", -8), (" 4", 8), ("+7 ", 14),
+                                ("3.5", 7.0), ("1e2", 200.0)]:
+            self.assertEqual(compiled.evaluate(value), expected, value)
+
+    def test_strings_are_rejected_in_arithmetic(self):
+        for backend in ("codegen", "interpreter"):
+            for text in ["ATTR * 3", "ATTR + 1", "-ATTR", "2 * (ATTR - 1)"]:
+                compiled = compile_expression(text, backend=backend)
+                for value in ["ab", "4-", "nan"]:
+                    with self.assertRaises(ValueError, msg=(backend, text)):
+                        compiled.evaluate(value)
+            regex = compile_expression('Regex(ATTR, "^ab")', backend=backend)
+            self.assertIs(regex.evaluate("abc"), True)
+
+    def test_unknown_identifier_is_rejected(self):
+        with self.assertRaises(ValueError):
+            compile_expression("FOO * 2")
+
+    def test_cache_counts_hits_misses_and_evictions(self):
+        cache = LRUCache(compile_expression, maxsize=2)
+        cache.get("ATTR + 1")
+        cache.get("ATTR + 1")
+        cache.get("ATTR + 2")
+        cache.get("ATTR + 3")
+        self.assertNotIn("ATTR + 1", cache)
+        self.assertEqual(
+            cache.stats(),
+            {"size": 2, "maxsize": 2, "hits": 1, "misses": 3, "evictions": 1},
+        )
+
+    def test_nodes_are_compact_and_immutable(self):
+        tree = parse_expression("-ATTR * 2")
+        self.assertEqual(tree.op, TokenType.MUL)
+        self.assertEqual(tree.left.op, TokenType.MINUS)
+        self.assertFalse(hasattr(tree, "__dict__"))
+        with self.assertRaises(AttributeError):
+            tree.op = TokenType.PLUS
+        with self.assertRaises(AttributeError):
+            tree.right.value = 3
+
+    def test_shared_tokens_and_names_are_interned(self):
+        first, second = Lexer("ATTR + 1"), Lexer("2 + 3")
+        first.get_next_token()
+        second.get_next_token()
+        self.assertIs(first.get_next_token(), second.get_next_token())
+        self.assertIs(parse_expression("ATTR + {power}").right.name,
+                      parse_expression("{power} + ATTR").left.name)
+
+    def test_invalid_expression_is_not_cached(self):
+        cache = LRUCache(compile_expression, maxsize=2)
+        with self.assertRaises(ValueError):
+            cache.get("ATTR +")
+        self.assertEqual(len(cache), 0)
+
+
+class BytecodeTests(TestCase):
+    def setUp(self):
+        routing_table.clear()
+        seen_messages.clear()
+        expression_cache.clear()
+
+    def test_round_trip(self):
+        for text in ["-(ATTR * 2) + 1 / 4", 'Regex(ATTR, "^d[o]g")',
+                     "{power} / {flow} - ATTR", "AVG(ATTR, 3) + RATE(ATTR)"]:
+            compiled = compile_expression(text)
+            loaded = load_compiled(text,
+                                   json.loads(json.dumps(compiled.bytecode)))
+            self.assertEqual(format_tree(loaded.tree),
+                             format_tree(compiled.tree))
+            self.assertEqual(loaded.attributes, compiled.attributes)
+            self.assertEqual(len(loaded.windows), len(compiled.windows))
+        text = 'Regex(ATTR, "^dog")'
+        loaded = load_compiled(text, compile_expression(text).bytecode)
+        self.assertIs(loaded.evaluate("doghouse"), True)
+
+    def test_stale_or_malformed_bytecode_is_rejected(self):
+        bytecode = compile_expression("ATTR + 1").bytecode
+        for text, code in [("ATTR + 2", bytecode),
+                           ("ATTR + 1", [BYTECODE_VERSION + 1, *bytecode[1:]]),
+                           ("ATTR + 1", bytecode[:2] + [["bin", "PLUS"]]),
+                           ("ATTR + 1", bytecode[:2] + [["call", "exit"]])]:
+            with self.assertRaises(ValueError):
+                load_compiled(text, code)
+
+    def test_saving_a_kpi_stores_its_bytecode(self):
+        response = self.client.post(reverse('kpi-create'), {
+            "name": "Stored", "expression": "ATTR * 2",
+        }, content_type="application/json")
+        self.assertEqual(response.status_code, 201)
+        kpi = KPI.objects.get(name="Stored")
+        self.assertEqual(kpi.bytecode, compile_expression("ATTR * 2").bytecode)
+        kpi.expression = "ATTR * 3"
+        kpi.save()
+        kpi.refresh_from_db()
+        loaded = load_compiled("ATTR * 3", kpi.bytecode)
+        self.assertEqual(loaded.evaluate(2), 6)
+
+    def test_routes_load_from_bytecode_without_parsing(self):
+        kpi = KPI.objects.create(name="Loaded", expression="ATTR + 5")
+        KPIAssetLink.objects.create(kpi=kpi, asset_id="B1")
+        expression_cache.clear()
+        with patch("kpi_app.interpreter.compiler.parse_expression") as parse:
+            routes = routing_table.route("B1")
+        parse.assert_not_called()
+        self.assertEqual(routes.routes[0].compiled.evaluate(1), 6)
+
+    def test_stale_bytecode_falls_back_to_compiling(self):
+        stale = compile_expression("ATTR + 1").bytecode
+        self.assertEqual(load_expression("ATTR + 2", stale).evaluate(1), 3)
+
+    def test_preload_fills_the_expression_cache(self):
+        KPI.objects.create(name="One", expression="ATTR + 1")
+        KPI.objects.create(name="Two", expression="ATTR + 2")
+        expression_cache.clear()
+        self.assertEqual(preload_expressions(), 2)
+        self.assertIn("ATTR + 1", expression_cache)
+        self.assertIn("ATTR + 2", expression_cache)
+        self.assertEqual(preload_expressions(), 0)
+
+    def test_preload_stores_missing_bytecode(self):
+        KPI.objects.create(name="Old", expression="ATTR + 1")
+        KPI.objects.create(name="Older", expression="ATTR + 2")
+        KPI.objects.update(bytecode=None)
+        expression_cache.clear()
+        with CaptureQueriesContext(connection) as queries:
+            self.assertEqual(preload_expressions(), 2)
+        self.assertEqual(len(queries_on(queries, 'UPDATE "kpi_app_kpi"')), 1)
+        self.assertEqual(KPI.objects.get(name="Old").bytecode,
+                         compile_expression("ATTR + 1").bytecode)
+
+    def test_first_request_waits_for_the_preload(self):
+        KPI.objects.create(name="Warm", expression="ATTR + 3")
+        expression_cache.clear()
+        request_started.connect(_FirstRequestPreload(), weak=False,
+                                dispatch_uid='kpi-preload')
+        self.addCleanup(request_started.disconnect, dispatch_uid='kpi-preload')
+        with patch("kpi_app.apps._preload", wraps=_preload) as preload:
+            self.client.get(reverse('cache-stats'))
+            self.assertIn("ATTR + 3", expression_cache)
+            self.client.get(reverse('cache-stats'))
+        preload.assert_called_once()
+
+
+def random_expression(rng, depth=0):
+    """Build a random KPI expression over ATTR for differential testing."""
+    if depth > 3 or rng.random() < 0.3:
+        return rng.choice(["ATTR", str(rng.randint(0, 20))])
+    if rng.random() < 0.1:
+        return rng.choice(['Regex(ATTR, "^1")', 'Regex(ATTR, "[2-5]$")'])
+    if rng.random() < 0.1:
+        return rng.choice("+-") + random_expression(rng, depth + 1)
+    left = random_expression(rng, depth + 1)
+    right = random_expression(rng, depth + 1)
+    expression = f"{left} {rng.choice('+-*/')} {right}"
+    return f"({expression})" if rng.random() < 0.5 else expression
+
+
+def outcome(compiled, value):
+    try:
+        return compiled.evaluate(value)
+    except ZeroDivisionError:
+        return ZeroDivisionError
+
+
+class CodegenBackendTests(TestCase):
+    def test_backends_agree_on_random_expressions(self):
+        rng = random.Random(1234)
+        for _ in range(300):
+            text = random_expression(rng)
+            codegen = compile_expression(text, backend="codegen")
+            reference = compile_expression(text, backend="interpreter")
+            self.assertEqual(codegen.backend, "codegen")
+            for value in (0, 1, 7, 13, 250, "42"):
+                expected = outcome(reference, value)
+                actual = outcome(codegen, value)
+                self.assertEqual(actual, expected, f"{text} with {value}")
+                self.assertIs(type(actual), type(expected))
+
+    def test_floordiv_semantics(self):
+        compiled = compile_expression("ATTR / 2", backend="codegen")
+        reference = compile_expression("ATTR / 2", backend="interpreter")
+        self.assertEqual(compiled.evaluate(-7), reference.evaluate(-7))
+        self.assertEqual(compiled.evaluate(-7), -4)
+        with self.assertRaises(ZeroDivisionError):
+            compile_expression("ATTR / 0").evaluate(3)
+
+    def test_regex_truthiness(self):
+        compiled = compile_expression('Regex(ATTR, "^dog")')
+        self.assertIs(compiled.evaluate("doghouse"), True)
+        self.assertIs(compiled.evaluate("catflap"), False)
+
+    def test_unary_operators(self):
+        tree = UnaryOp(TokenType.MINUS, UnaryOp(TokenType.MINUS, Num(4)))
+        codegen = CompiledExpression("--4", tree, backend="codegen")
+        reference = CompiledExpression("--4", tree, backend="interpreter")
+        self.assertEqual(codegen.evaluate(0), 4)
+        self.assertEqual(reference.evaluate(0), 4)
+
+    def test_deep_nesting_falls_back_to_interpreter(self):
+        text = "(1 + " * 210 + "ATTR" + ")" * 210
+        compiled = compile_expression(text, backend="codegen")
+        self.assertEqual(compiled.backend, "interpreter")
+        self.assertEqual(compiled.evaluate(5), 215)
+
+
+class EvaluateBatchTests(TestCase):
+    def setUp(self):
+        routing_table.clear()
+        seen_messages.clear()
+        kpi = KPI.objects.create(name="Batch KPI", expression="ATTR * 10")
+        KPIAssetLink.objects.create(kpi=kpi, asset_id="A1")
+        KPIAssetLink.objects.create(
+            kpi=KPI.objects.create(name="Other KPI", expression="ATTR + 1"),
+            asset_id="A2",
+        )
+
+    def message(self, asset_id, value, attribute_id="1"):
+        return {
+            "asset_id": asset_id,
+            "attribute_id": attribute_id,
+            "timestamp": f"2022-07-31T23:28:{value:02d}Z[UTC]",
+            "value": value,
+        }
+
+    def test_batch_resolves_links_and_inserts_in_bulk(self):
+        messages = [self.message("A1", 1), self.message("A2", 2),
+                    self.message("A1", 3)]
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.post(
+                reverse('evaluate-batch'), {"messages": messages},
+                content_type="application/json",
+            )
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json(),
+                         {"evaluated": 3, "duplicates": 0, "errors": []})
+        self.assertEqual(len(queries_on(queries, "kpi_app_kpiassetlink")), 1)
+        self.assertEqual(len(queries_on(queries, RESULT_INSERTS)), 1)
+        self.assertEqual(stored_values(), ["10", "3", "30"])
+
+    def test_batch_reports_errors_per_message(self):
+        broken = self.message("A1", 1)
+        del broken["timestamp"]
+        messages = [self.message("A1", 1), self.message("missing", 1),
+                    {"value": 1}, broken]
+        response = self.client.post(
+            reverse('evaluate-batch'), {"messages": messages},
+            content_type="application/json",
+        )
+        self.assertEqual(response.status_code, 200)
+        body = response.json()
+        self.assertEqual(body["evaluated"], 1)
+        self.assertEqual([error["index"] for error in body["errors"]],
+                         [1, 2, 3])
+        self.assertEqual(EvaluationResult.objects.count(), 1)
+
+    def test_malformed_timestamps_fail_only_their_message(self):
+        messages = [dict(self.message("A1", 1), timestamp=None),
+                    dict(self.message("A1", 2), timestamp=1659310117),
+                    self.message("A1", 3)]
+        response = self.client.post(
+            reverse('evaluate-batch'), {"messages": messages},
+            content_type="application/json",
+        )
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json(), {
+            "evaluated": 1,
+            "duplicates": 0,
+            "errors": [
+                {"index": 0, "error": "Timestamp None is not a string."},
+                {"index": 1,
+                 "error": "Timestamp 1659310117 is not a string."},
+            ],
+        })
+        response = self.client.post(
+            reverse('evaluate-linked-assets'), {"message": messages[0]},
+            content_type="application/json",
+        )
+        self.assertEqual(response.status_code, 400)
+
+    def test_batch_requires_a_list(self):
+        for body in ({"messages": "nope"}, [self.message("A1", 1)]):
+            response = self.client.post(
+                reverse('evaluate-batch'), body,
+                content_type="application/json",
+            )
+            self.assertEqual(response.status_code, 400)
+
+
+class OptimizerTests(TestCase):
+    def optimized(self, text):
+        return format_tree(compile_expression(text).tree)
+
+    def test_constant_subtrees_are_folded(self):
+        self.assertEqual(self.optimized("ATTR * (60 * 60) + 0"),
+                         ["BinOp MUL", "  Var ATTR", "  Num 3600"])
+        self.assertEqual(self.optimized("-(2 - 5) * 4"), ["Num 12"])
+
+    def test_identities_keep_boolean_to_integer_conversion(self):
+        self.assertEqual(self.optimized("(ATTR * 1) - (2 - 2)"),
+                         ["UnaryOp PLUS", "  Var ATTR"])
+        self.assertEqual(self.optimized("1 * (ATTR + 2) + 0"),
+                         ["BinOp PLUS", "  Var ATTR", "  Num 2"])
+        compiled = compile_expression('Regex(ATTR, "^1") * 1')
+        self.assertIs(type(compiled.evaluate(1)), int)
+
+    def test_double_negation_collapses(self):
+        self.assertEqual(self.optimized("--(ATTR * 2)"),
+                         ["BinOp MUL", "  Var ATTR", "  Num 2"])
+        self.assertEqual(self.optimized("-+ATTR"),
+                         ["UnaryOp MINUS", "  Var ATTR"])
+
+    def test_division_semantics_are_preserved(self):
+        self.assertEqual(self.optimized("ATTR / 1"),
+                         ["BinOp DIV", "  Var ATTR", "  Num 1"])
+        self.assertEqual(compile_expression("ATTR / 1").evaluate(7.5), 7.0)
+        compiled = compile_expression("ATTR + 4 / (2 - 2)")
+        self.assertIn("  BinOp DIV", format_tree(compiled.tree))
+        with self.assertRaises(ZeroDivisionError):
+            compiled.evaluate(1)
+
+    def test_parsed_tree_is_not_modified(self):
+        tree = parse_expression("ATTR * (1 + 1)")
+        compile_expression("ATTR * (1 + 1)")
+        self.assertEqual(format_tree(tree), [
+            "BinOp MUL", "  Var ATTR", "  BinOp PLUS", "    Num 1",
+            "    Num 1",
+        ])
+
+    def test_optimized_expressions_match_unoptimized(self):
+        rng = random.Random(4321)
+        for _ in range(300):
+            text = random_expression(rng)
+            plain = compile_expression(text, backend="interpreter",
+                                       optimize=False)
+            for backend in ("codegen", "interpreter"):
+                compiled = compile_expression(text, backend=backend)
+                for value in (0, 1, 7, -3, 2.5, True, "42"):
+                    expected = outcome(plain, value)
+                    actual = outcome(compiled, value)
+                    self.assertEqual(actual, expected,
+                                     f"{text} with {value!r}")
+                    self.assertIs(type(actual), type(expected))
+
+    def test_explain_view_shows_both_trees(self):
+        kpi = KPI.objects.create(name="Hourly",
+                                 expression="ATTR * (60 * 60) + 0")
+        response = self.client.get(reverse('kpi-explain', args=[kpi.pk]))
+        self.assertEqual(response.status_code, 200)
+        body = response.json()
+        self.assertEqual(body["tree"], [
+            "BinOp PLUS", "  BinOp MUL", "    Var ATTR", "    BinOp MUL",
+            "      Num 60", "      Num 60", "  Num 0",
+        ])
+        self.assertEqual(body["optimized"],
+                         ["BinOp MUL", "  Var ATTR", "  Num 3600"])
+        self.assertIn("(_operand(env['ATTR']) * 3600)", body["source"])
+
+    def test_explain_unknown_kpi(self):
+        response = self.client.get(reverse('kpi-explain', args=[999]))
+        self.assertEqual(response.status_code, 404)
+
+
+@skipUnless(vectorized.np is not None, "NumPy is not installed")
+class VectorizedEvaluatorTests(TestCase):
+    def test_vectorized_matches_scalar_results(self):
+        rng = random.Random(99)
+        values = [rng.randint(1, 500) for _ in range(200)]
+        for _ in range(100):
+            compiled = compile_expression(random_expression(rng))
+            try:
+                array = vectorized.evaluate_vectorized(compiled.tree, values)
+            except vectorized.NotVectorizable:
+                continue
+            self.assertEqual(array.tolist(),
+                             [compiled.evaluate(value) for value in values])
+
+    def test_floordiv_matches_operator_floordiv(self):
+        compiled = compile_expression("ATTR / 3")
+        values = [-7, -6, -1, 0, 1, 7]
+        array = vectorized.evaluate_vectorized(compiled.tree, values)
+        self.assertEqual(array.tolist(), [-3, -2, -1, 0, 0, 2])
+
+    def test_regex_over_strings(self):
+        compiled = compile_expression('Regex(ATTR, "^dog")')
+        array = vectorized.evaluate_vectorized(
+            compiled.tree, ["doghouse", "cat", "dogma"]
+        )
+        self.assertEqual(array.tolist(), [True, False, True])
+
+    def test_decimal_strings_are_coerced_like_scalars(self):
+        compiled = compile_expression("ATTR * 2")
+        array = vectorized.evaluate_vectorized(compiled.tree, ["3", "10"])
+        self.assertEqual(array.tolist(), [6, 20])
+
+    def test_mixed_columns_match_scalar_results(self):
+        cases = [('Regex(ATTR, "^0")', ["007", "abc"]),
+                 ("ATTR + 1", [1, 2.5]),
+                 ('Regex(ATTR, "^T")', [True, 2]),
+                 ("ATTR * 2", ["-4", " 4", "3.5"])]
+        for text, values in cases:
+            compiled = compile_expression(text)
+            scalar = [compiled.evaluate(value) for value in values]
+            many = compiled.evaluate_many(values)
+            self.assertEqual(many, scalar, text)
+            self.assertEqual([type(result) for result in many],
+                             [type(result) for result in scalar], text)
+
+    def test_fallback_when_not_vectorizable(self):
+        compiled = compile_expression("ATTR * 2")
+        with self.assertRaises(vectorized.NotVectorizable):
+            vectorized.evaluate_vectorized(compiled.tree, [2 ** 62, 1])
+        self.assertEqual(compiled.evaluate_many([2 ** 62, 1]), [2 ** 63, 2])
+
+        division = compile_expression("10 / ATTR")
+        with self.assertRaises(ZeroDivisionError):
+            division.evaluate_many([5, 0])
+
+
+def chain_tokens(text):
+    lexer = Lexer(text)
+    tokens = [lexer.get_next_token()]
+    while tokens[-1].type != TokenType.EOF:
+        tokens.append(lexer.get_next_token())
+    return [(token.type, token.value) for token in tokens]
+
+
+class ScanningLexerTests(TestCase):
+    def test_token_stream_matches_handler_chain(self):
+        rng = random.Random(7)
+        texts = [random_expression(rng) for _ in range(200)]
+        texts.append('Regex(doghouse, "^d[a-z]+") + Regexes')
+        texts.append("  ATTR\t+ 1  ")
+        texts.append('{power} / {flow.rate_2} + Regex({mode}, "^on")')
+        for text in texts:
+            scanned = [(token.type, token.value)
+                       for token in ScanningLexer.tokenize(text)]
+            self.assertEqual(scanned, chain_tokens(text), text)
+
+    def test_parses_like_handler_chain(self):
+        """The default lexer accepts and rejects what the chain did."""
+        rng = random.Random(11)
+        texts = [random_expression(rng) for _ in range(200)]
+        texts += [benchmarks.SHALLOW_EXPRESSION, benchmarks.DEEP_EXPRESSION,
+                  benchmarks.REGEX_EXPRESSION]
+        texts += [
+            "AVG(ATTR, 3) + SUM(ATTR,2)", "DELTA(ATTR)", "RATE( ATTR )",
+            "MAX(ATTR, 0)", "-+-ATTR", "ATTR\n+\t1", "{a.b-c_d} * 2",
+            'Regex(12, "1")', 'Regex({mode}, "on")', 'Regex(dog, "d")',
+            'Regex(ATTR, "^a', 'Regex(ATTR "x")', "Regexes", "RegexATTR",
+            "2ATTR", "{}", "{power", "{po wer}", "((ATTR)", "ATTR)", "1 2",
+            "ATTR,", "ATTR % 2", "1.5 * ATTR", "_x", "", "   ", '"x"',
+        ]
+        for text in texts:
+            try:
+                expected = format_tree(parse_expression(text, "chain"))
+            except Exception:
+                # The chain raises AttributeError or IndexError for some
+                # of these; the scanner reports all of them as ValueError
+                with self.assertRaises(ValueError, msg=text):
+                    parse_expression(text, "scan")
+            else:
+                self.assertEqual(format_tree(parse_expression(text, "scan")),
+                                 expected, text)
+
+    def test_tokens_carry_source_offsets(self):
+        tokens = ScanningLexer.tokenize("ATTR  * 12")
+        self.assertEqual([token.pos for token in tokens], [0, 6, 8, 10])
+
+    def test_unexpected_character(self):
+        with self.assertRaises(ValueError):
+            ScanningLexer.tokenize("ATTR % 2")
+
+    def test_lexer_is_selectable(self):
+        for lexer in ("chain", "scan"):
+            compiled = compile_expression("ATTR * (2 + 1)", lexer=lexer)
+            self.assertEqual(compiled.evaluate(4), 12)
+
+
+class RegexPatternTests(TestCase):
+    def test_pattern_is_compiled_at_parse_time(self):
+        compiled = compile_expression('Regex(ATTR, "^pump-[0-9]+$")')
+        self.assertEqual(compiled.tree.regex.pattern, "^pump-[0-9]+$")
+        self.assertIn("^pump-[0-9]+$", pattern_cache)
+
+    def test_invalid_pattern_is_rejected_when_parsing(self):
+        with self.assertRaises(ValueError):
+            compile_expression('Regex(ATTR, "([a-z")')
+
+    def test_invalid_pattern_is_rejected_at_kpi_creation(self):
+        data = {"name": "Broken", "expression": 'Regex(ATTR, "([a-z")'}
+        response = self.client.post(reverse('kpi-create'), data,
+                                    content_type="application/json")
+        self.assertEqual(response.status_code, 400)
+        self.assertIn("expression", response.json())
+        self.assertFalse(KPI.objects.filter(name="Broken").exists())
+
+    def test_invalid_syntax_is_rejected_at_kpi_creation(self):
+        data = {"name": "Broken", "expression": "ATTR * * 2"}
+        response = self.client.post(reverse('kpi-create'), data,
+                                    content_type="application/json")
+        self.assertEqual(response.status_code, 400)
+
+    def test_cache_stats_endpoint(self):
+        compile_expression('Regex(ATTR, "^stats")')
+        response = self.client.get(reverse('cache-stats'))
+        self.assertEqual(response.status_code, 200)
+        self.assertGreaterEqual(response.json()["patterns"]["size"], 1)
+        self.assertIn("hits", response.json()["expressions"])
+
+
+class RoutingTableTests(TestCase):
+    def setUp(self):
+        routing_table.clear()
+        seen_messages.clear()
+        self.kpi = KPI.objects.create(name="Routed KPI", expression="ATTR + 2")
+        self.link = KPIAssetLink.objects.create(kpi=self.kpi, asset_id="R1")
+        self.url = reverse('evaluate-linked-assets')
+        self.second = 0
+
+    def evaluate(self, asset_id="R1", value=5):
+        # A new reading each time; a repeated timestamp would be a duplicate
+        self.second += 1
+        message = {
+            "asset_id": asset_id,
+            "attribute_id": "1",
+            "timestamp": f"2022-07-31T23:28:{self.second:02d}Z[UTC]",
+            "value": value,
+        }
+        return self.client.post(self.url, {"message": message},
+                                content_type="application/json")
+
+    def test_cached_route_skips_link_lookup(self):
+        self.assertEqual(self.evaluate().status_code, 200)
+        with CaptureQueriesContext(connection) as queries:
+            self.assertEqual(self.evaluate().status_code, 200)
+        self.assertEqual(queries_on(queries, "kpi_app_kpiassetlink"), [])
+        self.assertEqual(stored_values(), ["7", "7"])
+
+    def test_expression_change_invalidates_route(self):
+        self.evaluate()
+        self.kpi.expression = "ATTR * 3"
+        self.kpi.save()
+        self.evaluate()
+        self.assertEqual(EvaluationResult.objects.last().value, "15")
+
+    def test_link_changes_invalidate_route(self):
+        self.assertEqual(self.evaluate("R2").status_code, 404)
+        self.link.asset_id = "R2"
+        self.link.save()
+        self.assertEqual(self.evaluate("R2").status_code, 200)
+        self.assertEqual(self.evaluate("R1").status_code, 404)
+        self.link.delete()
+        self.assertEqual(self.evaluate("R2").status_code, 404)
+
+    def test_version_stamp_detects_changes_from_other_processes(self):
+        table = RoutingTable(use_version_stamp=True, check_interval=0)
+        self.assertEqual([route.kpi_id for route in table.route("R1")],
+                         [self.kpi.pk])
+        # Simulate another worker relinking the asset without our signals
+        KPIAssetLink.objects.filter(pk=self.link.pk).update(asset_id="R9")
+        self.assertIsNotNone(table.route("R1"))
+        bump_routing_version()
+        self.assertIsNone(table.route("R1"))
+
+
+class AsyncEvaluateTests(TestCase):
+    def setUp(self):
+        routing_table.clear()
+        seen_messages.clear()
+        kpi = KPI.objects.create(name="Async KPI", expression="ATTR * 4")
+        KPIAssetLink.objects.create(kpi=kpi, asset_id="AS1")
+        self.url = reverse('evaluate-async')
+        self.message = {
+            "asset_id": "AS1",
+            "attribute_id": "2",
+            "timestamp": "2022-07-31T23:28:37Z[UTC]",
+            "value": 5,
+        }
+
+    async def test_async_evaluation_stores_result(self):
+        response = await self.async_client.post(
+            self.url, {"message": self.message},
+            content_type="application/json",
+        )
+        self.assertEqual(response.status_code, 200)
+        result = await EvaluationResult.objects.select_related(
+            "attribute").aget(asset__key="AS1")
+        self.assertEqual(result.value, "20")
+        self.assertEqual(result.attribute.key, "output_2")
+
+    async def test_unlinked_asset(self):
+        self.message["asset_id"] = "nope"
+        response = await self.async_client.post(
+            self.url, {"message": self.message},
+            content_type="application/json",
+        )
+        self.assertEqual(response.status_code, 404)
+
+    async def test_rejects_when_too_many_in_flight(self):
+        limit = async_limiter.limit
+        async_limiter.limit = 0
+        try:
+            response = await self.async_client.post(
+                self.url, {"message": self.message},
+                content_type="application/json",
+            )
+        finally:
+            async_limiter.limit = limit
+        self.assertEqual(response.status_code, 503)
+        self.assertEqual(await EvaluationResult.objects.acount(), 0)
+
+
+class MultiAttributeKPITests(TestCase):
+    def setUp(self):
+        routing_table.clear()
+        seen_messages.clear()
+        attribute_store.clear()
+        self.kpi = KPI.objects.create(name="Efficiency",
+                                      expression="{power} / {flow}")
+        KPIAssetLink.objects.create(kpi=self.kpi, asset_id="M1")
+
+    def evaluate(self, attribute_id, value, second=0):
+        url = reverse('evaluate-linked-assets')
+        return self.client.post(url, {"message": {
+            "asset_id": "M1", "attribute_id": attribute_id, "value": value,
+            "timestamp": f"2022-07-31T23:28:{second:02d}Z[UTC]",
+        }}, content_type="application/json")
+
+    def kpi_values(self):
+        return [result.value for result in EvaluationResult.objects
+                .filter(attribute__key=f"kpi_{self.kpi.pk}").order_by("id")]
+
+    def test_attribute_references_are_dependencies(self):
+        compiled = compile_expression(
+            '{power} / {flow} + Regex({mode}, "^on")')
+        self.assertEqual(compiled.attributes, {"power", "flow", "mode"})
+        self.assertFalse(compiled.uses_value)
+        self.assertEqual(compiled.evaluate_with(
+            {"power": 9, "flow": 2, "mode": "on"}), 5)
+        for text in ("{ATTR} + 1", "{} + 1", "{power + 1"):
+            with self.assertRaises(ValueError, msg=text):
+                compile_expression(text)
+            with self.assertRaises(ValueError, msg=text):
+                compile_expression(text, lexer="chain")
+
+    def test_evaluates_once_every_referenced_attribute_is_known(self):
+        response = self.evaluate("power", 100)
+        self.assertEqual(response.json(), {
+            "status": "Evaluation completed", "evaluated": 0, "duplicates": 0,
+            "errors": [{"kpi": self.kpi.pk,
+                        "error": "Waiting for attribute(s): flow."}],
+        })
+        self.assertEqual(self.evaluate("flow", "4", 1).status_code, 200)
+        self.assertEqual(self.kpi_values(), ["25"])
+
+    def test_only_dependent_messages_re_evaluate(self):
+        self.evaluate("power", 100)
+        self.evaluate("flow", 4, 1)
+        response = self.evaluate("temperature", 80, 2)
+        self.assertEqual(response.json(), {
+            "status": "Evaluation completed", "evaluated": 0, "duplicates": 0,
+            "errors": [],
+        })
+        self.assertFalse(AttributeValue.objects.filter(
+            attribute__key="temperature").exists())
+
+        with CaptureQueriesContext(connection) as queries:
+            self.evaluate("power", 200, 3)
+        # The cached flow value is reused instead of being read back
+        self.assertEqual(
+            queries_on(queries, 'FROM "kpi_app_attributevalue"'), [])
+        self.assertEqual(self.kpi_values(), ["25", "50"])
+
+    def test_latest_evaluation_at_a_timestamp_wins(self):
+        self.evaluate("flow", 10)
+        self.evaluate("power", 300, 1)
+        self.assertEqual(self.kpi_values(), ["30"])
+        response = self.evaluate("flow", 3, 1)
+        self.assertEqual(response.json()["evaluated"], 1)
+        self.assertEqual(response.json()["duplicates"], 0)
+        self.assertEqual(self.kpi_values(), ["100"])
+
+        messages = [
+            {"asset_id": "M1", "attribute_id": attribute_id, "value": value,
+             "timestamp": "2022-07-31T23:28:02Z[UTC]"}
+            for attribute_id, value in (("power", 50), ("flow", 25))
+        ]
+        url = reverse('evaluate-batch')
+        response = self.client.post(url, {"messages": messages},
+                                    content_type="application/json")
+        self.assertEqual(response.json(),
+                         {"evaluated": 2, "duplicates": 0, "errors": []})
+        self.assertEqual(self.kpi_values(), ["100", "2"])
+
+    def test_out_of_order_readings_are_ignored(self):
+        self.evaluate("flow", 4, 10)
+        self.evaluate("power", 100, 10)
+        self.evaluate("flow", 2, 5)
+        self.assertEqual(self.kpi_values(), ["25"])
+        self.assertEqual(
+            AttributeValue.objects.get(attribute__key="flow").value, 4)
+
+    def test_state_is_reloaded_after_a_restart(self):
+        self.evaluate("power", 100)
+        self.evaluate("flow", 4, 1)
+        attribute_store.clear()
+        self.evaluate("flow", 5, 2)
+        self.assertEqual(self.kpi_values(), ["25", "20"])
+
+    def test_batch_applies_readings_in_order(self):
+        messages = [
+            {"asset_id": "M1", "attribute_id": "power", "value": 100,
+             "timestamp": "2022-07-31T23:28:00Z[UTC]"},
+            {"asset_id": "M1", "attribute_id": "flow", "value": 4,
+             "timestamp": "2022-07-31T23:28:01Z[UTC]"},
+            {"asset_id": "M1", "attribute_id": "power", "value": 200,
+             "timestamp": "2022-07-31T23:28:02Z[UTC]"},
+        ]
+        url = reverse('evaluate-batch')
+        response = self.client.post(url, {"messages": messages},
+                                    content_type="application/json")
+        self.assertEqual(response.json(), {
+            "evaluated": 2, "duplicates": 0,
+            "errors": [{"index": 0, "kpi": self.kpi.pk,
+                        "error": "Waiting for attribute(s): flow."}],
+        })
+        self.assertEqual(self.kpi_values(), ["25", "50"])
+        self.assertEqual(
+            AttributeValue.objects.get(attribute__key="power").value, 200)
+
+
+class WindowFunctionTests(TestCase):
+    def setUp(self):
+        routing_table.clear()
+        seen_messages.clear()
+        window_store.clear()
+        self.kpi = KPI.objects.create(name="Smoothed",
+                                      expression="AVG(ATTR, 3)")
+        KPIAssetLink.objects.create(kpi=self.kpi, asset_id="W1")
+
+    def evaluate(self, value, second=0, attribute_id=1):
+        url = reverse('evaluate-linked-assets')
+        return self.client.post(url, {"message": {
+            "asset_id": "W1", "attribute_id": attribute_id, "value": value,
+            "timestamp": f"2022-07-31T23:28:{second:02d}Z[UTC]",
+        }}, content_type="application/json")
+
+    def values(self, attribute_id="output_1"):
+        return [result.value for result in EvaluationResult.objects
+                .filter(attribute__key=attribute_id).order_by("id")]
+
+    def test_accumulators_match_recomputation(self):
+        rng = random.Random(5)
+        values = [rng.randint(-50, 50) for _ in range(300)]
+        for size in (1, 2, 7):
+            windows = [MovingSum(size), MovingMin(size), MovingMax(size)]
+            for index, value in enumerate(values):
+                last = values[max(0, index + 1 - size):index + 1]
+                self.assertEqual(
+                    [window.push(value, None) for window in windows],
+                    [sum(last), min(last), max(last)])
+
+    def test_rate_is_per_second(self):
+        rate = Rate()
+        start = parse_timestamp("2022-07-31T23:28:00Z[UTC]")
+        self.assertEqual(rate.push(10, start), 0.0)
+        self.assertEqual(rate.push(40, start + timedelta(seconds=15)), 2.0)
+        with self.assertRaises(ValueError):
+            rate.push(50, start)
+
+    def test_bad_reading_does_not_break_the_window(self):
+        self.evaluate("abc", 0)
+        for second, value in enumerate((3, 6, 9), 1):
+            self.evaluate(value, second)
+        self.assertEqual(self.values(), ["3.0", "4.5", "6.0"])
+        window = MovingSum(2)
+        window.restore({"values": [1, "abc", 2]})
+        self.assertEqual(window.push(4, None), 6)
+        with self.assertRaises(TypeError):
+            window.push("abc", None)
+        self.assertEqual(window.push(5, None), 9)
+
+    def test_grammar(self):
+        compiled = compile_expression("DELTA(ATTR) + MAX(ATTR * 2, 5)")
+        self.assertTrue(compiled.is_stateful)
+        self.assertEqual(format_tree(compiled.tree), [
+            "BinOp PLUS", "  Window DELTA", "    Var ATTR",
+            "  Window MAX 5", "    BinOp MUL", "      Var ATTR", "      Num 2",
+        ])
+        self.assertFalse(compile_expression("ATTR + 1").is_stateful)
+        for text in ("AVG(ATTR)", "AVG(ATTR, 0)", "RATE(ATTR, 3)", "SUM"):
+            with self.assertRaises(ValueError, msg=text):
+                compile_expression(text)
+        with self.assertRaises(ValueError):
+            compiled.evaluate(1)
+
+    def test_windows_advance_per_message(self):
+        for second, value in enumerate((3, 6, 9, 12)):
+            self.assertEqual(self.evaluate(value, second).status_code, 200)
+        self.evaluate(100, 5, attribute_id=2)
+        self.assertEqual(self.values(), ["3.0", "4.5", "6.0", "9.0"])
+        self.assertEqual(self.values("output_2"), ["100.0"])
+
+    def test_state_resumes_from_checkpoint_without_history(self):
+        window_store.checkpoint_interval = 0
+        self.addCleanup(setattr, window_store, "checkpoint_interval",
+                        window_store.checkpoint_interval)
+        self.evaluate(3)
+        self.evaluate(6, 1)
+        self.assertEqual(WindowCheckpoint.objects.get().state,
+                         [{"values": [3, 6]}])
+
+        window_store.clear()
+        with CaptureQueriesContext(connection) as queries:
+            self.evaluate(9, 2)
+        self.assertEqual(
+            queries_on(queries, 'FROM "kpi_app_evaluationresult"'), [])
+        self.assertEqual(self.values(), ["3.0", "4.5", "6.0"])
+
+    def test_changed_expression_starts_new_windows(self):
+        self.evaluate(3)
+        self.evaluate(6, 1)
+        self.kpi.expression = "SUM(ATTR, 3)"
+        self.kpi.save()
+        self.evaluate(9, 2)
+        self.assertEqual(self.values(), ["3.0", "4.5", "9"])
+
+    def test_batch_evaluates_windows_in_order(self):
+        messages = [{"asset_id": "W1", "attribute_id": 1, "value": value,
+                     "timestamp": f"2022-07-31T23:28:0{second}Z[UTC]"}
+                    for second, value in enumerate((2, 4, 9))]
+        url = reverse('evaluate-batch')
+        response = self.client.post(url, {"messages": messages},
+                                    content_type="application/json")
+        self.assertEqual(response.json(),
+                         {"evaluated": 3, "duplicates": 0, "errors": []})
+        self.assertEqual(self.values(), ["2.0", "3.0", "5.0"])
+
+    async def test_async_endpoint_keeps_window_state(self):
+        for second, value in enumerate((4, 8)):
+            url = reverse('evaluate-async')
+            response = await self.async_client.post(url, {"message": {
+                "asset_id": "W1", "attribute_id": 1, "value": value,
+                "timestamp": f"2022-07-31T23:28:0{second}Z[UTC]",
+            }}, content_type="application/json")
+            self.assertEqual(response.status_code, 200)
+        values = [result.value async for result
+                  in EvaluationResult.objects.order_by("id")]
+        self.assertEqual(values, ["4.0", "6.0"])
+
+
+class MultiKPIFanOutTests(TestCase):
+    def setUp(self):
+        routing_table.clear()
+        seen_messages.clear()
+        self.kpis = [KPI.objects.create(name=f"K{index}",
+                                        expression=expression)
+                     for index, expression in enumerate(
+                         ["ATTR * 3600", "ATTR * 3600 + 1",
+                          "100 / (ATTR - 2)"])]
+        for kpi in self.kpis:
+            KPIAssetLink.objects.create(kpi=kpi, asset_id="F1")
+
+    def evaluate(self, value):
+        url = reverse('evaluate-linked-assets')
+        return self.client.post(url, {"message": {
+            "asset_id": "F1", "attribute_id": 1, "value": value,
+            "timestamp": "2022-07-31T23:28:00Z[UTC]",
+        }}, content_type="application/json")
+
+    def test_asset_links_to_many_kpis_once_each(self):
+        kpi = KPI.objects.create(name="Another", expression="ATTR")
+        url = reverse('kpi-asset-link-create')
+        response = self.client.post(url, {"kpi": kpi.pk, "asset_id": "F1"})
+        self.assertEqual(response.status_code, 201)
+        response = self.client.post(url, {"kpi": kpi.pk, "asset_id": "F1"})
+        self.assertEqual(response.status_code, 400)
+
+    def test_every_linked_kpi_is_stored_in_one_insert(self):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.evaluate(3)
+        self.assertEqual(response.json(), {
+            "status": "Evaluation completed", "evaluated": 3, "duplicates": 0,
+            "errors": [],
+        })
+        self.assertEqual(len(queries_on(queries, RESULT_INSERTS)), 1)
+        rows = EvaluationResult.objects.order_by("kpi_id")
+        self.assertEqual([(row.kpi_id, row.value) for row in rows],
+                         [(kpi.pk, value) for kpi, value
+                          in zip(self.kpis, ["10800", "10801", "100"])])
+        response = self.client.get(reverse('evaluation-list'),
+                                   {"kpi": self.kpis[1].pk})
+        self.assertEqual([row["value"] for row in response.json()["results"]],
+                         ["10801"])
+
+    def test_failing_kpi_does_not_block_the_others(self):
+        response = self.evaluate(2)
+        self.assertEqual(response.json(), {
+            "status": "Evaluation completed", "evaluated": 2, "duplicates": 0,
+            "errors": [{"kpi": self.kpis[2].pk,
+                        "error": "integer division or modulo by zero"}],
+        })
+
+    def test_unstorable_result_fails_only_its_kpi(self):
+        response = self.evaluate(2 ** 62)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()["evaluated"], 1)
+        self.assertEqual([error["kpi"] for error in response.json()["errors"]],
+                         [self.kpis[0].pk, self.kpis[1].pk])
+        self.assertEqual(EvaluationResult.objects.get().kpi_id,
+                         self.kpis[2].pk)
+
+    def test_shared_subexpressions_are_computed_once(self):
+        linked = routing_table.route("F1")
+        self.assertEqual(len(linked.program), 3)
+        self.assertEqual(len(linked.program.shared), 1)
+        # ATTR, 3600, ATTR * 3600, 1, the sum, 100, 2, ATTR - 2 and the
+        # quotient
+        self.assertEqual(linked.program.node_count, 9)
+        memo = {}
+        self.assertEqual(linked.program.evaluate(0, {"ATTR": 2}, memo), 7200)
+        self.assertEqual(list(memo.values()), [7200])
+
+    def test_fused_program_matches_separate_evaluation(self):
+        rng = random.Random(99)
+        for backend in ("codegen", "interpreter"):
+            for _ in range(40):
+                count = rng.randint(2, 6)
+                texts = [random_expression(rng) for _ in range(count)]
+                texts.append(texts[0])
+                expressions = [compile_expression(text, backend=backend)
+                               for text in texts]
+                program = FusedProgram(expressions)
+                for value in (0, 1, 7, 250, "42"):
+                    memo = {}
+                    for index, compiled in enumerate(expressions):
+                        try:
+                            actual = program.evaluate(
+                                index, {"ATTR": coerce_value(value)}, memo)
+                        except ZeroDivisionError:
+                            actual = ZeroDivisionError
+                        expected = outcome(compiled, value)
+                        self.assertEqual(actual, expected,
+                                         f"{texts[index]} with {value}")
+                        self.assertIs(type(actual), type(expected))
+
+
+class EvaluateStreamTests(TestCase):
+    def setUp(self):
+        routing_table.clear()
+        seen_messages.clear()
+        kpi = KPI.objects.create(name="Stream KPI", expression="ATTR + 100")
+        KPIAssetLink.objects.create(kpi=kpi, asset_id="S1")
+        self.url = reverse('evaluate-stream')
+
+    def line(self, value, asset_id="S1"):
+        return json.dumps({
+            "asset_id": asset_id,
+            "attribute_id": "1",
+            "timestamp": f"2022-07-31T23:28:{value:02d}Z[UTC]",
+            "value": value,
+        })
+
+    def post(self, body):
+        response = self.client.post(self.url, body,
+                                    content_type="application/x-ndjson")
+        lines = b"".join(response.streaming_content).decode().splitlines()
+        return response, [json.loads(line) for line in lines]
+
+    def test_stream_is_stored_in_chunks(self):
+        body = "\n".join(self.line(value) for value in range(5)) + "\n"
+        with self.settings(KPI_NDJSON_CHUNK_SIZE=2):
+            response, progress = self.post(body)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual([chunk["lines"] for chunk in progress[:-1]],
+                         [[1, 2], [3, 4], [5, 5]])
+        self.assertEqual(progress[-1],
+                         {"done": True, "evaluated": 5, "failed": 0,
+                          "duplicates": 0})
+        self.assertEqual(EvaluationResult.objects.count(), 5)
+
+    def test_stream_reports_bad_lines_per_chunk(self):
+        untimed = json.dumps(dict(json.loads(self.line(4)), timestamp=None))
+        body = "\n".join([self.line(1), "{not json", "",
+                          self.line(2, asset_id="unknown"), self.line(3),
+                          untimed])
+        response, progress = self.post(body)
+        self.assertEqual([error["line"] for error in progress[0]["errors"]],
+                         [2, 4, 6])
+        self.assertEqual(progress[-1],
+                         {"done": True, "evaluated": 2, "failed": 3,
+                          "duplicates": 0})
+
+    def test_stream_requires_ndjson(self):
+        response = self.client.post(self.url, {"messages": []},
+                                    content_type="application/json")
+        self.assertEqual(response.status_code, 415)
+
+
+class ColumnarBatchTests(TestCase):
+    def setUp(self):
+        routing_table.clear()
+        seen_messages.clear()
+        kpi = KPI.objects.create(name="Columnar KPI", expression="ATTR * 10")
+        KPIAssetLink.objects.create(kpi=kpi, asset_id="C1")
+        self.time = parse_timestamp("2022-07-31T23:28:37Z[UTC]")
+
+    def post(self, body):
+        return self.client.post(reverse('evaluate-batch'), body,
+                                content_type=CONTENT_TYPE)
+
+    def test_round_trip(self):
+        readings = [("C1", "1", self.time, 3), ("C1", "2", 1659310117, 2.5),
+                    ("C2", "1", self.time, True),
+                    ("C1", "é", self.time, "pump")]
+        batch = decode_batch(encode_batch(readings))
+        self.assertEqual(len(batch), 4)
+        self.assertEqual(batch.strings, ["C1", "1", "2", "C2", "é", "pump"])
+        epoch = int(self.time.timestamp())
+        self.assertEqual(list(batch.rows()), [
+            ("C1", "1", epoch, 3), ("C1", "2", 1659310117, 2.5),
+            ("C2", "1", epoch, True), ("C1", "é", epoch, "pump"),
+        ])
+        self.assertEqual(len(decode_batch(encode_batch([]))), 0)
+
+    def test_malformed_batches_are_rejected(self):
+        data = encode_batch([("C1", "1", self.time, "pump")])
+        for broken in (b"", b"JSON" + data[4:], data[:-1], data + b"\0",
+                       data[:-8] + (7).to_bytes(8, "little")):
+            with self.assertRaises(ValueError):
+                decode_batch(broken)
+        response = self.post(data[:-1])
+        self.assertEqual(response.status_code, 400)
+
+    def test_batch_is_evaluated_and_stored_like_json(self):
+        readings = [("C1", "1", self.time + timedelta(seconds=second), second)
+                    for second in range(3)]
+        readings.append(("unknown", "1", self.time, 1))
+        with CaptureQueriesContext(connection) as queries:
+            response = self.post(encode_batch(readings))
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json(), {
+            "evaluated": 3,
+            "duplicates": 0,
+            "errors": [{"index": 3, "error": "No KPI linked to this asset."}],
+        })
+        self.assertEqual(len(queries_on(queries, RESULT_INSERTS)), 1)
+        self.assertEqual(stored_values(), ["0", "10", "20"])
+        latest = EvaluationResult.objects.latest("timestamp")
+        self.assertEqual(latest.timestamp, self.time + timedelta(seconds=2))
+
+    def test_string_values_reach_the_expression(self):
+        KPIAssetLink.objects.create(
+            kpi=KPI.objects.create(name="Pump KPI",
+                                   expression='Regex(ATTR, "^pump")'),
+            asset_id="C2",
+        )
+        later = self.time + timedelta(seconds=1)
+        response = self.post(encode_batch([("C2", "1", self.time, "pump-7"),
+                                           ("C2", "1", later, "valve")]))
+        self.assertEqual(response.json()["evaluated"], 2)
+        self.assertEqual(stored_values(), ["False", "True"])
+
+    def test_out_of_range_timestamp_is_a_row_error(self):
+        response = self.post(encode_batch([("C1", "1", 2 ** 62, 1)]))
+        self.assertEqual(response.json()["errors"][0]["index"], 0)
+        self.assertEqual(EvaluationResult.objects.count(), 0)
+
+
+class DuplicateMessageTests(TestCase):
+    def setUp(self):
+        routing_table.clear()
+        seen_messages.clear()
+        kpi = KPI.objects.create(name="Idempotent", expression="ATTR + 1")
+        KPIAssetLink.objects.create(kpi=kpi, asset_id="D1")
+        self.message = {"asset_id": "D1", "attribute_id": "1", "value": 1,
+                        "timestamp": "2022-07-31T23:28:00Z[UTC]"}
+
+    def evaluate(self, message):
+        url = reverse('evaluate-linked-assets')
+        return self.client.post(url, {"message": message},
+                                content_type="application/json")
+
+    def test_retry_is_acknowledged_without_evaluating(self):
+        self.assertEqual(self.evaluate(self.message).json()["evaluated"], 1)
+        with self.assertNumQueries(0):
+            response = self.evaluate(dict(self.message, value=2))
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json(), {
+            "status": "Duplicate message ignored", "evaluated": 0,
+            "duplicates": 1, "errors": [],
+        })
+        self.assertEqual(stored_values(), ["2"])
+        self.assertEqual(seen_messages.stats()["hits"], 1)
+
+    def test_batches_count_duplicates(self):
+        self.evaluate(self.message)
+        later = dict(self.message, timestamp="2022-07-31T23:28:01Z[UTC]")
+        response = self.client.post(reverse('evaluate-batch'),
+                                    {"messages": [self.message, later, later]},
+                                    content_type="application/json")
+        self.assertEqual(response.json(),
+                         {"evaluated": 1, "duplicates": 2, "errors": []})
+
+        time = parse_timestamp("2022-07-31T23:28:02Z[UTC]")
+        body = encode_batch([("D1", "1", time, 5), ("D1", "1", time, 5)])
+        for duplicates in (1, 2):
+            response = self.client.post(reverse('evaluate-batch'), body,
+                                        content_type=CONTENT_TYPE)
+            self.assertEqual(response.json()["duplicates"], duplicates)
+        self.assertEqual(stored_values(), ["2", "2", "6"])
+
+    def test_database_rejects_duplicates_the_filter_missed(self):
+        self.evaluate(self.message)
+        # As if the retry reached another worker process
+        seen_messages.clear()
+        self.assertEqual(self.evaluate(self.message).json()["evaluated"], 1)
+        self.assertEqual(EvaluationResult.objects.count(), 1)
+        seen_messages.clear()
+        later = dict(self.message, timestamp="2022-07-31T23:29:00Z[UTC]")
+        url = reverse('evaluate-batch')
+        response = self.client.post(url, {"messages": [self.message, later]},
+                                    content_type="application/json")
+        self.assertEqual(response.json(),
+                         {"evaluated": 2, "duplicates": 0, "errors": []})
+        self.assertEqual(EvaluationResult.objects.count(), 2)
+
+    def test_results_without_kpi_are_stored_once(self):
+        evaluate_and_store_result(self.message, "ATTR + 1")
+        evaluate_and_store_result(dict(self.message, value=5), "ATTR + 1")
+        self.assertEqual(stored_values(), ["6"])
+        timestamp = parse_timestamp(self.message["timestamp"])
+        store_results([EvaluationResult.build("D1", "output_1", timestamp, 3),
+                       EvaluationResult.build("D1", "output_1", timestamp, 4)])
+        self.assertEqual(stored_values(), ["4"])
+
+    def test_kpis_sharing_a_series_can_be_deleted(self):
+        second = KPI.objects.create(name="Also D1", expression="ATTR * 2")
+        KPIAssetLink.objects.create(kpi=second, asset_id="D1")
+        self.assertEqual(self.evaluate(self.message).json()["evaluated"], 2)
+        for kpi in KPI.objects.all():
+            kpi.delete()
+        self.assertFalse(EvaluationResult.objects.exists())
+
+    def test_rejected_messages_are_not_remembered(self):
+        broken = dict(self.message, timestamp="yesterday")
+        self.assertEqual(self.evaluate(broken).status_code, 400)
+        self.assertEqual(self.evaluate(broken).status_code, 400)
+
+    def test_disabled_filter_keys_nothing(self):
+        seen = SeenMessages(enabled=False)
+        self.assertIsNone(seen.message_key(self.message))
+        seen.remember([("D1", "1", "2022-07-31T23:28:00Z[UTC]")])
+        self.assertFalse(seen.seen(("D1", "1", "2022-07-31T23:28:00Z[UTC]")))
+        self.assertIsNone(
+            seen_messages.message_key({"asset_id": "D1", "value": [1]}))
+
+
+class EvaluationResultListTests(TestCase):
+    def setUp(self):
+        start = parse_timestamp("2022-07-31T00:00:00Z[UTC]")
+        for minute in range(5):
+            for asset_id in ("L1", "L2"):
+                store_result(asset_id, "output_1",
+                             start + timedelta(minutes=minute), minute)
+        self.url = reverse('evaluation-list')
+
+    def test_results_are_cursor_paginated_in_timestamp_order(self):
+        response = self.client.get(self.url, {"asset_id": "L1",
+                                              "page_size": 2})
+        self.assertEqual(response.status_code, 200)
+        pages = [response.json()]
+        while pages[-1]["next"]:
+            pages.append(self.client.get(pages[-1]["next"]).json())
+        values = [row["value"] for page in pages for row in page["results"]]
+        self.assertEqual(values, ["0", "1", "2", "3", "4"])
+        self.assertEqual(len(pages), 3)
+
+    def test_serialized_shape_is_unchanged(self):
+        row = self.client.get(self.url).json()["results"][0]
+        self.assertEqual(set(row), {"id", "asset_id", "attribute_id",
+                                    "timestamp", "value", "kpi"})
+        self.assertEqual(row["timestamp"], "2022-07-31T00:00:00Z")
+
+    def test_time_range_filter(self):
+        response = self.client.get(self.url, {
+            "asset_id": "L2",
+            "start": "2022-07-31T00:01:00Z",
+            "end": "2022-07-31T00:03:00Z",
+        })
+        values = [row["value"] for row in response.json()["results"]]
+        self.assertEqual(values, ["1", "2"])
+
+    def test_invalid_time_filter(self):
+        response = self.client.get(self.url, {"start": "yesterday"})
+        self.assertEqual(response.status_code, 400)
+
+
+class EvaluationAggregateTests(TestCase):
+    def setUp(self):
+        start = parse_timestamp("2022-07-31T10:00:00Z[UTC]")
+        for minute, value in enumerate([2, 4, 6, 8]):
+            store_result("G1", "output_1",
+                         start + timedelta(minutes=30 * minute), value)
+        store_result("G2", "output_1", start, True)
+        self.url = reverse('evaluation-aggregate')
+
+    def row(self, asset_id, bucket, minimum, maximum, average, count,
+            attribute_id="output_1", kpi=None):
+        return {"asset_id": asset_id, "attribute_id": attribute_id, "kpi": kpi,
+                "bucket": bucket, "min": minimum, "max": maximum,
+                "avg": average, "count": count}
+
+    def test_hourly_buckets_per_asset(self):
+        response = self.client.get(self.url, {"bucket": "1h"})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json(), [
+            self.row("G1", "2022-07-31T10:00:00Z", 2.0, 4.0, 3.0, 2),
+            self.row("G1", "2022-07-31T11:00:00Z", 6.0, 8.0, 7.0, 2),
+            self.row("G2", "2022-07-31T10:00:00Z", 1.0, 1.0, 1.0, 1),
+        ])
+
+    def test_series_of_one_asset_are_not_mixed(self):
+        kpi = KPI.objects.create(name="Other", expression="ATTR")
+        start = parse_timestamp("2022-07-31T10:00:00Z[UTC]")
+        store_results([
+            EvaluationResult.build("G1", "output_2", start, 100),
+            EvaluationResult.build("G1", "output_1", start, 50, kpi_id=kpi.pk),
+        ])
+        response = self.client.get(self.url,
+                                   {"bucket": "1d", "asset_id": "G1"})
+        self.assertEqual(response.json(), [
+            self.row("G1", "2022-07-31T00:00:00Z", 2.0, 8.0, 5.0, 4),
+            self.row("G1", "2022-07-31T00:00:00Z", 50.0, 50.0, 50.0, 1,
+                     kpi=kpi.pk),
+            self.row("G1", "2022-07-31T00:00:00Z", 100.0, 100.0, 100.0, 1,
+                     attribute_id="output_2"),
+        ])
+
+    def test_filters_apply_before_aggregation(self):
+        response = self.client.get(self.url, {
+            "bucket": "1d", "asset_id": "G1",
+            "start": "2022-07-31T10:30:00Z",
+        })
+        self.assertEqual(response.json(), [
+            self.row("G1", "2022-07-31T00:00:00Z", 4.0, 8.0, 6.0, 3),
+        ])
+
+    def test_unknown_bucket(self):
+        response = self.client.get(self.url, {"bucket": "1w"})
+        self.assertEqual(response.status_code, 400)
+
+    def test_results_are_stored_in_typed_columns(self):
+        kpi = KPI.objects.create(name="Numeric KPI", expression="ATTR * 2")
+        evaluate_and_store_result({
+            "asset_id": "G3", "attribute_id": "1",
+            "timestamp": "2022-07-31T23:28:37Z[UTC]", "value": 21,
+        }, kpi.expression)
+        result = EvaluationResult.objects.get(asset__key="G3")
+        self.assertEqual(result.value_type, EvaluationResult.INTEGER)
+        self.assertEqual(result.numeric_value, 42.0)
+        self.assertEqual(result.value, "42")
+
+
+class TypedResultStorageTests(TestCase):
+    def test_each_result_type_round_trips_through_its_column(self):
+        timestamp = parse_timestamp("2022-07-31T23:28:37Z[UTC]")
+        for attribute_id, value in (("int", 7), ("float", 2.5),
+                                    ("bool", False)):
+            store_result("T1", attribute_id, timestamp, value)
+        results = EvaluationResult.objects.select_related("attribute")
+        stored = {result.attribute.key: result for result in results}
+        self.assertEqual(stored["int"].value, "7")
+        self.assertIsNone(stored["int"].bool_value)
+        self.assertEqual(stored["float"].value, "2.5")
+        self.assertEqual(stored["bool"].value, "False")
+        self.assertIs(stored["bool"].bool_value, False)
+        self.assertIsNone(stored["bool"].numeric_value)
+
+    def test_identifiers_are_interned_once(self):
+        timestamp = parse_timestamp("2022-07-31T23:28:37Z[UTC]")
+        for value in range(3):
+            store_result("T2", "output_1", timestamp, value)
+        self.assertEqual(Asset.objects.filter(key="T2").count(), 1)
+        self.assertEqual(Attribute.objects.filter(key="output_1").count(), 1)
+        self.assertEqual(
+            EvaluationResult.objects.values("asset_id").distinct().count(), 1
+        )
+
+    def test_large_integers_are_stored_exactly(self):
+        timestamp = parse_timestamp("2022-07-31T23:28:37Z[UTC]")
+        value = 123456789123 * 10 ** 6 + 1
+        store_result("T4", "output_1", timestamp, value)
+        result = EvaluationResult.objects.get(asset__key="T4")
+        self.assertEqual(result.integer_value, value)
+        self.assertEqual(result.value, str(value))
+        response = self.client.get(reverse('evaluation-list'),
+                                   {"asset_id": "T4"})
+        self.assertEqual(response.json()["results"][0]["value"], str(value))
+        with self.assertRaises(ValueError):
+            EvaluationResult.build("T4", "output_1", timestamp,
+                                   123456789123 * 10 ** 12)
+
+    def test_non_numeric_results_are_rejected(self):
+        with self.assertRaises(ValueError):
+            EvaluationResult.build("T3", "output_1", None, "text")
+
+
+class BenchmarkTests(TestCase):
+    def result(self, seconds):
+        return {"seconds_per_call": seconds}
+
+    def test_compare_flags_slowdowns_beyond_threshold(self):
+        baseline = {"benchmarks": {"a": self.result(1.0),
+                                   "b": self.result(1.0),
+                                   "gone": self.result(1.0)}}
+        results = {"benchmarks": {"a": self.result(1.1),
+                                  "b": self.result(1.5),
+                                  "new": self.result(1.0)}}
+        rows = benchmarks.compare(results, baseline, threshold=0.2)
+        self.assertEqual([(name, regressed) for name, *_, regressed in rows],
+                         [("a", False), ("b", True)])
+
+    def test_command_writes_json_and_fails_on_regression(self):
+        with tempfile.TemporaryDirectory() as directory:
+            output = os.path.join(directory, "results.json")
+            baseline = os.path.join(directory, "baseline.json")
+            options = {"scale": 0.01, "repeat": 1, "output": output,
+                       "baseline": baseline, "stderr": io.StringIO()}
+            call_command("benchmark", "parse_timestamp", save_baseline=True,
+                         **options)
+            self.assertEqual(list(benchmarks.load(baseline)["benchmarks"]),
+                             ["utils.parse_timestamp"])
+
+            stored = benchmarks.load(baseline)
+            parse = stored["benchmarks"]["utils.parse_timestamp"]
+            parse["seconds_per_call"] = 1e-12
+            benchmarks.save(stored, baseline)
+            with self.assertRaisesMessage(CommandError,
+                                          "utils.parse_timestamp"):
+                call_command("benchmark", "parse_timestamp", **options)
+            results = benchmarks.load(output)["benchmarks"]
+            result = results["utils.parse_timestamp"]
+            self.assertEqual(result["calls"], 50)
+
+    def test_memory_benchmark_reports_bytes_per_kpi(self):
+        result = benchmarks.measure_memory(count=40)
+        self.assertEqual(result["kpis"], 40)
+        self.assertGreater(result["tree_bytes_per_kpi"], 0)
+        self.assertGreater(result["bytes_per_kpi"],
+                           result["tree_bytes_per_kpi"])
+        baseline = {"memory": {benchmarks.MEMORY_BENCHMARK: dict(
+            result, bytes_per_kpi=result["bytes_per_kpi"] / 2)}}
+        results = {"memory": {benchmarks.MEMORY_BENCHMARK: result}}
+        rows = benchmarks.compare_memory(results, baseline, threshold=0.2)
+        self.assertEqual([regressed for *_, regressed in rows], [False, True])
+
+
+class ResultBufferTests(TestCase):
+    def setUp(self):
+        self.written = []
+
+    def buffer(self, **options):
+        buffer = ResultBuffer(self.written.append, enabled=True, **options)
+        self.addCleanup(buffer.close)
+        return buffer
+
+    def test_disabled_buffer_writes_through(self):
+        buffer = ResultBuffer(self.written.append)
+        buffer.store(["a"])
+        buffer.store([])
+        self.assertEqual(self.written, [["a"]])
+        self.assertEqual(buffer.stats()["flushes"], 0)
+
+    def test_waiting_stores_share_one_write(self):
+        started, release = Event(), Event()
+
+        def writer(results):
+            started.set()
+            release.wait(5)
+            self.written.append(results)
+        buffer = ResultBuffer(writer, enabled=True, durability='flush')
+        threads = [Thread(target=buffer.store, args=([value],))
+                   for value in "abc"]
+        threads[0].start()
+        started.wait(5)
+        for thread in threads[1:]:
+            thread.start()
+        while buffer.stats()["pending"] < 2:
+            time.sleep(0.001)
+        release.set()
+        for thread in threads:
+            thread.join(5)
+        self.assertEqual(self.written[0], ["a"])
+        self.assertEqual(sorted(self.written[1]), ["b", "c"])
+        self.assertEqual(buffer.stats()["largest_flush"], 2)
+
+    def test_write_errors_reach_flush_durability_callers(self):
+        def writer(results):
+            raise RuntimeError("database is down")
+        buffer = ResultBuffer(writer, enabled=True)
+        with self.assertRaises(RuntimeError):
+            buffer.store(["a"])
+        self.assertEqual(buffer.stats()["failed_rows"], 1)
+
+    def test_enqueue_flushes_on_size_and_time(self):
+        buffer = self.buffer(durability='enqueue', max_rows=3, max_delay=60)
+        buffer.store(["a", "b"])
+        self.assertEqual(self.written, [])
+        buffer.store(["c"])
+        deadline = time.monotonic() + 5
+        while not self.written and time.monotonic() < deadline:
+            time.sleep(0.001)
+        self.assertEqual(self.written, [["a", "b", "c"]])
+
+        buffer.max_delay = 0.01
+        buffer.store(["d"])
+        while len(self.written) < 2 and time.monotonic() < deadline:
+            time.sleep(0.001)
+        self.assertEqual(self.written[1], ["d"])
+        self.assertGreater(buffer.stats()["max_lag"], 0)
+
+    def test_close_flushes_what_is_queued(self):
+        buffer = self.buffer(durability='enqueue', max_delay=60)
+        buffer.store(["a"])
+        buffer.close()
+        self.assertEqual(self.written, [["a"]])
+        buffer.store(["b"])
+        self.assertEqual(self.written, [["a"], ["b"]])
+
+    def test_full_buffer_makes_the_caller_flush(self):
+        buffer = self.buffer(durability='enqueue', max_delay=60, capacity=2)
+        buffer.store(["a", "b"])
+        buffer.store(["c"])
+        self.assertEqual(self.written, [["a", "b"]])
+        self.assertEqual(buffer.stats()["backpressure"], 1)
+        self.assertEqual(buffer.stats()["pending"], 1)
+
+    def test_written_runs_only_after_a_successful_write(self):
+        fail = True
+
+        def writer(results):
+            if fail:
+                raise RuntimeError("database is down")
+            self.written.append(results)
+        buffer = ResultBuffer(writer, enabled=True, durability='enqueue',
+                              max_delay=60)
+        self.addCleanup(buffer.close)
+        acknowledged = []
+        buffer.store(["a"], partial(acknowledged.append, "a"))
+        self.assertEqual(acknowledged, [])
+        with self.assertLogs("kpi_app.write_behind", "ERROR"):
+            buffer.flush()
+        self.assertEqual(acknowledged, [])
+        fail = False
+        buffer.store(["b"], partial(acknowledged.append, "b"))
+        buffer.flush()
+        self.assertEqual(acknowledged, ["b"])
+        buffer.store([], partial(acknowledged.append, "c"))
+        self.assertEqual(acknowledged, ["b", "c"])
+
+    def test_evaluate_stores_through_the_buffer(self):
+        routing_table.clear()
+        seen_messages.clear()
+        kpi = KPI.objects.create(name="Buffered", expression="ATTR + 1")
+        KPIAssetLink.objects.create(kpi=kpi, asset_id="W1")
+        with patch.object(result_buffer, "enabled", True):
+            url = reverse('evaluate-linked-assets')
+            response = self.client.post(url, {"message": {
+                "asset_id": "W1", "attribute_id": 1, "value": 1,
+                "timestamp": "2022-07-31T23:28:00Z[UTC]",
+            }}, content_type="application/json")
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(stored_values(), ["2"])
+        self.assertGreaterEqual(result_buffer.stats()["flushes"], 1)
+
+
+class ResultMemoTests(TestCase):
+    def setUp(self):
+        routing_table.clear()
+        seen_messages.clear()
+        window_store.clear()
+        result_memo.clear()
+        patcher = patch.object(result_memo, "enabled", True)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.addCleanup(result_memo.clear)
+
+    def test_only_pure_attr_expressions_are_keyed(self):
+        memo = ResultMemo(enabled=True)
+        pure = compile_expression('Regex(ATTR, "^1")')
+        self.assertIsNotNone(memo.key(pure, "1"))
+        self.assertNotEqual(memo.key(pure, 1), memo.key(pure, True))
+        self.assertIsNone(memo.key(pure, [1]))
+        self.assertIsNone(memo.key(compile_expression("AVG(ATTR, 3)"), 1))
+        self.assertIsNone(memo.key(compile_expression("{power} * 2"), 1))
+        self.assertIsNone(ResultMemo().key(pure, "1"))
+        self.assertIs(memo.get(None), MISSING)
+
+    def test_repeated_values_skip_evaluation(self):
+        self.assertEqual(evaluate_expression("ATTR * 2", 4), 8)
+        with patch.object(CompiledExpression, "evaluate") as evaluate:
+            self.assertEqual(evaluate_expression("ATTR * 2", 4), 8)
+        evaluate.assert_not_called()
+        self.assertEqual(result_memo.stats()["hits"], 1)
+
+    def test_endpoint_reports_hit_rate_per_kpi(self):
+        status = KPI.objects.create(name="Status",
+                                    expression='Regex(ATTR, "^E[0-9]+$")')
+        smoothed = KPI.objects.create(name="Smoothed",
+                                      expression="AVG(ATTR, 2)")
+        for kpi in (status, smoothed):
+            KPIAssetLink.objects.create(kpi=kpi, asset_id="S7")
+        for second, value in enumerate(["E12", "E12", "OK", "E12"]):
+            self.client.post(reverse('evaluate-linked-assets'), {"message": {
+                "asset_id": "S7", "attribute_id": "1", "value": value,
+                "timestamp": f"2022-07-31T23:28:{second:02d}Z[UTC]",
+            }}, content_type="application/json")
+
+        values = [row.value for row in EvaluationResult.objects
+                  .filter(kpi=status).order_by("timestamp")]
+        self.assertEqual(values, ["True", "True", "False", "True"])
+        stats = self.client.get(reverse('cache-stats')).json()["results"]
+        self.assertEqual(stats["kpis"], {
+            str(status.pk): {"hits": 2, "misses": 2, "hit_rate": 0.5},
+        })
+
+
+class MetricsTests(TestCase):
+    def setUp(self):
+        routing_table.clear()
+        seen_messages.clear()
+        expression_cache.clear()
+        program_cache.clear()
+        metrics.reset()
+        self.kpis = [KPI.objects.create(name="Scaled", expression="ATTR * 2"),
+                     KPI.objects.create(name="Inverse",
+                                        expression="10 / ATTR")]
+        for kpi in self.kpis:
+            KPIAssetLink.objects.create(kpi=kpi, asset_id="P1")
+        self.second = 0
+
+    def evaluate(self, value):
+        self.second += 1
+        url = reverse('evaluate-linked-assets')
+        return self.client.post(url, {"message": {
+            "asset_id": "P1", "attribute_id": 1, "value": value,
+            "timestamp": f"2022-07-31T23:28:{self.second:02d}Z[UTC]",
+        }}, content_type="application/json")
+
+    def scrape(self):
+        response = self.client.get(reverse('metrics'))
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response["Content-Type"].startswith(
+            "text/plain; version=0.0.4"))
+        return response.content.decode().splitlines()
+
+    def test_stages_and_per_kpi_counters_are_exposed(self):
+        self.evaluate(5)
+        self.evaluate(0)
+        lines = self.scrape()
+        scaled, inverse = (kpi.pk for kpi in self.kpis)
+        self.assertIn(f'kpi_evaluations_total{{kpi="{scaled}"}} 2', lines)
+        self.assertIn(f'kpi_evaluations_total{{kpi="{inverse}"}} 1', lines)
+        self.assertIn(f'kpi_evaluation_errors_total{{kpi="{inverse}"}} 1',
+                      lines)
+        self.assertIn(
+            f'kpi_evaluation_duration_seconds_count{{kpi="{inverse}"}} 2',
+            lines)
+        stages = ("lex", "parse", "compile", "route", "timestamp", "insert")
+        for stage in stages:
+            prefix = f'kpi_stage_duration_seconds_count{{stage="{stage}"}}'
+            self.assertTrue(any(line.startswith(prefix) for line in lines),
+                            stage)
+        self.assertIn('kpi_stage_duration_seconds_count{stage="timestamp"} 2',
+                      lines)
+        self.assertIn('kpi_cache_hits_total{cache="routes"} 1', lines)
+
+    def test_histogram_buckets_are_cumulative(self):
+        histogram = Metrics(buckets=(0.1, 1.0))
+        for seconds in (0.05, 0.1, 0.5, 3):
+            histogram.observe("kpi_stage_duration_seconds", ("parse",),
+                              seconds)
+        lines = histogram.render().splitlines()
+        prefix = "kpi_stage_duration_seconds_"
+        self.assertEqual([line for line in lines if line.startswith(prefix)], [
+            'kpi_stage_duration_seconds_bucket{stage="parse",le="0.1"} 2',
+            'kpi_stage_duration_seconds_bucket{stage="parse",le="1.0"} 3',
+            'kpi_stage_duration_seconds_bucket{stage="parse",le="+Inf"} 4',
+            'kpi_stage_duration_seconds_sum{stage="parse"} 3.65',
+            'kpi_stage_duration_seconds_count{stage="parse"} 4',
+        ])
+
+    def test_disabled_metrics_record_nothing(self):
+        disabled = Metrics(enabled=False)
+        self.assertIs(disabled.stage("parse"), disabled.evaluation(1))
+        with disabled.stage("parse"):
+            pass
+        disabled.failed(1)
+        self.assertNotIn("kpi_evaluation_errors_total{", disabled.render())
+        with patch.object(metrics, "enabled", False):
+            self.evaluate(5)
+            self.assertEqual(self.client.get(reverse('metrics')).status_code,
+                             404)
+        self.assertNotIn("kpi_evaluations_total{", metrics.render())
+
+
+class BackfillTests(TestCase):
+    def setUp(self):
+        routing_table.clear()
+        seen_messages.clear()
+        self.start = parse_timestamp("2022-07-31T00:00:00Z[UTC]")
+        self.directory = tempfile.TemporaryDirectory()
+        self.addCleanup(self.directory.cleanup)
+        self.checkpoint = os.path.join(self.directory.name, "backfill.json")
+
+    def archive(self, asset_id, hours, attribute_id="1"):
+        reading_archive.save([(asset_id, attribute_id,
+                               self.start + timedelta(hours=hour), hour)
+                              for hour in hours])
+
+    def backfill(self, kpi, *args):
+        output = io.StringIO()
+        call_command("backfill_kpi", str(kpi.pk),
+                     "--start", "2022-07-31T00:00:00Z",
+                     "--end", "2022-08-02T00:00:00Z",
+                     "--workers", "0", "--shard-hours", "12",
+                     "--chunk-size", "5", "--checkpoint", self.checkpoint,
+                     *args, stdout=output, stderr=io.StringIO())
+        return output.getvalue()
+
+    def results(self, kpi):
+        rows = EvaluationResult.objects.filter(kpi=kpi).order_by(
+            "asset__key", "timestamp")
+        return [(row.asset.key, row.timestamp.hour, row.value)
+                for row in rows]
+
+    def test_archive_records_evaluated_messages(self):
+        kpi = KPI.objects.create(name="Doubled", expression="ATTR * 2")
+        KPIAssetLink.objects.create(kpi=kpi, asset_id="B1")
+        with patch.object(reading_archive, "enabled", True):
+            self.client.post(reverse('evaluate-linked-assets'), {"message": {
+                "asset_id": "B1", "attribute_id": 1, "value": "7",
+                "timestamp": "2022-07-31T23:28:37Z[UTC]",
+            }}, content_type="application/json")
+        reading = Reading.objects.get()
+        self.assertEqual(
+            (reading.asset.key, reading.attribute.key, reading.value),
+            ("B1", "1", "7"))
+
+    def test_results_are_replaced_and_filled_in(self):
+        kpi = KPI.objects.create(name="Doubled", expression="ATTR * 2")
+        for asset_id in ("B1", "B2"):
+            KPIAssetLink.objects.create(kpi=kpi, asset_id=asset_id)
+            self.archive(asset_id, range(0, 24, 3))
+        # A result the old expression stored, and one for another KPI
+        store_results([
+            EvaluationResult.build("B1", "output_1", self.start, 99,
+                                   kpi_id=kpi.pk),
+            EvaluationResult.build("B1", "output_1", self.start, 5),
+        ])
+
+        output = self.backfill(kpi)
+        self.assertIn("[8/8]", output)
+        self.assertIn("16 reading(s): 15 result(s) created, 1 updated", output)
+        self.assertEqual(self.results(kpi)[:3],
+                         [("B1", 0, "0"), ("B1", 3, "6"), ("B1", 6, "12")])
+        self.assertEqual(len(self.results(kpi)), 16)
+        self.assertEqual(EvaluationResult.objects.filter(kpi=None).get().value,
+                         "5")
+        self.assertFalse(os.path.exists(self.checkpoint))
+
+        # Running it again overwrites instead of duplicating
+        self.assertIn("0 result(s) created, 16 updated", self.backfill(kpi))
+
+    def test_stateless_kpis_are_evaluated_column_wise(self):
+        kpi = KPI.objects.create(name="Inverse", expression="36 / ATTR")
+        KPIAssetLink.objects.create(kpi=kpi, asset_id="B1")
+        self.archive("B1", range(0, 24, 3))
+        evaluate_many = CompiledExpression.evaluate_many
+        with patch.object(CompiledExpression, "evaluate_many", autospec=True,
+                          side_effect=evaluate_many) as many:
+            output = self.backfill(kpi)
+        # One chunk per shard holding readings; the one dividing by zero
+        # is evaluated again row by row
+        self.assertEqual(many.call_count, 2)
+        self.assertIn("7 result(s) created, 0 updated, 1 error(s)", output)
+        self.assertEqual(self.results(kpi)[:3],
+                         [("B1", 3, "12"), ("B1", 6, "6"), ("B1", 9, "4")])
+
+    def test_resumes_from_checkpoint(self):
+        kpi = KPI.objects.create(name="Doubled", expression="ATTR * 2")
+        KPIAssetLink.objects.create(kpi=kpi, asset_id="B1")
+        self.archive("B1", range(0, 24, 3))
+        with open(self.checkpoint, "w") as file:
+            json.dump({"run": {"kpi": kpi.pk, "expression": kpi.expression,
+                               "start": "2022-07-31T00:00:00+00:00",
+                               "end": "2022-08-02T00:00:00+00:00",
+                               "shard_hours": 12.0},
+                       "done": ["B1|2022-07-31T00:00:00+00:00"]}, file)
+        output = self.backfill(kpi)
+        self.assertIn("4 shard(s), 1 already done", output)
+        self.assertEqual([hour for _, hour, _ in self.results(kpi)],
+                         [12, 15, 18, 21])
+
+        kpi.expression = "ATTR * 3"
+        kpi.save()
+        with open(self.checkpoint, "w") as file:
+            json.dump({"run": {"kpi": kpi.pk}, "done": []}, file)
+        with self.assertRaisesMessage(CommandError, "different backfill"):
+            self.backfill(kpi)
+        self.assertIn("4 shard(s), 0 already done",
+                      self.backfill(kpi, "--restart"))
+
+    def test_stateful_kpis_warm_up_from_earlier_readings(self):
+        kpi = KPI.objects.create(name="Smoothed", expression="AVG(ATTR, 3)")
+        KPIAssetLink.objects.create(kpi=kpi, asset_id="B1")
+        reading_archive.save([("B1", "1", self.start - timedelta(hours=hour),
+                               30)
+                              for hour in (1, 2, 3, 4)])
+        self.archive("B1", [0, 1, 2])
+        self.assertIn("[1/1]", self.backfill(kpi))
+        self.assertEqual([value for *_, value in self.results(kpi)],
+                         ["20.0", "10.333333333333334", "1.0"])
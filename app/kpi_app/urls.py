@@ -2,17 +2,35 @@ from django.urls import path
 from .views import (
     KPIListView,
     KPICreateView,
+    KPIExplainView,
     KPIAssetLinkCreateView,
     EvaluateLinkedAssetsView,
+    EvaluateBatchView,
+    AsyncEvaluateView,
+    EvaluateStreamView,
     EvaluationResultListView,
+    EvaluationAggregateView,
+    CacheStatsView,
+    MetricsView,
 )
 
 
 urlpatterns = [
     path('list/', KPIListView.as_view(), name='kpi-list'),
     path('create/', KPICreateView.as_view(), name='kpi-create'),
+    path('<int:pk>/explain/', KPIExplainView.as_view(), name='kpi-explain'),
     path('link-asset/', KPIAssetLinkCreateView.as_view(), name='kpi-asset-link-create'),
     path('evaluate/', EvaluateLinkedAssetsView.as_view(), name='evaluate-linked-assets'),
+    path('evaluate/batch/', EvaluateBatchView.as_view(),
+         name='evaluate-batch'),
+    path('evaluate/async/', AsyncEvaluateView.as_view(),
+         name='evaluate-async'),
+    path('evaluate/stream/', EvaluateStreamView.as_view(),
+         name='evaluate-stream'),
     path('evaluations/', EvaluationResultListView.as_view(), name='evaluation-list'),
+    path('evaluations/aggregate/', EvaluationAggregateView.as_view(),
+         name='evaluation-aggregate'),
+    path('stats/cache/', CacheStatsView.as_view(), name='cache-stats'),
+    path('metrics/', MetricsView.as_view(), name='metrics'),
 
 ]
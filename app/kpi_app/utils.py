@@ -1,39 +1,217 @@
-from .models import EvaluationResult
-from .interpreter.lexer import Lexer
-from .interpreter.parser import Parser
-from .interpreter.interpreter import Interpreter
+from .models import KPI, EvaluationResult
+from .interning import asset_keys, attribute_keys
+from .memoization import MISSING, result_memo
+from .metrics import metrics
+from .interpreter.cache import LRUCache
+from .interpreter.compiler import compile_expression, load_compiled
+from .interpreter.fusion import FusedProgram
+from .interpreter.patterns import pattern_cache
+from .write_behind import ResultBuffer
 from datetime import datetime
+from functools import partial
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Q
 from django.utils import timezone
 
 
+EVALUATION_BACKEND = getattr(settings, 'KPI_EVALUATION_BACKEND', 'codegen')
+
+# Compiled expressions keyed by their source text, shared by all requests
+expression_cache = LRUCache(
+    partial(
+        compile_expression,
+        backend=EVALUATION_BACKEND,
+        lexer=getattr(settings, 'KPI_LEXER', 'scan'),
+        optimize=getattr(settings, 'KPI_OPTIMIZE_EXPRESSIONS', True),
+        timed=metrics.stage,
+    ),
+    maxsize=getattr(settings, 'KPI_EXPRESSION_CACHE_SIZE', 1024),
+)
+
+# Fused programs keyed by the expressions of the KPIs linked to an asset;
+# assets linked to the same KPIs share one
+program_cache = LRUCache(
+    lambda expressions: FusedProgram(
+        expression_cache.get(text) for text in expressions),
+    maxsize=getattr(settings, 'KPI_PROGRAM_CACHE_SIZE', 1024),
+)
+
+
+def load_expression(text, bytecode=None):
+    """The compiled form of ``text``, rebuilt from ``bytecode`` on a miss.
+
+    Current bytecode (see KPI.bytecode) skips lexing, parsing and
+    optimizing; bytecode that is missing, stale or of another format
+    version falls back to compiling the text.
+    """
+    if bytecode is not None and text not in expression_cache:
+        try:
+            compiled = load_compiled(text, bytecode, EVALUATION_BACKEND,
+                                     timed=metrics.stage)
+        except (ValueError, RecursionError):
+            pass
+        else:
+            expression_cache.put(text, compiled)
+            return compiled
+    return expression_cache.get(text)
+
+
+def preload_expressions():
+    """Load the expressions of every KPI into the expression cache.
+
+    Up to the cache's ``maxsize`` distinct expressions are loaded, from
+    their bytecode where it is current, so the first messages of a fresh
+    worker find them compiled. Bytecode that is missing (KPIs from before
+    it was stored) or stale is stored with one bulk_update. Returns how
+    many were loaded.
+    """
+    loaded = 0
+    stale = []
+    rows = (KPI.objects.order_by('-pk')
+            .values_list('pk', 'expression', 'bytecode'))
+    for pk, text, bytecode in rows.iterator():
+        if loaded >= expression_cache.maxsize:
+            break
+        if text in expression_cache:
+            continue
+        try:
+            compiled = load_expression(text, bytecode)
+        except (ValueError, RecursionError):
+            # Saved before validation; the route reports the error
+            continue
+        if compiled.bytecode != bytecode:
+            stale.append(KPI(pk=pk, bytecode=compiled.bytecode))
+        loaded += 1
+    # Bytecode of an expression changed meanwhile is rejected by
+    # load_compiled, and replaced when the KPI is saved
+    KPI.objects.bulk_update(stale, ['bytecode'], batch_size=500)
+    return loaded
+
+
+def cache_stats():
+    return {
+        "expressions": expression_cache.stats(),
+        "patterns": pattern_cache.stats(),
+        "programs": program_cache.stats(),
+        "assets": asset_keys.stats(),
+        "attributes": attribute_keys.stats(),
+        "results": result_memo.stats(),
+    }
+
+
+def evaluate_compiled(compiled, value):
+    """``compiled.evaluate(value)``, from the result memo if possible."""
+    key = result_memo.key(compiled, value)
+    result = result_memo.get(key)
+    if result is MISSING:
+        result = compiled.evaluate(value)
+        result_memo.put(key, result)
+    return result
+
+
 def evaluate_expression(equation, value):
-    equation_with_value = equation.replace("ATTR", str(value))
-    lexer = Lexer(equation_with_value)
-    parser = Parser(lexer)
-    interpreter = Interpreter()
-    tree = parser.parse()
-    return interpreter.interpret(tree)
+    return evaluate_compiled(expression_cache.get(equation), value)
 
 
 def parse_timestamp(timestamp_str):
     """Parse the timestamp from the received format to a valid datetime object."""
+    if isinstance(timestamp_str, datetime):
+        # Already parsed, e.g. a reading replayed from the archive
+        return timestamp_str
+    if not isinstance(timestamp_str, str):
+        raise ValueError(f"Timestamp {timestamp_str!r} is not a string.")
     # Remove "[UTC]" and parse with the format Django expects
     cleaned_timestamp = timestamp_str.replace("[UTC]", "").replace("T", " ").replace("Z", "")
     date_time = datetime.strptime(cleaned_timestamp, "%Y-%m-%d %H:%M:%S")
     return timezone.make_aware(date_time)
 
 
-def evaluate_and_store_result(message, kpi_expression):
+def build_evaluation_result(message, compiled):
+    """Evaluate a message against a compiled KPI; return the unsaved result."""
     asset_id = message.get("asset_id")
     attribute_id = f"output_{message['attribute_id']}"
-    timestamp = parse_timestamp(message["timestamp"])
+    with metrics.stage('timestamp'):
+        timestamp = parse_timestamp(message["timestamp"])
     value = message["value"]
 
-    result_value = evaluate_expression(kpi_expression, value)
+    with metrics.stage('evaluate'):
+        result_value = evaluate_compiled(compiled, value)
 
-    EvaluationResult.objects.create(
-        asset_id=asset_id,
-        attribute_id=attribute_id,
+    return EvaluationResult.build(
+        asset_key=str(asset_id),
+        attribute_key=attribute_id,
         timestamp=timestamp,
-        value=result_value
+        value=result_value,
     )
+
+
+# Columns a stored result is overwritten with by a later evaluation
+RESULT_VALUE_FIELDS = ['value_type', 'numeric_value', 'integer_value',
+                       'bool_value']
+
+
+def store_results(results):
+    """Intern asset/attribute keys and upsert results with one bulk_create.
+
+    A result for a KPI, asset, attribute and timestamp already stored
+    (``unique_result_per_kpi``) is overwritten, so the latest evaluation
+    wins: a multi-attribute KPI re-evaluated because another of its
+    attributes arrived for the same timestamp replaces its stale result.
+    Of equal keys within ``results`` the last one is stored.
+    """
+    if not results:
+        return results
+    with metrics.stage('insert'):
+        asset_ids = asset_keys.ids_for(result.asset_key for result in results)
+        attribute_ids = attribute_keys.ids_for(
+            result.attribute_key for result in results)
+        latest = {}
+        for result in results:
+            result.asset_id = asset_ids[result.asset_key]
+            result.attribute_id = attribute_ids[result.attribute_key]
+            latest[result.asset_id, result.attribute_id, result.timestamp,
+                   result.kpi_id] = result
+        linked = [result for key, result in latest.items()
+                  if key[3] is not None]
+        if linked:
+            EvaluationResult.objects.bulk_create(
+                linked, update_conflicts=True,
+                unique_fields=['asset', 'attribute', 'timestamp', 'kpi'],
+                update_fields=RESULT_VALUE_FIELDS)
+        unlinked = [result for key, result in latest.items()
+                    if key[3] is None]
+        if unlinked:
+            _replace_without_kpi(unlinked)
+        return results
+
+
+def _replace_without_kpi(results):
+    """Store results without a KPI over those stored for the same key.
+
+    Their key is a partial unique constraint (``unique_result_without_kpi``)
+    that ON CONFLICT cannot name, so the stored rows are deleted instead.
+    """
+    keys = Q()
+    for result in results:
+        keys |= Q(asset_id=result.asset_id, attribute_id=result.attribute_id,
+                  timestamp=result.timestamp)
+    with transaction.atomic():
+        EvaluationResult.objects.filter(keys, kpi__isnull=True).delete()
+        EvaluationResult.objects.bulk_create(results)
+
+
+# Results of evaluate requests are stored through this buffer
+result_buffer = ResultBuffer(
+    store_results,
+    enabled=getattr(settings, 'KPI_WRITE_BEHIND', False),
+    durability=getattr(settings, 'KPI_WRITE_BEHIND_DURABILITY', 'flush'),
+    max_rows=getattr(settings, 'KPI_WRITE_BEHIND_MAX_ROWS', 500),
+    max_delay=getattr(settings, 'KPI_WRITE_BEHIND_MAX_DELAY', 0.5),
+    capacity=getattr(settings, 'KPI_WRITE_BEHIND_CAPACITY', 10000),
+)
+
+
+def evaluate_and_store_result(message, kpi_expression):
+    compiled = expression_cache.get(kpi_expression)
+    result_buffer.store([build_evaluation_result(message, compiled)])
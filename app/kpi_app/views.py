@@ -1,8 +1,59 @@
-from .utils import evaluate_and_store_result
-from .models import KPI, KPIAssetLink, EvaluationResult
-from .serializers import KPISerializer, KPIAssetLinkSerializer, EvaluationResultSerializer
+import asyncio
+import json
+from functools import partial
+from asgiref.sync import sync_to_async
+from .utils import cache_stats, expression_cache, result_buffer
+from .interpreter.compiler import parse_expression
+from .interpreter.printer import format_tree
+from .pipeline import (
+    describe_error,
+    evaluate_asset,
+    evaluate_columns,
+    evaluate_message,
+    evaluate_messages,
+    ingest_ndjson,
+)
+from .attributes import attribute_store
+from .columnar import ColumnarBatch
+from .dedup import seen_messages
+from .parsers import ColumnarParser
+from .window_state import window_store
+from .readings import reading_archive
+from .routing import routing_table
+from .concurrency import async_limiter, evaluation_executor
+from .metrics import metrics
+from .models import KPI, EvaluationResult
+from .serializers import (
+    KPISerializer,
+    KPIAssetLinkSerializer,
+    EvaluationResultSerializer,
+    RESULT_VALUE_FIELDS,
+    represent_result_row,
+)
+from .pagination import EvaluationResultPagination
+from django.conf import settings
+from django.db.models import (
+    Avg,
+    Case,
+    Count,
+    F,
+    FloatField,
+    Max,
+    Min,
+    Value,
+    When,
+)
+from django.db.models.functions import TruncDay, TruncHour, TruncMinute
+from django.http import HttpResponse, JsonResponse, StreamingHttpResponse
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+from django.utils.decorators import method_decorator
+from django.views import View
+from django.views.decorators.csrf import csrf_exempt
 from rest_framework import generics, status
+from rest_framework.exceptions import ValidationError
 from rest_framework.response import Response
+from rest_framework.settings import api_settings
 from rest_framework.views import APIView
 
 
@@ -18,6 +69,36 @@ class KPICreateView(generics.CreateAPIView):
     serializer_class = KPISerializer
 
 
+# Show a KPI's parsed and optimized trees
+class KPIExplainView(APIView):
+    def get(self, request, pk):
+        try:
+            kpi = KPI.objects.get(pk=pk)
+        except KPI.DoesNotExist:
+            return Response({"error": "KPI not found"},
+                            status=status.HTTP_404_NOT_FOUND)
+
+        try:
+            tree = parse_expression(kpi.expression,
+                                    getattr(settings, 'KPI_LEXER', 'scan'))
+            compiled = expression_cache.get(kpi.expression)
+        except (ValueError, RecursionError) as error:
+            return Response(
+                {"error": f"Invalid KPI expression: {error}"},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+
+        # ``optimized`` is the tree the evaluation backend actually runs
+        return Response({
+            "id": kpi.pk,
+            "expression": kpi.expression,
+            "backend": compiled.backend,
+            "tree": format_tree(tree),
+            "optimized": format_tree(compiled.tree),
+            "source": compiled.source,
+        }, status=status.HTTP_200_OK)
+
+
 # Link an Asset to a KPI
 class KPIAssetLinkCreateView(APIView):
     def post(self, request):
@@ -25,7 +106,6 @@ class KPIAssetLinkCreateView(APIView):
 
         if serializer.is_valid():
             kpi_id = serializer.validated_data['kpi'].id
-            asset_id = serializer.validated_data['asset_id']
 
             # Check if the KPI with the given ID exists
             try:
@@ -36,20 +116,34 @@ class KPIAssetLinkCreateView(APIView):
                     status=status.HTTP_404_NOT_FOUND
                 )
 
-            # Check if this asset is already linked to any KPI
-            if KPIAssetLink.objects.filter(asset_id=asset_id).exists():
-                return Response(
-                    {"error": "This asset is already linked to another KPI."},
-                    status=status.HTTP_400_BAD_REQUEST
-                )
-
-            # Save the link if validations pass
+            # Save the link if validations pass. An asset can feed any number
+            # of KPIs; the serializer rejects linking the same pair twice
             serializer.save()
             return Response(serializer.data, status=status.HTTP_201_CREATED)
 
         return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
 
 
+def evaluation_summary(results, errors):
+    """Response body for one message evaluated against its linked KPIs."""
+    return {
+        "status": "Evaluation completed",
+        "evaluated": len(results),
+        "duplicates": 0,
+        "errors": [{"kpi": kpi_id, "error": error}
+                   for kpi_id, error in errors],
+    }
+
+
+# Answer to a retried message; it is acknowledged without re-evaluating it
+DUPLICATE_SUMMARY = {
+    "status": "Duplicate message ignored",
+    "evaluated": 0,
+    "duplicates": 1,
+    "errors": [],
+}
+
+
 class EvaluateLinkedAssetsView(APIView):
     def post(self, request):
         # Retrieve the asset ID from the message data
@@ -59,19 +153,280 @@ class EvaluateLinkedAssetsView(APIView):
         if not asset_id:
             return Response({"error": "Asset ID is required in the message data."}, status=status.HTTP_400_BAD_REQUEST)
 
-        # Retrieve the linked KPI based on the asset ID
-        try:
-            link = KPIAssetLink.objects.get(asset_id=asset_id)
-            kpi = link.kpi
-        except KPIAssetLink.DoesNotExist:
+        # Gateway retries are dropped before routing or parsing anything
+        key = seen_messages.message_key(message)
+        if seen_messages.seen(key):
+            return Response(DUPLICATE_SUMMARY, status=status.HTTP_200_OK)
+
+        # Retrieve the linked KPIs from the in-process routing table
+        with metrics.stage('route'):
+            linked = routing_table.route(asset_id)
+        if linked is None:
+            metrics.rejected()
             return Response({"error": "No KPI linked to this asset."}, status=status.HTTP_404_NOT_FOUND)
 
-        # Evaluate and store the result for this asset and linked KPI
-        evaluate_and_store_result(message, kpi.expression)
+        # Evaluate every linked KPI and store their results in one insert.
+        # KPIs combining several attributes only run when one of them changes
+        try:
+            results, errors = evaluate_message(linked, message)
+        except KeyError as error:
+            metrics.rejected()
+            return Response(
+                {"error": f"Missing field {error} in the message data."},
+                status=status.HTTP_400_BAD_REQUEST)
+        except (ValueError, TypeError) as error:
+            metrics.rejected()
+            return Response({"error": str(error)},
+                            status=status.HTTP_400_BAD_REQUEST)
+        result_buffer.store(results, partial(seen_messages.remember, [key]))
+
+        return Response(evaluation_summary(results, errors),
+                        status=status.HTTP_200_OK)
+
+
+# DRF views are synchronous, so the async endpoint is a plain Django view
+@method_decorator(csrf_exempt, name='dispatch')
+class AsyncEvaluateView(View):
+    async def post(self, request):
+        # Shed load instead of queueing when too many evaluations are running
+        if not async_limiter.try_acquire():
+            response = JsonResponse(
+                {"error": "Too many evaluations in flight."}, status=503)
+            response["Retry-After"] = "1"
+            return response
+        try:
+            return await self.evaluate(request)
+        finally:
+            async_limiter.release()
+
+    async def evaluate(self, request):
+        try:
+            message = json.loads(request.body).get("message", {})
+            asset_id = message.get("asset_id")
+        except (ValueError, AttributeError):
+            return JsonResponse({"error": "Invalid JSON message."}, status=400)
+
+        if not asset_id:
+            return JsonResponse(
+                {"error": "Asset ID is required in the message data."},
+                status=400)
+
+        key = seen_messages.message_key(message)
+        if seen_messages.seen(key):
+            return JsonResponse(DUPLICATE_SUMMARY, status=200)
+
+        with metrics.stage('route'):
+            linked = await routing_table.aroute(asset_id)
+        if linked is None:
+            metrics.rejected()
+            return JsonResponse({"error": "No KPI linked to this asset."},
+                                status=404)
+
+        try:
+            if linked.needs_state:
+                # Attribute and window state is read and saved through the
+                # ORM as well
+                results, errors = await sync_to_async(evaluate_message)(
+                    linked, message)
+            else:
+                # Expression evaluation is CPU-bound; keep it off the event
+                # loop
+                archive = reading_archive.collector()
+                loop = asyncio.get_running_loop()
+                results, errors = await loop.run_in_executor(
+                    evaluation_executor, evaluate_asset, linked, message, None,
+                    [], {}, archive
+                )
+                await sync_to_async(reading_archive.save)(archive)
+        except KeyError as error:
+            metrics.rejected()
+            return JsonResponse(
+                {"error": f"Missing field {error} in the message data."},
+                status=400)
+        except (ValueError, TypeError) as error:
+            metrics.rejected()
+            return JsonResponse({"error": str(error)}, status=400)
+        # Key interning and the insert are plain ORM calls; run them the way
+        # Django's async ORM methods do
+        await sync_to_async(result_buffer.store)(
+            results, partial(seen_messages.remember, [key]))
+
+        return JsonResponse(evaluation_summary(results, errors), status=200)
 
-        return Response({"status": "Evaluation completed"}, status=status.HTTP_200_OK)
+
+class EvaluateBatchView(APIView):
+    # A body of the binary columnar format (see columnar.py) is accepted
+    # besides {"messages": [...]}; its errors are indexed by row
+    parser_classes = [*api_settings.DEFAULT_PARSER_CLASSES, ColumnarParser]
+
+    def post(self, request):
+        accepted = []
+        if isinstance(request.data, ColumnarBatch):
+            results, errors, duplicates = evaluate_columns(request.data,
+                                                           accepted)
+        else:
+            messages = None
+            if isinstance(request.data, dict):
+                messages = request.data.get("messages")
+
+            if not isinstance(messages, list):
+                return Response({"error": "A list of messages is required."},
+                                status=status.HTTP_400_BAD_REQUEST)
+
+            # All uncached asset -> KPI links are resolved with a single query
+            results, errors, duplicates = evaluate_messages(
+                list(enumerate(messages)), accepted)
+        result_buffer.store(results, partial(seen_messages.remember, accepted))
+
+        return Response({
+            "evaluated": len(results),
+            "duplicates": duplicates,
+            "errors": [describe_error("index", *error) for error in errors],
+        }, status=status.HTTP_200_OK)
+
+
+@method_decorator(csrf_exempt, name='dispatch')
+class EvaluateStreamView(View):
+    def post(self, request):
+        if request.content_type != "application/x-ndjson":
+            return JsonResponse(
+                {"error": "Expected an application/x-ndjson body."},
+                status=415)
+
+        # Iterating the request reads the body line by line from the socket
+        # instead of loading the whole upload into memory
+        chunk_size = getattr(settings, 'KPI_NDJSON_CHUNK_SIZE', 500)
+        return StreamingHttpResponse(
+            ingest_ndjson(request, chunk_size),
+            content_type="application/x-ndjson"
+        )
+
+
+def parse_time_param(params, name):
+    """Read an ISO 8601 query parameter as an aware datetime."""
+    raw = params.get(name)
+    if raw is None:
+        return None
+    value = parse_datetime(raw)
+    if value is None:
+        raise ValidationError({name: "Expected an ISO 8601 datetime."})
+    if timezone.is_naive(value):
+        value = timezone.make_aware(value)
+    return value
+
+
+# Numeric view of a result for aggregation; booleans count as 0/1
+NUMBER = Case(
+    When(value_type=EvaluationResult.BOOLEAN, bool_value=True,
+         then=Value(1.0)),
+    When(value_type=EvaluationResult.BOOLEAN, bool_value=False,
+         then=Value(0.0)),
+    default=F('numeric_value'),
+    output_field=FloatField(),
+)
+
+# Supported aggregation bucket sizes
+BUCKETS = {
+    '1m': TruncMinute,
+    '1h': TruncHour,
+    '1d': TruncDay,
+}
+
+
+def filter_results(queryset, params):
+    """Apply the asset/attribute/KPI/time-range query parameters."""
+    if "asset_id" in params:
+        queryset = queryset.filter(asset__key=params["asset_id"])
+    if "attribute_id" in params:
+        queryset = queryset.filter(attribute__key=params["attribute_id"])
+    if "kpi" in params:
+        if not params["kpi"].isdecimal():
+            raise ValidationError({"kpi": "Expected a KPI id."})
+        queryset = queryset.filter(kpi_id=int(params["kpi"]))
+
+    start = parse_time_param(params, "start")
+    if start:
+        queryset = queryset.filter(timestamp__gte=start)
+    end = parse_time_param(params, "end")
+    if end:
+        queryset = queryset.filter(timestamp__lt=end)
+    return queryset
 
 
 class EvaluationResultListView(generics.ListAPIView):
-    queryset = EvaluationResult.objects.all()
     serializer_class = EvaluationResultSerializer
+    pagination_class = EvaluationResultPagination
+
+    def get_queryset(self):
+        return filter_results(EvaluationResult.objects.all(),
+                              self.request.query_params)
+
+    def list(self, request, *args, **kwargs):
+        # Plain dicts from .values() skip model and serializer instantiation
+        rows = self.get_queryset().values(*RESULT_VALUE_FIELDS)
+        page = self.paginate_queryset(rows)
+        return self.get_paginated_response(
+            [represent_result_row(row) for row in page])
+
+
+class EvaluationAggregateView(APIView):
+    def get(self, request):
+        bucket = request.query_params.get("bucket", "1h")
+        if bucket not in BUCKETS:
+            return Response(
+                {"error": f"bucket must be one of {', '.join(BUCKETS)}."},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+
+        # Bucketing and aggregation both run in SQL; only one row per
+        # series (asset, attribute and KPI) and bucket comes back, as an
+        # asset's KPIs and attributes are unrelated series
+        rows = (
+            filter_results(EvaluationResult.objects.all(),
+                           request.query_params)
+            .annotate(bucket=BUCKETS[bucket]('timestamp'), number=NUMBER)
+            .values('asset__key', 'attribute__key', 'kpi', 'bucket')
+            .annotate(
+                min=Min('number'),
+                max=Max('number'),
+                avg=Avg('number'),
+                count=Count('number'),
+            )
+            .order_by('asset__key', 'attribute__key', 'kpi', 'bucket')
+        )
+        return Response([
+            {"asset_id": row.pop("asset__key"),
+             "attribute_id": row.pop("attribute__key"), **row}
+            for row in rows
+        ], status=status.HTTP_200_OK)
+
+
+def process_cache_stats():
+    """Statistics of every in-process cache, keyed by cache name."""
+    stats = cache_stats()
+    stats["routes"] = routing_table.stats()
+    stats["attribute_state"] = attribute_store.stats()
+    stats["window_state"] = window_store.stats()
+    stats["seen_messages"] = seen_messages.stats()
+    return stats
+
+
+class CacheStatsView(APIView):
+    def get(self, request):
+        stats = process_cache_stats()
+        stats["async_evaluations"] = async_limiter.stats()
+        stats["result_buffer"] = result_buffer.stats()
+        return Response(stats, status=status.HTTP_200_OK)
+
+
+class MetricsView(View):
+    """Per-process latencies, KPI counters and cache hits for Prometheus."""
+
+    def get(self, request):
+        if not metrics.enabled:
+            return JsonResponse(
+                {"error": "Metrics are disabled (KPI_METRICS_ENABLED)."},
+                status=404)
+        return HttpResponse(
+            metrics.render(process_cache_stats()),
+            content_type="text/plain; version=0.0.4; charset=utf-8")
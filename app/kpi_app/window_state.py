@@ -0,0 +1,152 @@
+import time
+from threading import Lock
+from django.conf import settings
+from django.utils import timezone
+from .interning import asset_keys, attribute_keys
+from .interpreter.cache import LRUCache
+from .interpreter.windows import WindowState
+from .models import KPI, WindowCheckpoint
+
+
+class WindowStore:
+    """WindowState per asset, KPI and result series, checkpointed to the DB.
+
+    The series is the attribute key results are stored under, so an
+    ATTR-only KPI keeps separate windows for each attribute of an asset.
+
+    States live in an in-process LRU. Every state touched since the last
+    checkpoint is remembered until ``checkpoint_if_due`` writes it, at most
+    once per ``checkpoint_interval`` seconds, so evicting a state cannot
+    lose updates. A state missing from memory is restored from its
+    checkpoint, which is how a restarted worker resumes its windows
+    without reading result history.
+    """
+
+    def __init__(self, maxsize=10000, checkpoint_interval=10.0):
+        self.checkpoint_interval = checkpoint_interval
+        self._states = LRUCache(None, maxsize=maxsize)
+        self._dirty = {}
+        self._lock = Lock()
+        self._checkpointed_at = time.monotonic()
+
+    @staticmethod
+    def _key(asset_id, series, route):
+        return (str(asset_id), route.kpi_id, series)
+
+    def _fresh(self, key, route, checkpoints):
+        state = WindowState(route.expression, route.compiled.windows)
+        checkpoint = checkpoints.get(key)
+        if checkpoint is not None and checkpoint[0] == route.expression:
+            try:
+                state.restore(checkpoint[1])
+            except (ValueError, TypeError, KeyError, IndexError):
+                state = WindowState(route.expression, route.compiled.windows)
+        return state
+
+    @staticmethod
+    def _checkpoints(keys):
+        rows = (WindowCheckpoint.objects
+                .filter(asset__key__in={key[0] for key in keys},
+                        kpi_id__in={key[1] for key in keys},
+                        attribute__key__in={key[2] for key in keys})
+                .values_list('asset__key', 'kpi_id', 'attribute__key',
+                             'expression', 'state'))
+        return {(asset_id, kpi_id, series): (expression, state)
+                for asset_id, kpi_id, series, expression, state in rows}
+
+    def _cached(self, key, route):
+        state = self._states.peek(key)
+        if state is None:
+            with self._lock:
+                state = self._dirty.get(key)
+        if state is not None and state.expression == route.expression:
+            return state
+        return None
+
+    def states_for(self, entries):
+        """Return ``{(asset_id, kpi_id, series): WindowState}``.
+
+        ``entries`` are ``(asset_id, series, route)`` triples. Checkpoints
+        of all states missing from memory are read in one query, and every
+        returned state is marked for the next checkpoint.
+        """
+        states = {}
+        missing = {}
+        for asset_id, series, route in entries:
+            key = self._key(asset_id, series, route)
+            state = self._cached(key, route)
+            if state is None:
+                missing[key] = route
+            else:
+                states[key] = state
+
+        if missing:
+            checkpoints = self._checkpoints(list(missing))
+            for key, route in missing.items():
+                states[key] = self._fresh(key, route, checkpoints)
+                self._states.put(key, states[key])
+
+        with self._lock:
+            self._dirty.update(states)
+        return states
+
+    def state_for(self, asset_id, series, route):
+        key = self._key(asset_id, series, route)
+        return self.states_for([(asset_id, series, route)])[key]
+
+    def checkpoint_if_due(self):
+        elapsed = time.monotonic() - self._checkpointed_at
+        if elapsed >= self.checkpoint_interval:
+            self.checkpoint()
+
+    def checkpoint(self):
+        """Write every state touched since the last checkpoint."""
+        with self._lock:
+            dirty, self._dirty = self._dirty, {}
+            self._checkpointed_at = time.monotonic()
+        if not dirty:
+            return
+
+        # KPIs deleted since their state was touched have nothing to keep
+        live = set(KPI.objects.filter(pk__in={key[1] for key in dirty})
+                   .values_list('pk', flat=True))
+        asset_ids = asset_keys.ids_for(key[0] for key in dirty)
+        attribute_ids = attribute_keys.ids_for(key[2] for key in dirty)
+        now = timezone.now()
+        checkpoints = []
+        for (asset_id, kpi_id, series), state in dirty.items():
+            if kpi_id not in live:
+                continue
+            with state.lock:
+                dumped = state.dump()
+            checkpoints.append(WindowCheckpoint(
+                asset_id=asset_ids[asset_id],
+                kpi_id=kpi_id,
+                attribute_id=attribute_ids[series],
+                expression=state.expression,
+                state=dumped,
+                updated_at=now,
+            ))
+        WindowCheckpoint.objects.bulk_create(
+            checkpoints,
+            update_conflicts=True,
+            unique_fields=['asset', 'kpi', 'attribute'],
+            update_fields=['expression', 'state', 'updated_at'],
+        )
+
+    def clear(self):
+        self._states.clear()
+        with self._lock:
+            self._dirty.clear()
+
+    def stats(self):
+        stats = self._states.stats()
+        stats["pending_checkpoint"] = len(self._dirty)
+        return stats
+
+
+window_store = WindowStore(
+    maxsize=getattr(settings, 'KPI_WINDOW_STATE_SIZE', 10000),
+    checkpoint_interval=getattr(settings, 'KPI_WINDOW_CHECKPOINT_INTERVAL',
+                                10.0),
+)
@@ -0,0 +1,207 @@
+import atexit
+import logging
+import time
+from threading import Condition, Lock, Thread
+from django.db import connections
+from .metrics import metrics
+
+
+logger = logging.getLogger(__name__)
+
+DURABILITY_FLUSH = 'flush'
+DURABILITY_ENQUEUE = 'enqueue'
+
+
+class _Batch:
+    """Results of one ``store`` call waiting in the buffer."""
+    __slots__ = ("results", "written", "queued_at", "done", "error")
+
+    def __init__(self, results, written):
+        self.results = results
+        self.written = written
+        self.queued_at = time.monotonic()
+        self.done = False
+        self.error = None
+
+
+class ResultBuffer:
+    """Write-behind buffer coalescing result inserts into few bulk_creates.
+
+    Disabled, ``store`` writes through ``writer`` (``store_results``)
+    straight away. Enabled, results are queued and written together, which
+    ``durability`` acknowledges in one of two ways:
+
+    ``'flush'``: ``store`` returns once its results are written. Callers
+    queue up behind the one currently writing, and the next of them writes
+    everything queued meanwhile with one insert, so concurrent requests
+    share a commit (group commit) and write errors reach the caller.
+    Nothing waits for ``max_rows`` or ``max_delay``: a caller that finds
+    no write in progress writes its own results straight away, so at low
+    load this is one synchronous write per call.
+
+    ``'enqueue'``: ``store`` returns as soon as the results are queued. A
+    background thread writes them once ``max_rows`` are pending or the
+    oldest has waited ``max_delay`` seconds, and at interpreter exit.
+    Results queued when the process dies are lost, and a failed write is
+    logged and counted instead of being reported to the client.
+
+    At most ``capacity`` rows are held: a ``store`` that would exceed it
+    writes the pending results itself first, which slows producers down
+    to the speed of the database instead of growing the buffer.
+    """
+
+    def __init__(self, writer, enabled=False, durability=DURABILITY_FLUSH,
+                 max_rows=500, max_delay=0.5, capacity=10000):
+        if durability not in (DURABILITY_FLUSH, DURABILITY_ENQUEUE):
+            raise ValueError(f"Unknown result durability {durability!r}.")
+        self.writer = writer
+        self.enabled = enabled
+        self.durability = durability
+        self.max_rows = max_rows
+        self.max_delay = max_delay
+        self.capacity = capacity
+        self._pending = []
+        self._pending_rows = 0
+        # Held while writing, so batches are written one at a time and in order
+        self._flush_lock = Lock()
+        self._condition = Condition()
+        self._thread = None
+        self._closed = False
+        self.flushes = 0
+        self.flushed_rows = 0
+        self.largest_flush = 0
+        self.last_lag = 0.0
+        self.max_lag = 0.0
+        self.backpressure = 0
+        self.failed_rows = 0
+
+    def store(self, results, written=None):
+        """Store unsaved EvaluationResults according to the durability.
+
+        ``written`` is called once the results are written, and not at all
+        if writing them fails; with ``'enqueue'`` that is after ``store``
+        has returned, on the writer thread.
+        """
+        if not results or not self.enabled:
+            if results:
+                self.writer(results)
+            if written is not None:
+                written()
+            return
+
+        batch = _Batch(results, written)
+        with self._condition:
+            full = self._pending_rows + len(results) > self.capacity
+            if full:
+                self.backpressure += 1
+                metrics.backpressure()
+        if full:
+            self.flush()
+        with self._condition:
+            self._pending.append(batch)
+            self._pending_rows += len(results)
+            # Wakes the writer to flush or to set its deadline
+            self._condition.notify()
+
+        if self.durability == DURABILITY_FLUSH or not self._start():
+            self._wait(batch)
+
+    def _wait(self, batch):
+        with self._flush_lock:
+            # A caller that wrote before us may have taken our batch along
+            if not batch.done:
+                self._flush_locked()
+        if batch.error is not None:
+            raise batch.error
+
+    def flush(self):
+        """Write everything queued so far."""
+        with self._flush_lock:
+            self._flush_locked()
+
+    def _flush_locked(self):
+        with self._condition:
+            batches, self._pending = self._pending, []
+            self._pending_rows = 0
+            self._condition.notify_all()
+        if not batches:
+            return
+
+        results = [result for batch in batches for result in batch.results]
+        error = None
+        try:
+            self.writer(results)
+        except Exception as exc:
+            error = exc
+            self.failed_rows += len(results)
+            if self.durability == DURABILITY_ENQUEUE:
+                logger.exception("Dropped %d buffered result(s)", len(results))
+        else:
+            lag = time.monotonic() - batches[0].queued_at
+            self.flushes += 1
+            self.flushed_rows += len(results)
+            self.largest_flush = max(self.largest_flush, len(results))
+            self.last_lag = lag
+            self.max_lag = max(self.max_lag, lag)
+            metrics.flushed(len(results), lag)
+        for batch in batches:
+            batch.error = error
+            batch.done = True
+            if error is None and batch.written is not None:
+                batch.written()
+
+    def _start(self):
+        """Make sure the background writer runs; False once closed."""
+        with self._condition:
+            if self._closed:
+                return False
+            if self._thread is None:
+                self._thread = Thread(target=self._run,
+                                      name='kpi-result-writer', daemon=True)
+                self._thread.start()
+                atexit.register(self.close)
+            return True
+
+    def _due(self):
+        if not self._pending:
+            return None
+        if self._pending_rows >= self.max_rows or self._closed:
+            return 0
+        return self._pending[0].queued_at + self.max_delay - time.monotonic()
+
+    def _run(self):
+        try:
+            while True:
+                with self._condition:
+                    while (wait := self._due()) is None or wait > 0:
+                        if self._closed and wait is None:
+                            return
+                        self._condition.wait(wait)
+                self.flush()
+        finally:
+            connections.close_all()
+
+    def close(self):
+        """Stop the background writer after it has written what is queued."""
+        with self._condition:
+            self._closed = True
+            self._condition.notify_all()
+            thread = self._thread
+        if thread is not None:
+            thread.join()
+        self.flush()
+
+    def stats(self):
+        return {
+            "enabled": self.enabled,
+            "durability": self.durability,
+            "pending": self._pending_rows,
+            "capacity": self.capacity,
+            "flushes": self.flushes,
+            "flushed_rows": self.flushed_rows,
+            "largest_flush": self.largest_flush,
+            "last_lag": self.last_lag,
+            "max_lag": self.max_lag,
+            "backpressure": self.backpressure,
+            "failed_rows": self.failed_rows,
+        }
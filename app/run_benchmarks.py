@@ -0,0 +1,14 @@
+#!/usr/bin/env python
+"""Run the KPI benchmark suite; takes the options of `manage.py benchmark`."""
+import os
+import sys
+
+
+def main():
+    os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'app.settings')
+    from django.core.management import execute_from_command_line
+    execute_from_command_line([sys.argv[0], 'benchmark', *sys.argv[1:]])
+
+
+if __name__ == '__main__':
+    main()